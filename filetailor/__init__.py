@@ -0,0 +1,6 @@
+def __getattr__(name):
+    # Import the session only when used, so the command line starts quickly
+    if name in ['Session', 'SessionError']:
+        import filetailor.session  # pylint: disable=import-outside-toplevel
+        return getattr(filetailor.session, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
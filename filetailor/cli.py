@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""Command line of filetailor. Calls other helper functions to load configs and
+YAML. Calls other core functions to modify files and YAML.
+"""
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+import filetailor.config as ftconfig
+import filetailor.helpers.runs
+from filetailor.helpers import load_ini_files
+from filetailor.helpers.get_device_id import main as get_device_id
+from filetailor.helpers.get_hostname import main as get_hostname
+
+# Core modules (and the YAML libraries they use) are imported by the
+# function calling them, so commands only load what they use
+# pylint: disable=import-outside-toplevel
+
+
+# PARSERS
+
+class VersionAction(argparse.Action):
+    """Print the version, looked up only when asked for since it is slow"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from importlib.metadata import version
+        parser.exit(message=f'{parser.prog} {version("filetailor")}\n')
+
+
+def update_parser_all(parser, config_ini):
+    """Adds arguments to the parser"""
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='suppress all output not requiring user input')
+    parser.add_argument('-y', '--assumeyes', action='store_true',
+                        help='suppress all output requiring user input by '
+                        + 'assuming yes')
+    if config_ini['DEFAULT'].get('testing', False):
+        parser.add_argument('--debug', action='store_true',
+                            help='display debug info')
+        parser.add_argument('--test', action='store_true',
+                            help='use test YAML, sync, and files')
+    return parser
+
+
+def update_parser_sync(parser, environment):
+    """Adds arguments to the backup and restore parsers"""
+    parser = update_parser_all(parser, environment)
+    parser.add_argument('FILES', nargs='*',
+                        help='files to interact on as specified in YAML, '
+                        + 'defaults to all files for device')
+    parser.add_argument('-d', '--device', default=get_hostname(),
+                        help='specify device name to use, defaults to '
+                        + 'current hostname')
+    parser.add_argument('--no-diff', action='store_true',
+                        help='suppress diff output')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='do not modify any files')
+    parser.add_argument('--sudo', action='store_true',
+                        help='use "sudo" when copying/creating files')
+    parser.add_argument('--max-rate', metavar='RATE',
+                        help='limit reads and writes to RATE bytes per '
+                        + 'second, such as "20M"')
+    parser.add_argument('--max-iops', metavar='N',
+                        help='limit reads and writes to N per second')
+    parser.add_argument('--idle', action='store_true',
+                        help='only use CPU and disk time other processes '
+                        + 'leave idle')
+    return parser
+
+
+def update_parser_sync_restore(parser, environment):
+    """Adds arguments to the restore parser"""
+    parser = update_parser_sync(parser, environment)
+    parser.add_argument('--staging',
+                        help='store files to staging directory instead of '
+                        + 'local files')
+    return parser
+
+
+def update_parser_yaml_modify(parser):
+    """Adds arguments to the add and remove parsers"""
+    parser.add_argument('-d', '--device', default=get_hostname(),
+                        help='specify device name to use, defaults to current '
+                        + 'hostname')
+    parser.add_argument('--no-diff', action='store_true')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='do not modify any files')
+
+    return parser
+
+
+# YAML
+
+def prep_yaml():
+    """Find filetailor.ini, read it, then load YAML"""
+    import filetailor.helpers.load_yaml
+
+    if 'test' in ARGS and ARGS.test:
+        # Use test locations
+        logging.debug('Using test config')
+        paths = {'sync_dir': './tests/sync', 'yaml_dir': './tests/yaml'}
+    else:
+        # Load YAML
+        logging.debug('Using production config')
+        filetailor_ini_path = load_ini_files.find_filetailor_ini()
+        if not os.path.isfile(filetailor_ini_path):
+            print('ERROR: "filetailor.ini" not found at '
+                  + f'"{filetailor_ini_path}".')
+            print('Fix the path or run "filetailor init" to generate a new '
+                  + 'INI file.')
+            sys.exit()
+        filetailor_ini = load_ini_files.read_filetailor_ini(
+            filetailor_ini_path)
+        paths = filetailor_ini['PATHS']
+
+        # Check directories exist
+        for key in paths:
+
+            if key not in ['sync_dir', 'yaml', 'in-progress_dir']:
+                continue
+
+            # Convert to Path type
+            os_path = Path(paths[key])
+
+            # Check if directory exists
+            if not os.path.exists(os_path):
+                print(f'ERROR: "{os_path}" does not exist ({key}). '
+                      + 'Run "filetailor init" to create.')
+                sys.exit()
+
+        # Load YAML
+        logging.debug('Loading YAML')
+        (yaml_default, yaml_devices,
+            yaml_files) = filetailor.helpers.load_yaml.main(paths)
+        ftconfig.yaml_default = yaml_default
+        ftconfig.yaml_devices = yaml_devices
+        ftconfig.yaml_files = yaml_files
+
+    ftconfig.paths = paths
+    ftconfig.tools = filetailor_ini['TOOLS']
+    if 'SNAPSHOTS' in filetailor_ini:
+        ftconfig.snapshots = filetailor_ini['SNAPSHOTS']
+    if 'STORE' in filetailor_ini:
+        ftconfig.store = filetailor_ini['STORE']
+    if 'device' in ARGS:
+        ftconfig.device_id = get_device_id(yaml_devices, ARGS.device)
+
+
+# CORE FUNCTIONS
+
+def call_init():
+    """Create filetailor.ini or create sync_dir and yaml"""
+    import filetailor.core.initialize
+    filetailor.core.initialize.main()
+
+
+def call_sync_status():
+    """Display status of local files in comparison to the sync directory"""
+    import filetailor.core.summary
+    if ARGS.cached:
+        filetailor.core.summary.show_cached(ARGS.device)
+        return
+    import filetailor.core.sync
+    logging.debug('Calling sync:status')
+    ftconfig.sync = 'status'
+    prep_yaml()
+    filetailor.core.sync.status()
+
+
+def call_sync_backup():
+    """Copy files from local machine to sync_dir"""
+    import filetailor.core.summary
+    import filetailor.core.sync
+    logging.debug('Calling sync:backup')
+    ftconfig.sync = 'backup'
+    prep_yaml()
+    if not ARGS.dry_run:
+        filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.sync.backup()
+    if not ARGS.dry_run:
+        # Update the summary for `status --cached`
+        filetailor.core.summary.refresh(ARGS.device)
+
+
+def call_sync_restore():
+    """Copy files from sync_dir to local machine"""
+    import filetailor.core.summary
+    import filetailor.core.sync
+    logging.debug('Calling sync:restore')
+    ftconfig.sync = 'restore'
+    prep_yaml()
+    if not ARGS.dry_run:
+        filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.sync.restore()
+    if not ARGS.dry_run and not ARGS.staging:
+        # Update the summary for `status --cached`
+        filetailor.core.summary.refresh(ARGS.device)
+
+
+def call_plan():
+    """Save the actions a restore would take to a plan file"""
+    import filetailor.core.plan
+    logging.debug('Calling plan')
+    ftconfig.sync = 'plan'
+    prep_yaml()
+    filetailor.core.plan.plan()
+
+
+def call_apply():
+    """Apply a plan file created by `filetailor plan`"""
+    import filetailor.core.plan
+    logging.debug('Calling apply')
+    ftconfig.sync = 'restore'
+    prep_yaml()
+    filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.plan.apply()
+
+
+def call_render():
+    """Render tailored files for many devices into staging directories"""
+    import filetailor.core.render
+    logging.debug('Calling render')
+    ftconfig.sync = 'restore'
+    prep_yaml()
+    filetailor.core.render.main()
+
+
+def call_export():
+    """Stream files tailored for a device into a tar archive"""
+    import filetailor.core.export
+    logging.debug('Calling export')
+    ftconfig.sync = 'restore'
+    prep_yaml()
+    filetailor.core.export.main()
+
+
+def call_rollback():
+    """Put local files back as they were before a restore"""
+    import filetailor.core.snapshot
+    logging.debug('Calling rollback')
+    ftconfig.sync = 'restore'
+    prep_yaml()
+    filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.snapshot.rollback()
+
+
+def call_yaml_add():
+    """Add file location to YAML for backup/restore"""
+    import filetailor.core.update_yaml
+    prep_yaml()
+    filetailor.core.update_yaml.main('add')
+
+
+def call_yaml_remove():
+    """Remove file location from YAML for backup/restore"""
+    import filetailor.core.update_yaml
+    prep_yaml()
+    filetailor.core.update_yaml.main('remove')
+
+
+def call_clean():
+    """Remove files from sync_dir that are no longer defined in YAML"""
+    import filetailor.core.clean
+    prep_yaml()
+    filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.clean.main()
+
+
+def call_fsck():
+    """Check files in sync_dir against the manifest of their contents"""
+    import filetailor.core.fsck
+    prep_yaml()
+    filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.fsck.main()
+
+
+def call_migrate():
+    """Copy files in sync_dir into the SQLite database"""
+    import filetailor.core.store
+    prep_yaml()
+    if not ARGS.dry_run:
+        filetailor.helpers.runs.lock_sync_dir()
+    filetailor.core.store.migrate()
+
+
+def call_uninstall():
+    """Delete filetailor directories"""
+    import filetailor.core.uninstall
+    filetailor.core.uninstall.main()
+
+
+def call_paths():
+    """Show filetailor paths"""
+    import filetailor.core.paths
+    prep_yaml()
+    filetailor.core.paths.main()
+
+
+def main():
+    """Create argparse parsers, update variables, and call the core function as
+    defined by the user arguments
+    """
+
+    # Get path to data directory
+    ftconfig.data = os.path.join(os.path.dirname(__file__), 'data')
+
+    # Load config.ini
+    config_ini = load_ini_files.load_config_ini()
+    override_filetailor_ini_path = config_ini['DEFAULT'].get(
+        'override_filetailor_ini_path', '')
+    ftconfig.override_filetailor_ini_path = override_filetailor_ini_path
+
+    # Generate main parser
+    parser = argparse.ArgumentParser(
+        description=('Peer-based configuration management utility with a high'
+                     ' level of file content control.'))
+    parser = update_parser_all(parser, config_ini)
+    parser.add_argument('--version', action=VersionAction, nargs=0)
+    subparsers = parser.add_subparsers(
+        help='commands executing various aspects of filetailor')
+
+    # Generate subparsers
+
+    # Parser: init
+    parser_init = subparsers.add_parser(
+        'init',
+        help='initialize new directories for sync')
+    parser_init = update_parser_all(parser_init, config_ini)
+    parser_init.set_defaults(func=call_init)
+
+    # Parser: status
+    parser_sync_status = subparsers.add_parser(
+        'status',
+        help='display status of local files in comparison to the sync directory')
+    parser_sync_status = update_parser_sync(parser_sync_status, config_ini)
+    parser_sync_status.add_argument(
+        '--cached', action='store_true',
+        help='show counts saved by the last status run, for shell prompts')
+    parser_sync_status.add_argument(
+        '--since', metavar='REV',
+        help='only check files changed in the sync directory since git '
+        + 'revision REV')
+    # Used by background refreshes, which must not run scripts unasked
+    parser_sync_status.add_argument('--no-scripts', action='store_true',
+                                    help=argparse.SUPPRESS)
+    parser_sync_status.set_defaults(func=call_sync_status)
+
+    # Parser: backup
+    parser_sync_backup = subparsers.add_parser(
+        'backup',
+        help='copy files from local device to sync directory')
+    parser_sync_backup = update_parser_sync(parser_sync_backup, config_ini)
+    parser_sync_backup.add_argument(
+        '--verify', action='store_true',
+        help='hash files as they are copied and check the copies')
+    parser_sync_backup.add_argument(
+        '--resume', action='store_true',
+        help='continue an interrupted backup, skipping files it finished and '
+        + 'reusing its answers')
+    parser_sync_backup.set_defaults(func=call_sync_backup)
+
+    # Parser: restore
+    parser_sync_restore = subparsers.add_parser(
+        'restore',
+        help='copy files from sync directory to local device')
+    parser_sync_restore.add_argument('--no-backup', action='store_true')
+    parser_sync_restore = update_parser_sync_restore(parser_sync_restore, config_ini)
+    parser_sync_restore.add_argument(
+        '--verify', action='store_true',
+        help='hash files as they are copied and check the copies')
+    parser_sync_restore.add_argument(
+        '--resume', action='store_true',
+        help='continue an interrupted restore, skipping files it finished and '
+        + 'reusing its answers')
+    parser_sync_restore.set_defaults(func=call_sync_restore)
+
+    # Parser: plan
+    parser_plan = subparsers.add_parser(
+        'plan',
+        help='save the actions a restore would take to a plan file')
+    parser_plan.add_argument('--no-backup', action='store_true')
+    parser_plan = update_parser_all(parser_plan, config_ini)
+    parser_plan.add_argument('FILES', nargs='*',
+                             help='files to plan as specified in YAML, '
+                             + 'defaults to all files for device')
+    parser_plan.add_argument('-d', '--device', default=get_hostname(),
+                             help='specify device name to use, defaults to '
+                             + 'current hostname')
+    parser_plan.add_argument('--staging',
+                             help='plan for staging directory instead of '
+                             + 'local files')
+    parser_plan.add_argument('-o', '--output', required=True,
+                             help='path to save the plan to')
+    parser_plan.set_defaults(func=call_plan)
+
+    # Parser: apply
+    parser_apply = subparsers.add_parser(
+        'apply',
+        help='apply a plan file created by "filetailor plan"')
+    parser_apply = update_parser_all(parser_apply, config_ini)
+    parser_apply.add_argument('PLAN', help='plan file to apply')
+    parser_apply.add_argument('--dry-run', action='store_true',
+                              help='do not modify any files')
+    parser_apply.set_defaults(func=call_apply)
+
+    # Parser: render
+    parser_render = subparsers.add_parser(
+        'render',
+        help='save files from sync directory as restored to each device')
+    parser_render = update_parser_all(parser_render, config_ini)
+    parser_render.add_argument('FILES', nargs='*',
+                               help='files to render as specified in YAML, '
+                               + 'defaults to all files')
+    parser_render.add_argument('--devices', nargs='+', default=['all'],
+                               help='device names to render for, defaults '
+                               + 'to "all" devices in YAML')
+    parser_render.add_argument('--out', required=True,
+                               help='directory to save files to, in '
+                               + '"OUT/DEVICE_ID/FILE_ID/filename"')
+    parser_render.set_defaults(func=call_render)
+
+    # Parser: export
+    parser_export = subparsers.add_parser(
+        'export',
+        help='write files from sync directory as restored to a device into '
+        + 'a tar archive')
+    parser_export = update_parser_all(parser_export, config_ini)
+    parser_export.add_argument('-o', '--output', default='-',
+                               help='archive to write, defaults to "-" for '
+                               + 'stdout')
+    parser_export.add_argument('FILES', nargs='*',
+                               help='files to export as specified in YAML, '
+                               + 'defaults to all files for device')
+    parser_export.add_argument('-d', '--device', default=get_hostname(),
+                               help='specify device name to use, defaults to '
+                               + 'current hostname')
+    parser_export.add_argument('--format', choices=['tar', 'tar.gz'],
+                               default='tar', help='archive format')
+    parser_export.set_defaults(func=call_export)
+
+    # Parser: rollback
+    parser_rollback = subparsers.add_parser(
+        'rollback',
+        help='put local files back as they were before a restore')
+    parser_rollback = update_parser_all(parser_rollback, config_ini)
+    parser_rollback.add_argument('RUN_ID', nargs='?',
+                                 help='snapshot to roll back to, lists '
+                                 + 'snapshots if omitted')
+    parser_rollback.add_argument('--dry-run', action='store_true',
+                                 help='do not modify any files')
+    parser_rollback.set_defaults(func=call_rollback)
+
+    # Parser: yaml:add
+    parser_yaml_add = subparsers.add_parser(
+        'add',
+        help='add files to YAML')
+    parser_yaml_add = update_parser_all(parser_yaml_add, config_ini)
+    parser_yaml_add.add_argument(
+        'PATHS', nargs='*', type=Path,
+        help='file path(s) on system to add to YAML')
+    parser_yaml_add.add_argument(
+        '-n', '--name', action='append', help='name to save within YAML')
+    parser_yaml_add = update_parser_yaml_modify(parser_yaml_add)
+    parser_yaml_add.set_defaults(func=call_yaml_add)
+
+    # Parser: yaml:remove
+    parser_yaml_remove = subparsers.add_parser(
+        'remove',
+        help='remove files from YAML')
+    parser_yaml_remove = update_parser_all(parser_yaml_remove, config_ini)
+    parser_yaml_remove.add_argument(
+        'FILES', nargs='*', help='file(s) to remove from YAML')
+    parser_yaml_remove = update_parser_yaml_modify(parser_yaml_remove)
+    parser_yaml_remove.set_defaults(func=call_yaml_remove)
+
+    # Parser: clean
+    parser_clean = subparsers.add_parser(
+        'clean',
+        help='permanently delete files from sync directory not in YAML')
+    parser_clean = update_parser_all(parser_clean, config_ini)
+    parser_clean.add_argument('--dry-run', action='store_true',
+                             help='do not modify any files')
+    parser_clean.set_defaults(func=call_clean)
+
+    # Parser: fsck
+    parser_fsck = subparsers.add_parser(
+        'fsck',
+        help='check files in sync directory for corruption and changes')
+    parser_fsck = update_parser_all(parser_fsck, config_ini)
+    parser_fsck.add_argument('--update', action='store_true',
+                             help='accept changed and missing files')
+    parser_fsck.set_defaults(func=call_fsck)
+
+    # Parser: migrate
+    parser_migrate = subparsers.add_parser(
+        'migrate',
+        help='copy files from sync directory into the SQLite database')
+    parser_migrate = update_parser_all(parser_migrate, config_ini)
+    parser_migrate.add_argument('--dry-run', action='store_true',
+                                help='do not modify any files')
+    parser_migrate.set_defaults(func=call_migrate)
+
+    # Parser: uninstall
+    parser_uninstall = subparsers.add_parser(
+        'uninstall',
+        help='delete filetailor directories')
+    parser_uninstall = update_parser_all(parser_uninstall, config_ini)
+    parser_uninstall.add_argument('--dry-run', action='store_true',
+                             help='do not modify any files')
+    parser_uninstall.set_defaults(func=call_uninstall)
+
+    # Parser: paths
+    parser_paths = subparsers.add_parser(
+        'paths',
+        help='show paths to configuration files')
+    parser_paths.set_defaults(func=call_paths)
+
+    # Get ARGS then call function
+    global ARGS
+    ARGS = parser.parse_args()
+    ftconfig.args = ARGS
+    if 'debug' in ARGS and ARGS.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    logging.info('ARGS = %s', ARGS)
+
+    if 'func' in ARGS:
+        # Call core function
+        try:
+            ARGS.func()
+        finally:
+            if ftconfig.sync_store is not None:
+                ftconfig.sync_store.close()
+            filetailor.helpers.runs.finish()
+    else:
+        # Call help if no argument provided
+        parser.print_help()
+
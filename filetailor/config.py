@@ -1,18 +1,127 @@
 #!/usr/bin/env python3
+"""Settings and YAML for the current run
+
+Modules read and set these as attributes of `filetailor.config`, but each
+`Session` call (and the command line) has its own copy, kept in a context
+variable so calls in different threads do not share state.
+"""
+
+import contextvars
+import sys
+import types
 
 from appdirs import AppDirs
 
+
 # https://docs.python.org/3/faq/programming.html#how-do-i-share-global-variables-across-modules
-args = ''
-data = ''
-config_ini_path = ''
-override_filetailor_ini_path = ''
-filetailor_ini_path = ''
-paths = {}
-tools = {}
-yaml_default = ''
-yaml_devices = ''
-yaml_files = ''
-sync = ''
-dirs = AppDirs('filetailor', False)
-device_id = None
+def get_defaults():
+    """Return the starting value of every setting"""
+
+    return {
+        'args': '',
+        'data': '',
+        'config_ini_path': '',
+        'override_filetailor_ini_path': '',
+        'filetailor_ini_path': '',
+        'paths': {},
+        'tools': {},
+        'snapshots': {},
+        'store': {},
+        'yaml_default': '',
+        'yaml_devices': '',
+        'yaml_files': '',
+        'sync': '',
+        'dirs': AppDirs('filetailor', False),
+        'device_id': None,
+        # Copies of the YAML with vars replaced, set by `copy_yaml`
+        'yaml_default_copy': None,
+        'yaml_files_copy': None,
+        # Snapshot being saved, set by `snapshot.save`
+        'snapshot_run_id': None,
+        'snapshot_saved': set(),
+        # Status of each file, set by `backup_or_restore`
+        'results': [],
+        # This run's directory within in-progress_dir and the locks held,
+        # set by `filetailor.helpers.runs`
+        'in_progress_dir': None,
+        'in_progress_lock': None,
+        'sync_dir_lock': None,
+        # Store of backed up files and the directory holding the files
+        # checked out from it, set by `filetailor.core.store`
+        'sync_store': None,
+        'sync_path': None,
+        # Git index of sync_dir, files saved when they last matched, and
+        # those found unchanged since, set by `filetailor.core.git_status`
+        'git_index': None,
+        'git_saved': {},
+        'git_unchanged': set(),
+        # Journal of this run and entries of the interrupted run being
+        # resumed, set by `filetailor.core.journal`
+        'journal': None,
+        'journal_entries': {},
+        # Changes to the manifest of sync_dir made by this run, set by
+        # `filetailor.core.fsck`
+        'manifest_updates': {},
+        # Limits on I/O of this run, set by `filetailor.helpers.throttle`
+        'throttle': None,
+        # `lstat` and `stat` results of paths, by path, kept by
+        # `filetailor.helpers.stat_cache`
+        'lstat_cache': {},
+        'stat_cache': {},
+        # Templates compiled by `filetailor.helpers.tailor_lines`, by key
+        'templates': {},
+    }
+
+
+class State(types.SimpleNamespace):
+    """Settings for one run"""
+
+
+SETTINGS = frozenset(get_defaults())
+
+# State used unless a `Session` sets its own
+cli_state = State(**get_defaults())
+current_state = contextvars.ContextVar('filetailor_state')
+
+
+def get_state():
+    """Return the state of the current context"""
+    return current_state.get(cli_state)
+
+
+def bind(function):
+    """Return `function` running with the caller's state, for use in worker
+    threads, which do not inherit context variables
+    """
+
+    state = get_state()
+
+    def run(*args, **kwargs):
+        token = current_state.set(state)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current_state.reset(token)
+
+    return run
+
+
+class ConfigModule(types.ModuleType):
+    """Module whose settings are read from and written to the current state"""
+
+    def __getattr__(self, name):
+        # Only called for names not defined in the module itself
+        try:
+            return getattr(get_state(), name)
+        except AttributeError:
+            raise AttributeError(
+                f'module {self.__name__!r} has no attribute {name!r}') from None
+
+    def __setattr__(self, name, value):
+        if name in SETTINGS:
+            setattr(get_state(), name, value)
+        else:
+            super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = ConfigModule
@@ -1,10 +1,9 @@
 #!/usr/bin/env python3
 """Remove files from sync_dir that are no longer defined in YAML"""
 
-import os
-import shutil
-
 import filetailor.config as ftconfig
+import filetailor.core.fsck
+import filetailor.core.store
 import filetailor.helpers.okay_to_continue as okay
 from filetailor.helpers import cprint
 from filetailor.helpers.get_option import main as get_option
@@ -44,28 +43,59 @@ def file_in_yaml(sync_file, yaml_files):
     return False
 
 
+def find_orphans(names, yaml_files):
+    """Return stored `names` not listed in `yaml_files`, sorted"""
+    return sorted(name for name in names if not file_in_yaml(name, yaml_files))
+
+
+def format_size(size):
+    """Return `size` in bytes as a human readable string"""
+
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+
+    if unit == 'B':
+        return f'{size} {unit}'
+    return f'{size:.1f} {unit}'
+
+
+def delete(store, name):
+    """Delete `name` from sync directory unless running a dry run"""
+
+    if not get_option('dry_run'):
+        store.remove(name)
+        filetailor.core.fsck.forget(name)
+    cprint.success(f'Deleted "{name}" from sync directory.')
+
+
 def main():
     """Remove files from sync_dir that are no longer defined in YAML"""
-    paths = ftconfig.paths
+    store = filetailor.core.store.get_store()
 
     cprint.plain('Searching for files in sync directory not listed in YAML...')
-    sync_files = os.listdir(paths['sync_dir'])
-    yaml_files = ftconfig.yaml_files
-    orphans_found = False
-    for sync_file in sync_files:
-        if not file_in_yaml(sync_file, yaml_files):
-            orphans_found = True
-            if okay.main(f'\nOkay to delete "{sync_file}" from sync directory '
-                         + '(no longer tracked in YAML)?', 'y'):
-                sync_file_path = os.path.join(paths['sync_dir'], sync_file)
-                try:
-                    if not get_option('dry_run'):
-                        shutil.rmtree(sync_file_path)
-                    cprint.success(f'Deleted "{sync_file}" from sync directory.')
-                except NotADirectoryError:
-                    os.remove(sync_file_path)
-                    cprint.success(f'Deleted "{sync_file}" from sync directory.')
-    if orphans_found:
-        cprint.plain('\nClean complete.\n')
-    else:
+    orphans = find_orphans(store.list(), ftconfig.yaml_files)
+    if not orphans:
         cprint.plain('\nNo untracked files found.\n')
+        return
+    sizes = store.sizes(orphans)
+
+    # Show plan
+    cprint.plain('\nUntracked files in sync directory (no longer in YAML):')
+    for (orphan, size) in zip(orphans, sizes):
+        cprint.plain(f'  {orphan} ({format_size(size)})')
+    cprint.plain(f'\n{len(orphans)} untracked file(s), '
+                 + f'{format_size(sum(sizes))} reclaimable.')
+
+    # Delete all orphans, ask for each orphan, or delete none
+    response = okay.get_response('\nDelete untracked files?', 'a')
+    if response == 'n':
+        cprint.plain('\nClean cancelled.\n')
+        return
+    for orphan in orphans:
+        if response == 'a' or okay.main(f'Okay to delete "{orphan}"?', 'y'):
+            delete(store, orphan)
+    filetailor.core.fsck.save()
+
+    cprint.plain('\nClean complete.\n')
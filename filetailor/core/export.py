@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Stream files from sync_dir, tailored for a device, into a tar archive"""
+
+import gzip
+import io
+import logging
+import os
+import sys
+import tarfile
+from pathlib import Path
+
+import filetailor.config as ftconfig
+import filetailor.core.store
+import filetailor.core.sync as ftsync
+import filetailor.helpers.tailor_lines
+from filetailor.core.plan import get_owner
+
+
+def warn(text):
+    """Print to stderr since stdout may be the archive"""
+    print(text, file=sys.stderr)
+
+
+def get_umask():
+    """Return the umask, which sets the mode restore gives new directories"""
+
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return umask
+
+
+def get_mtime(path):
+    """Return the time to give the entry for `path`: `SOURCE_DATE_EPOCH` if
+    set, otherwise when `path` in sync_dir was last changed, so the same
+    files always give the same archive
+    """
+
+    if os.environ.get('SOURCE_DATE_EPOCH', '').isdigit():
+        return int(os.environ['SOURCE_DATE_EPOCH'])
+    return int(os.lstat(path).st_mtime)
+
+
+def get_content(xfile):
+    """Return the contents of `xfile.source` tailored for its device"""
+
+    with open(xfile.source, 'rb') as source_file:
+        data = source_file.read()
+    lines = filetailor.helpers.tailor_lines.decode(data)
+    if lines is False:
+        # Binary files are copied as is
+        return data
+
+    return ''.join(
+        filetailor.helpers.tailor_lines.tailor(lines, xfile)).encode('UTF-8')
+
+
+def add_entry(archive, path, owner, mode, mtime, data=None, link=None):
+    """Add a file with `data` to `archive`, a symlink to `link`, or a
+    directory if both are None
+    """
+
+    info = tarfile.TarInfo(str(path).lstrip('/'))
+    (info.uid, info.gid) = owner
+    info.mode = mode
+    info.mtime = mtime
+    if link is not None:
+        info.type = tarfile.SYMTYPE
+        info.linkname = link
+        archive.addfile(info)
+    elif data is None:
+        info.type = tarfile.DIRTYPE
+        archive.addfile(info)
+    else:
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+
+
+def get_mode(xfile):
+    """Return the mode restore gives `xfile.target`, from `xfile.source`"""
+    return ftsync.get_metadata(xfile, owner=False, restrict=False).mode
+
+
+def export_xfile(archive, xfile, owner):
+    """Add the tailored file or preserved symlink `xfile` to `archive`"""
+
+    mtime = get_mtime(xfile.source)
+    if ftsync.is_preserved_link(xfile, xfile.source):
+        add_entry(archive, xfile.target, owner, 0o777, mtime,
+                  link=os.readlink(xfile.source))
+    else:
+        add_entry(archive, xfile.target, owner, get_mode(xfile), mtime,
+                  get_content(xfile))
+
+
+def export_file(archive, cfile, umask):
+    """Add `cfile`, or each subfile if it is a directory, to `archive`"""
+
+    # Paths as restore would use, without staging
+    filetailor.core.store.checkout([cfile.file_id])
+    source = Path(os.path.join(filetailor.core.store.get_sync_dir(),
+                               cfile.file_id))
+    target = Path(cfile.yaml_file['path'])
+    cfile.set_paths(source, target, in_progress=False)
+
+    owner = get_owner(cfile)
+    if owner is None:
+        owner = (getattr(os, 'getuid', lambda: 0)(),
+                 getattr(os, 'getgid', lambda: 0)())
+
+    if source.is_file() or ftsync.is_preserved_link(cfile, source):
+        export_xfile(archive, cfile, owner)
+    elif source.is_dir():
+        add_entry(archive, target, owner, 0o777 & ~umask, get_mtime(source))
+        subfiles = [entry.name for entry in os.scandir(source)
+                    if entry.is_file()
+                    or ftsync.is_preserved_link(cfile, entry.path)]
+        ignores = ftsync.get_ignores(cfile, subfiles)
+        for subfile_id in sorted(set(subfiles) - set(ignores)):
+            export_xfile(archive, cfile.get_subfile(subfile_id), owner)
+    else:
+        warn(f'Not in sync directory: "{cfile.file_id}" does not exist at '
+             + f'"{source}".')
+        return
+
+    for warning in cfile.warnings:
+        warn(warning)
+
+
+def main():
+    """Write every file for the device to a tar archive without prompting or
+    creating temporary files
+    """
+
+    logging.debug('Running export')
+    args = ftconfig.args
+
+    yaml_devices = ftsync.copy_yaml()
+    device_id = ftconfig.device_id
+    if device_id not in yaml_devices:
+        warn(f'Device "{device_id}" is not in YAML.')
+        sys.exit(1)
+    cdevice = ftsync.CDevice(device_id, yaml_devices)
+
+    files = args.FILES or list(ftconfig.yaml_files_copy.keys())
+    umask = get_umask()
+
+    if args.output == '-':
+        output = sys.stdout.buffer
+    else:
+        output = open(args.output, 'wb')
+    stream = output
+    if args.format == 'tar.gz':
+        # Compressed here rather than by `tarfile`, which puts the current
+        # time in the header
+        stream = gzip.GzipFile(filename='', mode='wb', fileobj=output,
+                               mtime=0)
+    try:
+        with tarfile.open(fileobj=stream, mode='w|') as archive:
+            for file_id in files:
+                if file_id not in ftconfig.yaml_files_copy:
+                    warn(f'{file_id} not found in YAML.')
+                    continue
+                cfile = ftsync.CFile(file_id, cdevice)
+                if ftsync.is_for_device(cfile):
+                    export_file(archive, cfile, umask)
+    finally:
+        if stream is not output:
+            stream.close()
+        if output is not sys.stdout.buffer:
+            output.close()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Check files in sync_dir against a manifest of their contents
+
+Backup records the size, modification time, and SHA-256 hash of every file
+it writes to sync_dir in a manifest kept with the user data. `filetailor
+fsck` hashes every file in sync_dir and reports files whose contents
+changed while their size and modification time did not (corruption),
+files changed outside of filetailor, such as by a sync tool, and files
+missing from sync_dir. Files not in the manifest yet are added to it.
+
+For the SQLite store, the database is checked instead, along with the
+hash of every stored file.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import filetailor.config as ftconfig
+import filetailor.core.store
+from filetailor.helpers import cprint
+from filetailor.helpers.get_option import main as get_option
+from filetailor.helpers.hash_file import hash_bytes, main as hash_file
+
+# Stored files hashed at once when checking the SQLite store
+BATCH_SIZE = 64
+
+
+def get_manifest_path():
+    """Return the path of the manifest of sync_dir"""
+
+    name = hashlib.sha256(os.path.abspath(
+        ftconfig.paths['sync_dir']).encode()).hexdigest()
+    return os.path.join(ftconfig.dirs.user_data_dir, 'manifests',
+                        f'{name[:16]}.json')
+
+
+def read_manifest():
+    """Return [size, mtime_ns, hash] of files in sync_dir by relative path"""
+
+    try:
+        with open(get_manifest_path(), 'r', encoding='UTF-8') as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest):
+    """Replace the manifest with `manifest` in one step"""
+
+    manifest_path = get_manifest_path()
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    partial = f'{manifest_path}.{os.getpid()}'
+    with open(partial, 'w', encoding='UTF-8') as manifest_file:
+        json.dump(manifest, manifest_file, sort_keys=True)
+    os.replace(partial, manifest_path)
+
+
+def get_entry(path, file_hash):
+    """Return the manifest entry of the file at `path` with `file_hash`"""
+
+    stats = os.lstat(path)
+    return [stats.st_size, stats.st_mtime_ns, file_hash]
+
+
+def record(path, file_hash):
+    """Record that the file at `path` was written with contents `file_hash`,
+    or removed if `file_hash` is None
+
+    Called by `copy_file`
+    """
+
+    relative = os.path.relpath(path, ftconfig.paths['sync_dir'])
+    if relative.startswith(os.pardir):
+        # Checked out from a database, which keeps its own hashes
+        return
+    relative = relative.replace(os.sep, '/')
+    if file_hash is None:
+        ftconfig.manifest_updates[relative] = None
+    else:
+        ftconfig.manifest_updates[relative] = get_entry(path, file_hash)
+
+
+def forget(file_id):
+    """Record that `file_id` and everything below it was removed
+
+    Called by `clean`
+    """
+    ftconfig.manifest_updates[file_id] = None
+
+
+def save():
+    """Apply the changes recorded during this run to the manifest
+
+    Called by `backup_or_restore` and `clean`
+    """
+
+    updates = ftconfig.manifest_updates
+    ftconfig.manifest_updates = {}
+    if not updates or isinstance(filetailor.core.store.get_store(),
+                                 filetailor.core.store.SQLiteStore):
+        return
+
+    manifest = read_manifest()
+    for (relative, entry) in updates.items():
+        if entry is not None:
+            manifest[relative] = entry
+            continue
+        manifest.pop(relative, None)
+        for path in [path for path in manifest
+                     if path.startswith(f'{relative}/')]:
+            del manifest[path]
+    write_manifest(manifest)
+    logging.debug('Updated %s manifest entries', len(updates))
+
+
+def list_files(store):
+    """Return the `lstat` result of every file in sync_dir by relative
+    path
+    """
+
+    files = {}
+    for file_id in store.list():
+        entry = os.path.join(ftconfig.paths['sync_dir'], file_id)
+        for (path, _, stats) in filetailor.core.store.walk_entry(entry):
+            if stat.S_ISREG(stats.st_mode):
+                files[f'{file_id}/{path}' if path else file_id] = stats
+
+    return files
+
+
+def check_database(store):
+    """Check the integrity of the SQLite store and the hash of every stored
+    file; return the number of problems found
+    """
+
+    problems = 0
+    for (result,) in store.connection.execute('PRAGMA integrity_check'):
+        if result != 'ok':
+            cprint.error(f'Database: {result}')
+            problems += 1
+
+    rows = store.connection.execute('SELECT hash, data FROM blobs')
+    with ThreadPoolExecutor() as executor:
+        for batch in iter(lambda: rows.fetchmany(BATCH_SIZE), []):
+            hashes = executor.map(hash_bytes, [data for (_, data) in batch])
+            for ((file_hash, _), actual) in zip(batch, hashes):
+                if actual == file_hash:
+                    continue
+                file_ids = [row[0] for row in store.connection.execute(
+                    'SELECT DISTINCT file_id FROM entries WHERE hash = ?',
+                    (file_hash,))]
+                cprint.error(f'Corrupted: contents of {", ".join(file_ids)} '
+                             + 'do not match their hash.')
+                problems += 1
+
+    return problems
+
+
+def check_files(store, update):
+    """Hash every file in sync_dir and compare it to the manifest, adding
+    files not in it and accepting changes if `update`; return the number of
+    problems found
+    """
+
+    manifest = read_manifest()
+    files = list_files(store)
+    cprint.plain(f'Checking {len(files)} file(s) in sync directory...')
+    with ThreadPoolExecutor() as executor:
+        hashes = dict(zip(files, executor.map(
+            hash_file, [os.path.join(ftconfig.paths['sync_dir'], path)
+                        for path in files])))
+
+    (corrupted, changed, added) = ([], [], [])
+    for (path, stats) in sorted(files.items()):
+        entry = [stats.st_size, stats.st_mtime_ns, hashes[path]]
+        saved = manifest.get(path)
+        if saved is None:
+            added.append(path)
+        elif saved[2] == entry[2]:
+            pass
+        elif saved[:2] == entry[:2]:
+            corrupted.append(path)
+            if not update:
+                continue
+        else:
+            changed.append(path)
+            if not update:
+                continue
+        manifest[path] = entry
+    missing = sorted(set(manifest) - set(files))
+
+    for path in corrupted:
+        cprint.error(f'Corrupted: {path} (contents changed but size and '
+                     + 'modification time did not)')
+    for path in changed:
+        cprint.differ(f'Changed outside filetailor: {path}')
+    for path in missing:
+        cprint.differ(f'Missing: {path}')
+        if update:
+            del manifest[path]
+    if added:
+        cprint.plain(f'Added {len(added)} file(s) to the manifest.')
+    write_manifest(manifest)
+
+    return len(corrupted) + len(changed) + len(missing)
+
+
+def main():
+    """Check sync_dir for corrupted, changed, and missing files"""
+
+    store = filetailor.core.store.get_store()
+    if isinstance(store, filetailor.core.store.SQLiteStore):
+        problems = check_database(store)
+        if problems:
+            cprint.error(f'\n{problems} problem(s) found in the database.\n')
+            sys.exit(1)
+    elif get_option('update'):
+        problems = check_files(store, True)
+        if problems:
+            cprint.plain(f'\nAccepted {problems} change(s).\n')
+            return
+    else:
+        problems = check_files(store, False)
+        if problems:
+            cprint.error(f'\n{problems} problem(s) found. If the changes '
+                         + 'are expected, run "filetailor fsck --update" to '
+                         + 'accept them.\n')
+            sys.exit(1)
+    cprint.plain('\nNo problems found.\n')
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Skip comparing files that have not changed since they last matched, when
+sync_dir is in a git repository
+
+After status finds a file the same on both sides, the git object hashes of
+its entries in sync_dir and the `lstat` results of its local paths are
+saved. Later status runs report the file unchanged without tailoring it as
+long as git shows the same hashes, no uncommitted changes, and the local
+paths have not changed either.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import subprocess
+import sys
+
+import filetailor.config as ftconfig
+import filetailor.core.store
+import filetailor.core.sync
+import filetailor.helpers.stat_cache as stat_cache
+from filetailor.helpers import cprint
+
+
+def run_git(*args):
+    """Return the output of git in sync_dir, or None if git is not installed
+    or sync_dir is not in a repository
+    """
+
+    try:
+        result = subprocess.run(
+            ['git', '-C', ftconfig.paths['sync_dir'], *args],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, check=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+        logging.debug('git %s failed (%s)', ' '.join(args), error)
+        return None
+
+    return result.stdout
+
+
+def get_top_level(path):
+    """Return the entry of sync_dir that `path` (relative to it) is within"""
+    return path.split('/', 1)[0]
+
+
+def split_paths(output):
+    """Return the paths in NUL-separated git output"""
+    return [path for path in output.decode().split('\0') if path]
+
+
+def get_index():
+    """Return the index of sync_dir as {entry: {path: object_hash}} and the
+    entries with uncommitted changes, or None if git is unavailable
+
+    Paths are relative to sync_dir, which may be within the repository.
+    """
+
+    if isinstance(filetailor.core.store.get_store(),
+                  filetailor.core.store.SQLiteStore):
+        # Files are checked out from a database instead
+        return None
+    staged = run_git('ls-files', '--stage', '-z')
+    dirty = run_git('ls-files', '--modified', '--deleted', '--others',
+                    '--exclude-standard', '-z')
+    if staged is None or dirty is None:
+        return None
+
+    entries = {}
+    for line in split_paths(staged):
+        (info, path) = line.split('\t', 1)
+        object_hash = info.split()[1]
+        entries.setdefault(get_top_level(path), {})[path] = object_hash
+    dirty = {get_top_level(path) for path in split_paths(dirty)}
+
+    return (entries, dirty)
+
+
+def get_sync_key(name):
+    """Return a hash of the git objects of sync_dir entry `name`, or None if
+    it has uncommitted changes or is not in git
+    """
+
+    (entries, dirty) = ftconfig.git_index
+    if name in dirty or name not in entries:
+        return None
+
+    listing = '\n'.join(f'{path} {object_hash}' for (path, object_hash)
+                        in sorted(entries[name].items()))
+    return hashlib.sha256(listing.encode()).hexdigest()
+
+
+def get_stat_key(stats):
+    """Return the parts of `stats` that change with contents or metadata"""
+    return [stats.st_mode, stats.st_uid, stats.st_gid, stats.st_size,
+            stats.st_mtime_ns, stats.st_ctime_ns]
+
+
+def get_local_key(cfile):
+    """Return `lstat` results of the local path of `cfile` and, for
+    directories, of the entries synced within it, or None if it does not
+    exist
+    """
+
+    stats = stat_cache.lstat(cfile.local)
+    if stats is None:
+        return None
+    keys = [['', *get_stat_key(stats)]]
+    if stat.S_ISDIR(stats.st_mode):
+        # Only the entries `diff_dir` compares
+        (files, links) = filetailor.core.sync.list_subfiles(cfile, cfile.local)
+        for name in sorted(files | links):
+            stats = stat_cache.lstat(os.path.join(cfile.local, name))
+            if stats is not None:
+                keys.append([name, *get_stat_key(stats)])
+
+    return keys
+
+
+def get_cache_path():
+    """Return the path saving the state of files that last matched"""
+    return os.path.join(ftconfig.dirs.user_cache_dir, 'git_status.json')
+
+
+def get_context():
+    """Return what the saved state depends on besides the files, so it is
+    not used after the YAML changes
+    """
+
+    try:
+        yaml_mtime = os.stat(ftconfig.paths['yaml']).st_mtime_ns
+    except OSError:
+        yaml_mtime = None
+    return [ftconfig.device_id, yaml_mtime]
+
+
+def load():
+    """Read the git index and the state saved by the last status
+
+    Called by `backup_or_restore`
+    """
+
+    ftconfig.git_index = get_index()
+    ftconfig.git_saved = {}
+    ftconfig.git_unchanged = set()
+    if ftconfig.git_index is None:
+        return
+    try:
+        with open(get_cache_path(), 'r', encoding='UTF-8') as cache_file:
+            saved = json.load(cache_file).get(ftconfig.device_id, {})
+    except (OSError, ValueError):
+        return
+    if saved.get('context') == get_context():
+        ftconfig.git_saved = saved['files']
+
+
+def is_unchanged(cfile):
+    """Return True if neither side of `cfile` changed since it last matched
+
+    Called by `get_file_status`
+    """
+
+    saved = ftconfig.git_saved.get(cfile.file_id)
+    if saved is None:
+        return False
+    if (saved['sync'] != get_sync_key(cfile.file_id)
+            or saved['local'] != get_local_key(cfile)):
+        return False
+    ftconfig.git_unchanged.add(cfile.file_id)
+
+    return True
+
+
+def save(cfiles):
+    """Save the state of `cfiles`, which status found the same
+
+    Called by `backup_or_restore`
+    """
+
+    if not ftconfig.git_index:
+        return
+
+    files = {}
+    for cfile in cfiles:
+        if cfile.file_id in ftconfig.git_unchanged:
+            # Found unchanged by `is_unchanged` during this run
+            files[cfile.file_id] = ftconfig.git_saved[cfile.file_id]
+            continue
+        sync_key = get_sync_key(cfile.file_id)
+        local_key = get_local_key(cfile)
+        if sync_key is not None and local_key is not None:
+            files[cfile.file_id] = {'sync': sync_key, 'local': local_key}
+
+    try:
+        with open(get_cache_path(), 'r', encoding='UTF-8') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        cache = {}
+    cache[ftconfig.device_id] = {'context': get_context(), 'files': files}
+
+    cache_path = get_cache_path()
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    partial = f'{cache_path}.{os.getpid()}'
+    with open(partial, 'w', encoding='UTF-8') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(partial, cache_path)
+
+
+def get_changed_since(rev):
+    """Return entries of sync_dir changed since git revision `rev`, including
+    uncommitted changes
+
+    Called by `backup_or_restore` for `status --since`
+    """
+
+    changed = run_git('diff', '--name-only', '--relative', '-z', rev, '--')
+    untracked = run_git('ls-files', '--others', '--exclude-standard', '-z')
+    if changed is None or untracked is None:
+        cprint.error(f'ERROR: Could not find changes since "{rev}". Check '
+                     + 'the sync directory is in a git repository with that '
+                     + 'revision.')
+        sys.exit(1)
+
+    return {get_top_level(path)
+            for path in split_paths(changed) + split_paths(untracked)}
@@ -53,6 +53,11 @@ def create_filetailor_ini(filetailor_ini_path):
         config['TOOLS'] = {}
         config['TOOLS']['diff_pager'] = 'None'
         config['TOOLS']['difftool'] = 'None'
+        config['SNAPSHOTS'] = {}
+        config['SNAPSHOTS']['retention'] = '10'
+        config['STORE'] = {}
+        config['STORE']['backend'] = 'directory'
+        config['STORE']['local_cache'] = 'no'
         with open(filetailor_ini_path, 'w', encoding='UTF-8') as configfile:
             config.write(configfile)
 
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Record the progress of backup and restore so an interrupted run can be
+continued with `--resume`
+
+The journal starts with what the run depends on besides the files. Then a
+line is added for every answer to a prompt, with the contents it applied
+to, and for every file once it is done, with `lstat` results of both sides
+(of directories themselves, not their entries, so recording stays cheap).
+Resuming skips files whose sides have not changed since they were done,
+without tailoring them again, and answers prompts about the same contents
+as before. The journal is removed when the run completes.
+"""
+
+import json
+import logging
+import os
+
+import filetailor.config as ftconfig
+import filetailor.core.git_status
+import filetailor.core.snapshot
+from filetailor.helpers import cprint
+from filetailor.helpers.get_option import main as get_option
+
+
+def get_journal_path():
+    """Return the path of the journal for this operation and device"""
+    return os.path.join(ftconfig.dirs.user_cache_dir, 'journals',
+                        f'{ftconfig.sync}-{ftconfig.device_id}.jsonl')
+
+
+def get_context():
+    """Return what the recorded progress depends on besides the files"""
+    return [ftconfig.paths['sync_dir'],
+            *filetailor.core.git_status.get_context()]
+
+
+def read(path):
+    """Return the entries of the journal at `path`"""
+
+    entries = []
+    try:
+        with open(path, 'r', encoding='UTF-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Last line cut short when the run was interrupted
+                    break
+    except OSError:
+        pass
+
+    return entries
+
+
+def write(entry):
+    """Add `entry` to the journal, written out right away"""
+
+    ftconfig.journal.write(json.dumps(entry) + '\n')
+    ftconfig.journal.flush()
+
+
+def load(path):
+    """Return entries of the interrupted run by key, or None if there are
+    none to resume
+    """
+
+    entries = read(path)
+    if not entries:
+        cprint.plain('No interrupted run to resume, starting over.')
+        return None
+    if entries[0].get('context') != get_context():
+        cprint.plain('Configuration changed since the interrupted run, '
+                     + 'starting over.')
+        return None
+
+    journal_entries = {}
+    for entry in entries[1:]:
+        if 'done' in entry:
+            journal_entries[('done', entry['done'])] = entry
+            if entry.get('snapshot'):
+                ftconfig.snapshot_run_id = entry['snapshot']
+        elif 'answer' in entry:
+            journal_entries[('answer', entry['answer'])] = entry
+    logging.debug('Resuming from %s journal entries', len(entries) - 1)
+
+    return journal_entries
+
+
+def start():
+    """Start the journal of a backup or restore, continuing the one left by
+    an interrupted run with `--resume`
+
+    Called by `backup_or_restore`
+    """
+
+    ftconfig.journal = None
+    ftconfig.journal_entries = {}
+    if ftconfig.sync not in ['backup', 'restore'] or get_option('dry_run'):
+        return
+
+    path = get_journal_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    journal_entries = None
+    if get_option('resume'):
+        journal_entries = load(path)
+
+    if journal_entries is None:
+        ftconfig.journal = open(path, 'w', encoding='UTF-8')  # pylint: disable=consider-using-with
+        write({'context': get_context()})
+        return
+
+    ftconfig.journal_entries = journal_entries
+    ftconfig.journal = open(path, 'a', encoding='UTF-8')  # pylint: disable=consider-using-with
+    run_id = ftconfig.snapshot_run_id
+    if run_id is not None:
+        # Keep the first state of targets the interrupted run saved
+        manifest = filetailor.core.snapshot.get_manifest(run_id)
+        if manifest.exists():
+            ftconfig.snapshot_saved = {
+                entry['target'] for entry
+                in filetailor.core.snapshot.read_manifest(run_id)}
+        else:
+            ftconfig.snapshot_run_id = None
+
+
+def get_key(path):
+    """Return `lstat` results of `path`, or None if it does not exist"""
+
+    try:
+        return filetailor.core.git_status.get_stat_key(os.lstat(path))
+    except OSError:
+        return None
+
+
+def get_keys(cfile):
+    """Return `lstat` results of both sides of `cfile`"""
+    return {'source': get_key(cfile.source), 'target': get_key(cfile.target)}
+
+
+def is_done(cfile):
+    """Return True if the interrupted run finished `cfile` and neither side
+    changed since
+
+    Called by `get_file_status`
+    """
+
+    entry = ftconfig.journal_entries.get(('done', cfile.file_id))
+    if entry is None:
+        return False
+    keys = get_keys(cfile)
+    return (entry['source'], entry['target']) == (keys['source'],
+                                                  keys['target'])
+
+
+def done(cfile):
+    """Record that `cfile` is finished
+
+    Called by `handle_file_status`
+    """
+
+    if ftconfig.journal is None:
+        return
+    write({'done': cfile.file_id, **get_keys(cfile),
+           'snapshot': ftconfig.snapshot_run_id})
+
+
+def answer(key, get_contents, ask):
+    """Return the answer the interrupted run recorded for prompt `key` about
+    the same contents, otherwise call `ask` and record its answer
+
+    `get_contents` returns the contents, such as a hash, and is only called
+    when there is a journal. If it returns a list, an earlier answer about
+    any list containing it is used. Called by `handle_file_status` and
+    `copy_subfiles`
+    """
+
+    if ftconfig.journal is None:
+        return ask()
+
+    contents = get_contents()
+    entry = ftconfig.journal_entries.get(('answer', key))
+    if entry is not None and (
+            entry['contents'] == contents
+            or (isinstance(contents, list)
+                and set(contents) <= set(entry['contents']))):
+        logging.debug('Reusing answer to "%s"', key)
+        return entry['result']
+
+    result = ask()
+    if not ftconfig.args.assumeyes:
+        write({'answer': key, 'contents': contents, 'result': result})
+
+    return result
+
+
+def finish():
+    """Remove the journal once the run completes
+
+    Called by `backup_or_restore`
+    """
+
+    if ftconfig.journal is None:
+        return
+    ftconfig.journal.close()
+    os.remove(ftconfig.journal.name)
+    ftconfig.journal = None
+    ftconfig.journal_entries = {}
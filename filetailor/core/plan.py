@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""Plan a restore into a JSON file, then apply the plan as a separate step"""
+
+import base64
+import json
+import logging
+import os
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import filetailor.config as ftconfig
+import filetailor.core.snapshot
+import filetailor.core.store
+import filetailor.core.sync as ftsync
+import filetailor.helpers.stat_cache as stat_cache
+import filetailor.helpers.okay_to_continue as okay
+from filetailor.helpers import cprint
+from filetailor.helpers.get_option import main as get_option
+from filetailor.helpers.hash_file import hash_bytes
+from filetailor.helpers.hash_file import main as hash_file
+
+PLAN_VERSION = 2
+MKDIR = 'mkdir'
+COPY = 'copy'
+DELETE = 'delete'
+CHOWN = 'chown'
+CHMOD = 'chmod'
+LINK = 'link'
+
+# Actions in the same phase do not depend on each other and run in parallel;
+# modes are set after owners since changing the owner clears setuid bits
+PHASES = [[MKDIR], [COPY, DELETE, LINK], [CHOWN], [CHMOD]]
+
+
+# PLAN
+
+def get_owner(cfile):
+    """Return (uid, gid) restore would apply to `cfile` and its subfiles
+
+    Matches the owner taken from `cfile.stats` by `get_file_status`
+    """
+
+    if not sys.platform.startswith('linux'):
+        return None
+    if cfile.target.exists():
+        stats = os.stat(cfile.target)
+    elif cfile.target_parent.is_dir():
+        stats = os.stat(cfile.target_parent)
+    else:
+        # Parent will be created by the current user
+        return None
+
+    return (stats[stat.ST_UID], stats[stat.ST_GID])
+
+
+def plan_chmod(cfile, xfile):
+    """Return an action giving `xfile.target` the mode of `xfile.source`"""
+
+    return {
+        'op': CHMOD,
+        'file_id': cfile.file_id,
+        'subfile': xfile.file_id if xfile is not cfile else None,
+        'target': str(xfile.target),
+        'mode': ftsync.get_metadata(xfile, owner=False).mode,
+    }
+
+
+def get_entry(xfile):
+    """Return (file_id, path) of the store entry `xfile` is tailored from
+
+    Plans name the entry rather than `xfile.source`, which may be in a
+    checkout removed when the plan is saved
+    """
+
+    entry = os.path.relpath(xfile.source,
+                            filetailor.core.store.get_sync_dir())
+    (file_id, _, path) = entry.replace(os.sep, '/').partition('/')
+
+    return (file_id, path)
+
+
+def plan_copy(cfile, xfile, owner):
+    """Return actions to copy the tailored `xfile` and set its owner and
+    mode
+    """
+
+    if os.path.islink(xfile.in_progress):
+        # Preserved symlink, made as a link with no owner or mode of its own
+        return [{
+            'op': LINK,
+            'file_id': cfile.file_id,
+            'subfile': xfile.file_id if xfile is not cfile else None,
+            'target': str(xfile.target),
+            'target_hash': hash_file(xfile.target),
+            'backup': not get_option('no_backup', cfile, cfile.device),
+            'link': os.readlink(xfile.in_progress),
+        }]
+
+    with open(xfile.in_progress, 'rb') as in_progress_file:
+        content = in_progress_file.read()
+
+    entry = get_entry(xfile)
+    actions = [{
+        'op': COPY,
+        'file_id': cfile.file_id,
+        'subfile': xfile.file_id if xfile is not cfile else None,
+        'entry': entry,
+        'source_hash': filetailor.core.store.get_store().get_hash(*entry),
+        'target': str(xfile.target),
+        'target_hash': hash_file(xfile.target),
+        'hash': hash_bytes(content),
+        'backup': not get_option('no_backup', cfile, cfile.device),
+        'content': base64.b64encode(content).decode('ascii'),
+    }]
+    if owner:
+        actions.append({
+            'op': CHOWN,
+            'file_id': cfile.file_id,
+            'subfile': actions[0]['subfile'],
+            'target': str(xfile.target),
+            'uid': owner[0],
+            'gid': owner[1],
+        })
+    actions.append(plan_chmod(cfile, xfile))
+
+    return actions
+
+
+def plan_entry(cfile, file_status):
+    """Return the list of actions needed to restore `cfile`
+
+    Called by `plan` after `get_file_status` has tailored the file
+    """
+
+    actions = []
+    if file_status not in [ftsync.DIFFERENT, ftsync.MISSING_TARGET,
+                           ftsync.METADATA]:
+        return actions
+
+    owner = get_owner(cfile)
+    if cfile.source.is_file() and file_status == ftsync.METADATA:
+        # Only the mode differs
+        actions.append(plan_chmod(cfile, cfile))
+
+    elif cfile.source.is_file():
+        # For files
+        if not cfile.target_parent.is_dir():
+            actions.append({'op': MKDIR, 'file_id': cfile.file_id,
+                            'subfile': None,
+                            'target': str(cfile.target_parent)})
+        actions += plan_copy(cfile, cfile, owner)
+
+    elif cfile.source.is_dir():
+        # For directories
+        if not cfile.target.is_dir():
+            actions.append({'op': MKDIR, 'file_id': cfile.file_id,
+                            'subfile': None, 'target': str(cfile.target)})
+        for file_id in sorted(cfile.changed) + sorted(cfile.new):
+            actions += plan_copy(cfile, cfile.get_subfile(file_id), owner)
+        for file_id in sorted(cfile.delete):
+            subfile = cfile.get_subfile(file_id)
+            actions.append({'op': DELETE, 'file_id': cfile.file_id,
+                            'subfile': file_id,
+                            'target': str(subfile.target),
+                            'target_hash': hash_file(subfile.target),
+                            'backup': not get_option('no_backup', cfile,
+                                                     cfile.device)})
+        for file_id in sorted(cfile.metadata):
+            actions.append(plan_chmod(cfile, cfile.get_subfile(file_id)))
+
+    return actions
+
+
+def describe(action):
+    """Return a one-line description of `action`"""
+
+    name = action['file_id']
+    if action['subfile']:
+        name = f'{name}/{action["subfile"]}'
+    if action['op'] == CHOWN:
+        return (f'{action["op"]:6} {name}: "{action["target"]}" to '
+                + f'{action["uid"]}:{action["gid"]}')
+    if action['op'] == LINK:
+        return (f'{action["op"]:6} {name}: "{action["target"]}" to '
+                + f'"{action["link"]}"')
+    if action['op'] == CHMOD:
+        return (f'{action["op"]:6} {name}: "{action["target"]}" to '
+                + f'{action["mode"]:o}')
+    return f'{action["op"]:6} {name}: "{action["target"]}"'
+
+
+def plan():
+    """Tailor every file for restore and save the actions to a plan file
+    without modifying any local files
+    """
+
+    logging.debug('Running plan')
+    (cdevice, files) = ftsync.setup()
+    stat_cache.clear()
+
+    actions = []
+    for file_id in files:
+        cfile = ftsync.CFile(file_id, cdevice)
+        filetailor.core.store.checkout([cfile.file_id])
+        file_status = ftsync.get_file_status(cfile, cdevice)
+        if file_status in [ftsync.SKIP, ftsync.CONFLICT]:
+            continue
+        for warning in cfile.warnings:
+            cprint.error(warning, cfile)
+
+        if file_status in [ftsync.MISSING_SOURCE, ftsync.MISSING_BOTH]:
+            cprint.differ(f'Not in sync directory: "{cfile.file_id}" does '
+                          + f'not exist at "{cfile.source}".')
+        actions += plan_entry(cfile, file_status)
+        cfile.clean_in_progress_file()
+
+    plan_data = {
+        'version': PLAN_VERSION,
+        'operation': ftsync.RESTORE,
+        'device': cdevice.device_id,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'actions': actions,
+    }
+    with open(ftconfig.args.output, 'w', encoding='UTF-8') as plan_file:
+        json.dump(plan_data, plan_file, indent=1)
+
+    for action in actions:
+        cprint.plain(describe(action))
+    cprint.plain(f'\nSaved {len(actions)} action(s) to '
+                 + f'"{ftconfig.args.output}".\n')
+
+
+# APPLY
+
+def check_action(action, source_hash):
+    """Return why `action` must be refused, or None if it is safe to apply
+
+    `source_hash` is the current hash of the store entry a copy was tailored
+    from.
+    """
+
+    if action['op'] == COPY:
+        content = base64.b64decode(action['content'])
+        if hash_bytes(content) != action['hash']:
+            return 'planned content is corrupt'
+        if source_hash != action['source_hash']:
+            return 'source changed since planning'
+    if action['op'] in [COPY, DELETE, LINK]:
+        if hash_file(action['target']) != action['target_hash']:
+            return 'target changed since planning'
+
+    return None
+
+
+def run_action(action):
+    """Apply a single action; return an error message or None on success"""
+
+    target = action['target']
+    try:
+        if action['op'] == MKDIR:
+            os.makedirs(target, exist_ok=True)
+        elif action['op'] == COPY:
+            if action['backup']:
+                filetailor.core.snapshot.save(target)
+            with open(target, 'wb') as target_file:
+                target_file.write(base64.b64decode(action['content']))
+        elif action['op'] == DELETE:
+            if action['backup']:
+                filetailor.core.snapshot.save(target)
+            os.remove(target)
+        elif action['op'] == LINK:
+            if action['backup']:
+                filetailor.core.snapshot.save(target)
+            if os.path.lexists(target):
+                os.remove(target)
+            os.symlink(action['link'], target)
+        elif action['op'] == CHOWN:
+            os.chown(target, action['uid'], action['gid'])
+        elif action['op'] == CHMOD:
+            os.chmod(target, action['mode'])
+    except OSError as error:
+        return str(error)
+
+    return None
+
+
+def apply():
+    """Apply the actions in a plan file created by `plan`"""
+
+    logging.debug('Running apply')
+    plan_path = ftconfig.args.PLAN
+    with open(plan_path, 'r', encoding='UTF-8') as plan_file:
+        plan_data = json.load(plan_file)
+    if plan_data.get('version') != PLAN_VERSION:
+        cprint.error(f'ERROR: "{plan_path}" is not a filetailor plan or was '
+                     + 'created by an incompatible version.')
+        sys.exit(1)
+
+    actions = plan_data['actions']
+    if not actions:
+        cprint.plain('Nothing to apply.')
+        return
+    for action in actions:
+        cprint.plain(describe(action))
+    if not okay.main(f'\nApply {len(actions)} action(s) planned for '
+                     + f'"{plan_data["device"]}" on {plan_data["created"]}?',
+                     'y'):
+        return
+
+    # Check every entry before modifying anything. Stores are read here since
+    # the database can only be used from the thread that opened it.
+    store = filetailor.core.store.get_store()
+    source_hashes = [store.get_hash(*action['entry'])
+                     if action['op'] == COPY else None for action in actions]
+    with ThreadPoolExecutor() as executor:
+        problems = list(executor.map(ftconfig.bind(check_action), actions,
+                                     source_hashes))
+    refused = set()
+    for (action, problem) in zip(actions, problems):
+        if problem:
+            cprint.error(f'Refusing {describe(action)} ({problem}).')
+            refused.add(action['target'])
+
+    failed = False
+    for phase in PHASES:
+        # Owners and modes are only changed on targets that were copied
+        todo = [action for action in actions
+                if action['op'] in phase and action['target'] not in refused]
+        if get_option('dry_run'):
+            errors = [None] * len(todo)
+        elif phase == [MKDIR]:
+            errors = [run_action(action) for action in todo]
+        else:
+            with ThreadPoolExecutor() as executor:
+                errors = list(executor.map(ftconfig.bind(run_action), todo))
+        for (action, error) in zip(todo, errors):
+            if error:
+                cprint.error(f'ERROR: Could not {describe(action)} ({error}).')
+                refused.add(action['target'])
+                failed = True
+            elif action['op'] == COPY:
+                entry = '/'.join(filter(None, action['entry']))
+                cprint.success(f'Copied "{entry}" to "{action["target"]}".')
+            elif action['op'] == DELETE:
+                cprint.success(f'Deleted "{action["target"]}".')
+            elif action['op'] == LINK:
+                cprint.success(f'Linked "{action["target"]}" to '
+                               + f'"{action["link"]}".')
+
+    filetailor.core.snapshot.finish()
+    if refused:
+        cprint.error(f'\n{len(refused)} target(s) not applied. Run '
+                     + '"filetailor plan" again to review them.')
+    cprint.plain('\nApply complete!\n')
+    if failed or refused:
+        sys.exit(1)
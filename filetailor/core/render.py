@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Render the files every device would receive from sync_dir into staging
+directories in a single run
+"""
+
+import argparse
+import copy
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import filetailor.config as ftconfig
+import filetailor.core.store
+import filetailor.core.sync as ftsync
+import filetailor.helpers.metadata
+import filetailor.helpers.runs
+import filetailor.helpers.tailor_lines
+from filetailor.helpers import cprint
+from filetailor.helpers.fast_copy import main as fast_copy
+
+# Devices with vars replaced, loaded once per worker process by `init_worker`
+yaml_devices = {}
+
+
+def get_device_ids(devices):
+    """Return device IDs for `devices`, where "all" selects every device"""
+
+    all_devices = ftconfig.yaml_devices
+    if 'all' in devices:
+        return list(all_devices.keys())
+
+    device_ids = []
+    for device in devices:
+        # Accept hostnames as well as device IDs
+        device_id = device
+        for key in all_devices:
+            if (all_devices[key] and 'hostname' in all_devices[key]
+                    and device == all_devices[key]['hostname']):
+                device_id = key
+        if device_id not in all_devices:
+            cprint.error(f'Device "{device}" is not in YAML.')
+            sys.exit(1)
+        device_ids.append(device_id)
+
+    return device_ids
+
+
+def init_worker(state):
+    """Load the state of the main process into a worker process"""
+
+    for (key, value) in state.items():
+        setattr(ftconfig, key, value)
+
+    global yaml_devices
+    yaml_devices = ftsync.copy_yaml()
+
+
+class SourceCache():
+    """Contents of sync_dir files, each read and decoded once and shared by
+    every device
+    """
+
+    def __init__(self):
+        self.sources = {}
+
+    def get(self, path):
+        """Return (data, lines) for `path`; `lines` is False if binary"""
+
+        if path not in self.sources:
+            with open(path, 'rb') as source_file:
+                data = source_file.read()
+            self.sources[path] = (
+                data, filetailor.helpers.tailor_lines.decode(data))
+
+        return self.sources[path]
+
+
+def write_tailored(xfile, sources):
+    """Tailor `xfile.source` for its device and write it to `xfile.target`"""
+
+    if ftsync.is_preserved_link(xfile, xfile.source):
+        os.makedirs(xfile.target.parent, exist_ok=True)
+        ftsync.copy_link(xfile.source, xfile.target)
+        return
+
+    (data, lines) = sources.get(str(xfile.source))
+    os.makedirs(xfile.target.parent, exist_ok=True)
+    if lines is not False:
+        tailored = filetailor.helpers.tailor_lines.tailor(lines, xfile)
+    if (lines is False or filetailor.helpers.tailor_lines.is_unchanged(
+            data, lines, tailored)):
+        # Binary or untailored, so copy as is (a reflink where supported)
+        fast_copy(xfile.source, xfile.target)
+    else:
+        with open(xfile.target, 'w', encoding='UTF-8') as target_file:
+            target_file.writelines(tailored)
+        # Same mode restore gives a new file
+        filetailor.helpers.metadata.apply(
+            xfile.target,
+            ftsync.get_metadata(xfile, owner=False, restrict=False))
+
+
+def render_file(file_id, device_ids, out_dir):
+    """Render `file_id` for every device in `device_ids`; return a list of
+    (device_id, message, is_error) to report
+
+    Called by `main` in a worker process
+    """
+
+    sources = SourceCache()
+    messages = []
+    for device_id in device_ids:
+        cdevice = ftsync.CDevice(device_id, yaml_devices)
+        cfile = ftsync.CFile(file_id, cdevice,
+                             copy.deepcopy(ftconfig.yaml_files_copy[file_id]))
+        if not ftsync.is_for_device(cfile):
+            continue
+
+        # Same layout as `--staging`
+        source = Path(os.path.join(filetailor.core.store.get_sync_dir(),
+                                   cfile.file_id))
+        target = Path(os.path.join(out_dir, device_id, cfile.file_id,
+                                   os.path.basename(cfile.yaml_file['path'])))
+        cfile.set_paths(source, target)
+
+        if source.is_file() or ftsync.is_preserved_link(cfile, source):
+            write_tailored(cfile, sources)
+        elif source.is_dir():
+            os.makedirs(target, exist_ok=True)
+            subfiles = [entry.name for entry in os.scandir(source)
+                        if entry.is_file()
+                        or ftsync.is_preserved_link(cfile, entry.path)]
+            ignores = ftsync.get_ignores(cfile, subfiles)
+            for subfile_id in sorted(set(subfiles) - set(ignores)):
+                write_tailored(cfile.get_subfile(subfile_id), sources)
+        else:
+            messages.append((device_id, f'Not in sync directory: '
+                             + f'"{cfile.file_id}" does not exist at '
+                             + f'"{source}".', True))
+            continue
+
+        messages += [(device_id, warning, True) for warning in cfile.warnings]
+        messages.append((device_id, f'Rendered "{cfile.file_id}" to '
+                         + f'"{target}".', False))
+
+    return messages
+
+
+def get_file_ids(files, device_ids):
+    """Return the names `files` are stored under in sync_dir for any of
+    `device_ids`
+
+    Called by `main`
+    """
+
+    devices = ftsync.copy_yaml()
+    file_ids = set()
+    for device_id in device_ids:
+        cdevice = ftsync.CDevice(device_id, devices)
+        for file_id in files:
+            cfile = ftsync.CFile(
+                file_id, cdevice,
+                copy.deepcopy(ftconfig.yaml_files_copy[file_id]))
+            if ftsync.is_for_device(cfile):
+                file_ids.add(cfile.file_id)
+
+    return sorted(file_ids)
+
+
+def main():
+    """Render tailored files for each device into `OUT/DEVICE_ID`"""
+
+    logging.debug('Running render')
+    args = ftconfig.args
+    device_ids = get_device_ids(args.devices)
+    out_dir = Path(args.out).resolve()
+
+    if args.FILES == []:
+        files = list(ftconfig.yaml_files.keys())
+    else:
+        files = []
+        for file_id in args.FILES:
+            if file_id in ftconfig.yaml_files:
+                files.append(file_id)
+            else:
+                cprint.plain(f'{file_id} not found in YAML.')
+
+    # Files for every device, since unique files are stored under each
+    filetailor.core.store.checkout(get_file_ids(files, device_ids))
+
+    # Pass state explicitly so workers also start on platforms that spawn
+    # rather than fork processes
+    state = {
+        'args': argparse.Namespace(**{key: value
+                                      for (key, value) in vars(args).items()
+                                      if key != 'func'}),
+        'paths': dict(ftconfig.paths),
+        'sync': ftconfig.sync,
+        # Share this run's directory rather than each worker creating one
+        'in_progress_dir': filetailor.helpers.runs.get_in_progress_dir(),
+        'sync_path': ftconfig.sync_path,
+        'yaml_default': ftconfig.yaml_default,
+        'yaml_devices': ftconfig.yaml_devices,
+        'yaml_files': ftconfig.yaml_files,
+    }
+    with ProcessPoolExecutor(initializer=init_worker,
+                             initargs=(state,)) as executor:
+        results = executor.map(render_file, files,
+                               [device_ids] * len(files),
+                               [out_dir] * len(files))
+        for messages in results:
+            for (device_id, message, is_error) in messages:
+                if is_error:
+                    cprint.error(f'{device_id}: {message}')
+                else:
+                    cprint.plain(f'{device_id}: {message}')
+
+    cprint.plain(f'\nRendered {len(files)} file(s) for {len(device_ids)} '
+                 + f'device(s) to "{out_dir}".\n')
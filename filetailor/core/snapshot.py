@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Save local files before restore overwrites or deletes them, and roll back
+to those copies
+
+Contents are stored once per hash under `objects`, so targets that have not
+changed since an earlier run take no extra space. Each run lists the files
+it saved in `runs/RUN_ID.jsonl`.
+"""
+
+import errno
+import json
+import logging
+import os
+import stat
+import subprocess
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import filetailor.config as ftconfig
+import filetailor.helpers.metadata
+import filetailor.helpers.okay_to_continue as okay
+from filetailor.helpers import cprint
+from filetailor.helpers.fast_copy import main as fast_copy
+from filetailor.helpers.get_option import main as get_option
+from filetailor.helpers.hash_file import hash_bytes
+from filetailor.helpers.hash_file import main as hash_file
+
+DEFAULT_RETENTION = 10
+
+# The run saving files is `ftconfig.snapshot_run_id`, started by the first
+# call to `save`
+lock = threading.Lock()
+
+
+def get_snapshot_dir():
+    """Return the snapshot directory
+
+    Uses "snapshot_dir" from "filetailor.ini" if set, otherwise the OS default
+    """
+
+    snapshot_dir = ftconfig.paths.get('snapshot_dir') if ftconfig.paths else None
+    if not snapshot_dir:
+        snapshot_dir = os.path.join(ftconfig.dirs.user_data_dir, 'snapshots')
+
+    return Path(os.path.expanduser(snapshot_dir))
+
+
+def get_retention():
+    """Return the number of runs to keep from "filetailor.ini\""""
+
+    try:
+        return int(ftconfig.snapshots.get('retention', DEFAULT_RETENTION))
+    except ValueError:
+        cprint.error('ERROR: "retention" in "filetailor.ini" must be a '
+                     + 'number.')
+        sys.exit(1)
+
+
+def get_object(file_hash):
+    """Return the path storing contents with `file_hash`"""
+    return get_snapshot_dir() / 'objects' / file_hash[:2] / file_hash
+
+
+def get_manifest(run):
+    """Return the path listing the files saved by `run`"""
+    return get_snapshot_dir() / 'runs' / f'{run}.jsonl'
+
+
+def start_run():
+    """Return an ID for a new run, named by the time it started"""
+
+    (get_snapshot_dir() / 'runs').mkdir(parents=True, exist_ok=True)
+    run = datetime.now().strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while get_manifest(run).exists():
+        suffix += 1
+        run = f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{suffix}'
+    get_manifest(run).touch()
+    logging.debug('Started snapshot %s', run)
+
+    return run
+
+
+def read_with_sudo(target):
+    """Return the contents of `target`, read with sudo since it may only be
+    readable by root
+    """
+
+    result = subprocess.run(['sudo', 'cat', '--', target],
+                            stdout=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        raise PermissionError(errno.EACCES, 'Could not read with "sudo"',
+                              target)
+
+    return result.stdout
+
+
+def save_object(target, sudo):
+    """Store the contents of `target` once per hash; return the hash"""
+
+    data = read_with_sudo(target) if sudo else None
+    file_hash = hash_file(target) if data is None else hash_bytes(data)
+    stored = get_object(file_hash)
+    if stored.exists():
+        return file_hash
+
+    stored.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary name so an interrupted copy is not used
+    partial = stored.with_name(f'{file_hash}.{threading.get_ident()}')
+    if data is None:
+        fast_copy(target, partial)
+    else:
+        with open(partial, 'wb') as partial_file:
+            partial_file.write(data)
+    os.replace(partial, stored)
+
+    return file_hash
+
+
+def save(target, sudo=False):
+    """Save the current contents and metadata of `target` to this run, or
+    that it did not exist so rolling back deletes it
+
+    Contents are read with sudo if `sudo`, as for files restored with it.
+    Only the first state of each target in a run is kept. Called by
+    `copy_files`, `run_action`, and `rollback`
+    """
+
+    target = os.path.abspath(target)
+    with lock:
+        if target in ftconfig.snapshot_saved:
+            return
+        if ftconfig.snapshot_run_id is None:
+            ftconfig.snapshot_run_id = start_run()
+        ftconfig.snapshot_saved.add(target)
+        run_id = ftconfig.snapshot_run_id
+
+    entry = {'target': target, 'hash': None}
+    try:
+        stats = os.lstat(target)
+    except FileNotFoundError:
+        # Only a target known not to exist is deleted by rolling back
+        stats = None
+    if stats is not None and stat.S_ISLNK(stats.st_mode):
+        entry['link'] = os.readlink(target)
+    elif stats is not None and stat.S_ISREG(stats.st_mode):
+        file_hash = save_object(target, sudo)
+        metadata = filetailor.helpers.metadata.read(target, owner=True)
+        entry.update({'hash': file_hash, 'mode': metadata.mode,
+                      'uid': metadata.uid, 'gid': metadata.gid,
+                      'atime_ns': metadata.atime_ns,
+                      'mtime_ns': metadata.mtime_ns})
+
+    with lock:
+        with open(get_manifest(run_id), 'a', encoding='UTF-8') as manifest:
+            manifest.write(json.dumps(entry) + '\n')
+
+
+def read_manifest(run):
+    """Return the entries saved by `run`"""
+
+    with open(get_manifest(run), 'r', encoding='UTF-8') as manifest:
+        return [json.loads(line) for line in manifest if line.strip()]
+
+
+def get_runs():
+    """Return IDs of saved runs, oldest first"""
+
+    runs_dir = get_snapshot_dir() / 'runs'
+    if not runs_dir.is_dir():
+        return []
+    return sorted(path.stem for path in runs_dir.glob('*.jsonl'))
+
+
+def prune(retention):
+    """Delete all but the newest `retention` runs, then any contents no
+    remaining run refers to
+    """
+
+    runs = get_runs()
+    for run in runs[:max(len(runs) - retention, 0)]:
+        logging.debug('Removing snapshot %s', run)
+        os.remove(get_manifest(run))
+
+    used = {entry['hash'] for run in get_runs()
+            for entry in read_manifest(run) if entry['hash']}
+    objects_dir = get_snapshot_dir() / 'objects'
+    if not objects_dir.is_dir():
+        return
+    for prefix in os.scandir(objects_dir):
+        for stored in os.scandir(prefix.path):
+            if stored.name not in used:
+                os.remove(stored.path)
+        if not os.listdir(prefix.path):
+            os.rmdir(prefix.path)
+
+
+def finish():
+    """Report the run and remove old runs beyond the retention count
+
+    Called by `restore`, `apply`, and `rollback`
+    """
+
+    run_id = ftconfig.snapshot_run_id
+    if run_id is None:
+        return
+    cprint.plain(f'\nSaved snapshot {run_id}. To undo, run '
+                 + f'"filetailor rollback {run_id}".')
+    prune(get_retention())
+    ftconfig.snapshot_run_id = None
+    ftconfig.snapshot_saved = set()
+
+
+def list_runs():
+    """Print saved runs with the number of files in each"""
+
+    runs = get_runs()
+    if not runs:
+        cprint.plain('No snapshots saved.')
+        return
+    for run in runs:
+        cprint.plain(f'{run}: {len(read_manifest(run))} file(s)')
+
+
+def roll_back_entry(entry):
+    """Put back the saved state of one target"""
+
+    target = entry['target']
+    if 'link' in entry:
+        if os.path.lexists(target):
+            os.remove(target)
+        os.symlink(entry['link'], target)
+        cprint.success(f'Restored link "{target}".')
+        return
+    if entry['hash'] is None:
+        if os.path.isfile(target) or os.path.islink(target):
+            os.remove(target)
+        cprint.success(f'Deleted "{target}".')
+        return
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    owner = sys.platform.startswith('linux')
+    fast_copy(get_object(entry['hash']), target,
+              filetailor.helpers.metadata.Metadata(
+                  entry['mode'],
+                  entry['uid'] if owner else None,
+                  entry['gid'] if owner else None,
+                  entry['atime_ns'], entry['mtime_ns'], None))
+    cprint.success(f'Restored "{target}".')
+
+
+def rollback():
+    """Put local files back as they were before run RUN_ID, or list runs if
+    RUN_ID is not given
+    """
+
+    logging.debug('Running rollback')
+    run = ftconfig.args.RUN_ID
+    if run is None:
+        list_runs()
+        return
+    if run not in get_runs():
+        cprint.error(f'ERROR: Snapshot "{run}" not found. Run "filetailor '
+                     + 'rollback" to list snapshots.')
+        sys.exit(1)
+
+    entries = read_manifest(run)
+    for entry in entries:
+        if entry['hash'] is None and 'link' not in entry:
+            cprint.plain(f'delete  "{entry["target"]}"')
+        else:
+            cprint.plain(f'restore "{entry["target"]}"')
+    if not okay.main(f'\nRoll back {len(entries)} file(s) to before {run}?',
+                     'y'):
+        return
+
+    failed = False
+    for entry in entries:
+        if get_option('dry_run'):
+            continue
+        try:
+            # Rolling back can be undone as well
+            save(entry['target'])
+            roll_back_entry(entry)
+        except OSError as error:
+            cprint.error(f'ERROR: Could not roll back "{entry["target"]}" '
+                         + f'({error}).')
+            failed = True
+
+    finish()
+    cprint.plain('\nRollback complete!\n')
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""Keep backed up files as entries in sync_dir (the default) or in a single
+SQLite database within sync_dir
+
+The database suits setups with many small files, which otherwise each take
+an entry in sync_dir for tools like Syncthing or NFS to scan. Select it in
+"filetailor.ini":
+```ini
+[STORE]
+backend = sqlite
+```
+
+Files already in sync_dir are copied into the database by `filetailor
+migrate`, which only deletes them from sync_dir once confirmed. Runs check out
+the files they use from the database into their own directory within
+in-progress_dir, then backup saves the files it changed in one transaction.
+
+With `local_cache = yes`, entries of a sync_dir on a slow network filesystem
+are copied to the cache directory and read from there, except by backup,
+which writes to sync_dir directly. Copies are updated when the size,
+modification time, or mode of an entry in sync_dir changes.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import filetailor.config as ftconfig
+import filetailor.helpers.okay_to_continue as okay
+import filetailor.helpers.runs
+from filetailor.helpers import cprint
+from filetailor.helpers.fast_copy import main as fast_copy
+from filetailor.helpers.get_option import main as get_option
+from filetailor.helpers.hash_file import hash_bytes
+from filetailor.helpers.hash_file import main as hash_file
+
+DATABASE = 'filetailor.sqlite3'
+MIRROR_DIR = 'mirror'
+
+# Kinds of entries in the database
+FILE = 'file'
+DIR = 'dir'
+LINK = 'link'
+
+# Each file or directory is stored as its top-level entry (path '') and,
+# for directories, an entry for every path below it. Contents are stored
+# once per hash.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    file_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    mode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT,
+    link TEXT,
+    PRIMARY KEY (file_id, path)
+);
+CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+'''
+
+
+def get_size(path):
+    """Return the number of bytes used by `path` without following symlinks"""
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            size += get_size(entry.path)
+
+    return size
+
+
+def list_entries(sync_dir):
+    """Return names of files in `sync_dir`, leaving out the database and
+    hidden entries, such as ".git" or ".stfolder" of sync tools
+    """
+
+    return [name for name in os.listdir(sync_dir)
+            if not name.startswith((DATABASE, '.'))]
+
+
+class DirectoryStore():
+    """Each file as an entry in sync_dir, used as is"""
+
+    def __init__(self, sync_dir):
+        self.sync_dir = sync_dir
+
+    def checkout(self, file_ids):
+        """Return the directory holding `file_ids`"""
+        # pylint: disable=unused-argument
+        return self.sync_dir
+
+    def commit(self, file_ids):
+        """Nothing to save since files are written to sync_dir directly"""
+
+    def list(self):
+        """Return names of stored files, leaving out hidden entries"""
+        return list_entries(self.sync_dir)
+
+    def get_hash(self, file_id, path=''):
+        """Return the hash of file `path` within `file_id`, or None if it is
+        not a file
+        """
+
+        full_path = os.path.join(self.sync_dir, file_id)
+        if path:
+            full_path = os.path.join(full_path, path)
+        return hash_file(full_path)
+
+    def sizes(self, file_ids):
+        """Return the number of bytes used by each of `file_ids`"""
+
+        # Measure all at once since directories may be large
+        with ThreadPoolExecutor() as executor:
+            return list(executor.map(
+                get_size, [os.path.join(self.sync_dir, file_id)
+                           for file_id in file_ids]))
+
+    def remove(self, file_id):
+        """Delete `file_id` from sync_dir"""
+
+        path = os.path.join(self.sync_dir, file_id)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def close(self):
+        """Nothing to close"""
+
+
+def walk_entry(path):
+    """Yield (relative_path, full_path, lstat) for `path` and everything
+    below it, without following symlinks
+    """
+
+    if not os.path.lexists(path):
+        return
+    yield ('', path, os.lstat(path))
+    if os.path.islink(path) or not os.path.isdir(path):
+        return
+    for (dirpath, dirs, files) in os.walk(path):
+        for name in dirs + files:
+            full_path = os.path.join(dirpath, name)
+            relative = os.path.relpath(full_path, path).replace(os.sep, '/')
+            yield (relative, full_path, os.lstat(full_path))
+
+
+def get_kind(stats):
+    """Return the kind of entry `stats` describe"""
+
+    if stat.S_ISLNK(stats.st_mode):
+        return LINK
+    if stat.S_ISDIR(stats.st_mode):
+        return DIR
+    return FILE
+
+
+class SQLiteStore():
+    """Every file in one SQLite database within sync_dir"""
+
+    def __init__(self, sync_dir):
+        self.sync_dir = sync_dir
+        self.path = os.path.join(sync_dir, DATABASE)
+        self.checkout_dir = None
+        self.checked_out = set()
+
+        self.connection = sqlite3.connect(self.path)
+        # Readers are not blocked by a backup writing at the same time
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def checkout(self, file_ids):
+        """Write `file_ids` to this run's directory; return the directory"""
+
+        if self.checkout_dir is None:
+            self.checkout_dir = os.path.join(
+                filetailor.helpers.runs.get_in_progress_dir(), '.sync_dir')
+            os.makedirs(self.checkout_dir, exist_ok=True)
+
+        for file_id in file_ids:
+            if file_id in self.checked_out:
+                continue
+            self.checked_out.add(file_id)
+            dirs = []
+            rows = self.connection.execute(
+                'SELECT path, kind, mode, mtime_ns, link, data FROM entries '
+                + 'LEFT JOIN blobs USING (hash) WHERE file_id = ? '
+                + 'ORDER BY path', (file_id,))
+            for (path, kind, mode, mtime_ns, link, data) in rows:
+                full_path = os.path.join(self.checkout_dir, file_id)
+                if path:
+                    full_path = os.path.join(full_path, path)
+                if kind == DIR:
+                    os.makedirs(full_path, exist_ok=True)
+                    dirs.append((full_path, mode))
+                    continue
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if kind == LINK:
+                    os.symlink(link, full_path)
+                    continue
+                with open(full_path, 'wb') as checked_out:
+                    checked_out.write(data)
+                os.chmod(full_path, stat.S_IMODE(mode))
+                os.utime(full_path, ns=(mtime_ns, mtime_ns))
+            # After their contents, since writing them needs permission
+            for (full_path, mode) in reversed(dirs):
+                os.chmod(full_path, stat.S_IMODE(mode))
+        logging.debug('Checked out %s file(s)', len(self.checked_out))
+
+        return self.checkout_dir
+
+    def commit(self, file_ids, root=None):
+        """Save every entry of `file_ids` in `root` (the checkout by default)
+        that changed, in one transaction
+        """
+
+        if root is None:
+            # Files not checked out are not in the checkout to compare
+            root = self.checkout_dir
+            file_ids = [file_id for file_id in file_ids
+                        if file_id in self.checked_out]
+        if root is None:
+            return
+        with self.connection:
+            for file_id in file_ids:
+                stored = {row[0]: tuple(row[1:]) for row in self.connection.execute(
+                    'SELECT path, kind, mode, mtime_ns, size FROM entries '
+                    + 'WHERE file_id = ?', (file_id,))}
+                found = set()
+                for (path, full_path, stats) in walk_entry(
+                        os.path.join(root, file_id)):
+                    found.add(path)
+                    kind = get_kind(stats)
+                    # Directory times change with their contents, so ignore
+                    mtime_ns = 0 if kind == DIR else stats.st_mtime_ns
+                    size = stats.st_size if kind == FILE else 0
+                    if stored.get(path) == (kind, stats.st_mode, mtime_ns, size):
+                        continue
+                    (file_hash, link) = (None, None)
+                    if kind == FILE:
+                        with open(full_path, 'rb') as committed:
+                            data = committed.read()
+                        file_hash = hash_bytes(data)
+                        self.connection.execute(
+                            'INSERT OR IGNORE INTO blobs VALUES (?, ?)',
+                            (file_hash, data))
+                    elif kind == LINK:
+                        link = os.readlink(full_path)
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO entries '
+                        + 'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (file_id, path, kind, stats.st_mode, mtime_ns, size,
+                         file_hash, link))
+                self.connection.executemany(
+                    'DELETE FROM entries WHERE file_id = ? AND path = ?',
+                    [(file_id, path) for path in set(stored) - found])
+            self.remove_unused_blobs()
+
+    def remove_unused_blobs(self):
+        """Delete contents no entry refers to"""
+        self.connection.execute(
+            'DELETE FROM blobs WHERE hash NOT IN '
+            + '(SELECT hash FROM entries WHERE hash IS NOT NULL)')
+
+    def list(self):
+        """Return names of stored files"""
+        return [row[0] for row in self.connection.execute(
+            "SELECT file_id FROM entries WHERE path = ''")]
+
+    def get_hash(self, file_id, path=''):
+        """Return the hash of file `path` within `file_id`, or None if it is
+        not a file
+        """
+
+        row = self.connection.execute(
+            'SELECT hash FROM entries WHERE file_id = ? AND path = ?',
+            (file_id, path)).fetchone()
+        return row[0] if row else None
+
+    def sizes(self, file_ids):
+        """Return the number of bytes used by each of `file_ids`"""
+
+        sizes = dict(self.connection.execute(
+            'SELECT file_id, SUM(size) FROM entries GROUP BY file_id'))
+        return [sizes.get(file_id, 0) for file_id in file_ids]
+
+    def remove(self, file_id):
+        """Delete `file_id` from the database"""
+
+        with self.connection:
+            self.connection.execute('DELETE FROM entries WHERE file_id = ?',
+                                    (file_id,))
+            self.remove_unused_blobs()
+
+    def close(self):
+        """Move changes from the write-ahead log into the database file, so
+        tools syncing sync_dir see them, then close it
+        """
+
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.connection.close()
+
+
+def remove_path(path):
+    """Delete `path`, which may be a directory, if it still exists"""
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def is_current(stats, mirror_path, mirror_stats):
+    """Return True if the copy at `mirror_path` matches the entry in sync_dir
+    with `stats`
+    """
+
+    kind = get_kind(stats)
+    if mirror_stats is None or get_kind(mirror_stats) != kind:
+        return False
+    if kind == FILE:
+        return ((stats.st_mode, stats.st_size, stats.st_mtime_ns)
+                == (mirror_stats.st_mode, mirror_stats.st_size,
+                    mirror_stats.st_mtime_ns))
+
+    # Directories are checked by their contents; links are compared later
+    return True
+
+
+class MirroredStore(DirectoryStore):
+    """Each file as an entry in sync_dir, read from copies in the local
+    cache directory by every command but backup
+    """
+
+    def __init__(self, sync_dir):
+        super().__init__(sync_dir)
+        name = hashlib.sha256(os.path.abspath(sync_dir).encode()).hexdigest()
+        self.mirror_dir = os.path.join(ftconfig.dirs.user_cache_dir,
+                                       MIRROR_DIR, name[:16])
+        self.mirrored = set()
+
+    def checkout(self, file_ids):
+        """Update copies of `file_ids`; return the directory holding them"""
+
+        if ftconfig.sync == 'backup':
+            # Writes go to sync_dir, so compare against it as well
+            return self.sync_dir
+
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        file_ids = [file_id for file_id in file_ids
+                    if file_id not in self.mirrored]
+        self.mirrored.update(file_ids)
+        # Check all at once since each check waits on the network
+        with ThreadPoolExecutor() as executor:
+            updated = sum(executor.map(ftconfig.bind(self.update),
+                                       file_ids))
+        logging.debug('Updated %s of %s cached file(s)', updated,
+                      len(file_ids))
+
+        return self.mirror_dir
+
+    def copy(self, path, mirror_path, stats):
+        """Replace `mirror_path` with a copy of `path` in one step, so runs
+        at the same time never read a partial copy
+        """
+
+        (fd, partial) = tempfile.mkstemp(prefix='.partial-',
+                                         dir=self.mirror_dir)
+        os.close(fd)
+        try:
+            if stat.S_ISLNK(stats.st_mode):
+                os.remove(partial)
+                os.symlink(os.readlink(path), partial)
+            else:
+                fast_copy(path, partial)
+            if os.path.isdir(mirror_path) and not os.path.islink(mirror_path):
+                shutil.rmtree(mirror_path)
+            os.replace(partial, mirror_path)
+        finally:
+            if os.path.lexists(partial):
+                os.remove(partial)
+
+    def update(self, file_id):
+        """Copy entries of `file_id` that changed in sync_dir and remove
+        those deleted from it; return True if any were
+        """
+
+        mirror_root = os.path.join(self.mirror_dir, file_id)
+        found = set()
+        dirs = []
+        updated = False
+        for (path, full_path, stats) in walk_entry(
+                os.path.join(self.sync_dir, file_id)):
+            found.add(path)
+            mirror_path = os.path.join(mirror_root, path) if path else mirror_root
+            try:
+                mirror_stats = os.lstat(mirror_path)
+            except OSError:
+                mirror_stats = None
+
+            if stat.S_ISDIR(stats.st_mode):
+                if mirror_stats is not None and not stat.S_ISDIR(
+                        mirror_stats.st_mode):
+                    os.remove(mirror_path)
+                os.makedirs(mirror_path, exist_ok=True)
+                # Writable until its contents are updated
+                os.chmod(mirror_path, stat.S_IMODE(stats.st_mode) | stat.S_IRWXU)
+                dirs.append((mirror_path, stats.st_mode))
+            elif not is_current(stats, mirror_path, mirror_stats) or (
+                    stat.S_ISLNK(stats.st_mode)
+                    and os.readlink(mirror_path) != os.readlink(full_path)):
+                self.copy(full_path, mirror_path, stats)
+                updated = True
+
+        # Entries removed from sync_dir, deepest first
+        removed = [mirror_path for (path, mirror_path, _)
+                   in walk_entry(mirror_root) if path not in found]
+        for mirror_path in reversed(removed):
+            remove_path(mirror_path)
+            updated = True
+        for (mirror_path, mode) in reversed(dirs):
+            os.chmod(mirror_path, stat.S_IMODE(mode))
+
+        return updated
+
+    def remove(self, file_id):
+        """Delete `file_id` from sync_dir and the cache"""
+
+        super().remove(file_id)
+        remove_path(os.path.join(self.mirror_dir, file_id))
+
+
+BACKENDS = {'directory': DirectoryStore, 'sqlite': SQLiteStore}
+
+
+def get_store_class():
+    """Return the store class selected in "filetailor.ini\""""
+
+    (backend, local_cache) = ('directory', False)
+    if ftconfig.store:
+        backend = ftconfig.store.get('backend', backend)
+        try:
+            local_cache = ftconfig.store.getboolean('local_cache', False)
+        except ValueError:
+            cprint.error('ERROR: "local_cache" in "filetailor.ini" must be '
+                         + '"yes" or "no".')
+            sys.exit(1)
+    if backend not in BACKENDS:
+        cprint.error('ERROR: "backend" in "filetailor.ini" must be one of '
+                     + f'{", ".join(BACKENDS)}.')
+        sys.exit(1)
+    store_class = BACKENDS[backend]
+    if local_cache and store_class is DirectoryStore:
+        # The database is checked out locally already
+        store_class = MirroredStore
+
+    return store_class
+
+
+def get_store():
+    """Return the store for this run, opened on first use"""
+
+    if ftconfig.sync_store is None:
+        store_class = get_store_class()
+        sync_dir = ftconfig.paths['sync_dir']
+        if (store_class is SQLiteStore
+                and not os.path.exists(os.path.join(sync_dir, DATABASE))
+                and list_entries(sync_dir)):
+            # Never moved as a side effect of a run, since it may only read
+            cprint.error('ERROR: Files in sync directory are not in the '
+                         + 'database yet. Run "filetailor migrate" to copy '
+                         + 'them into it.')
+            sys.exit(1)
+        ftconfig.sync_store = store_class(sync_dir)
+
+    return ftconfig.sync_store
+
+
+def migrate():
+    """Copy files in sync_dir into the database, then delete them from
+    sync_dir once confirmed
+
+    Copies are updated when run again, so files can be kept in sync_dir until
+    every device uses the database.
+
+    Called by `call_migrate`
+    """
+
+    if get_store_class() is not SQLiteStore:
+        cprint.error('ERROR: Set "backend = sqlite" under "[STORE]" in '
+                     + '"filetailor.ini" before migrating.')
+        sys.exit(1)
+    sync_dir = ftconfig.paths['sync_dir']
+    file_ids = list_entries(sync_dir)
+    if not file_ids:
+        cprint.plain('\nNo files in sync directory to migrate.\n')
+        return
+
+    cprint.plain(f'Copying {len(file_ids)} file(s) from sync directory into '
+                 + f'"{os.path.join(sync_dir, DATABASE)}"...')
+    if get_option('dry_run'):
+        return
+    ftconfig.sync_store = SQLiteStore(sync_dir)
+    ftconfig.sync_store.commit(file_ids, sync_dir)
+    cprint.success(f'Copied {len(file_ids)} file(s) into the database.')
+
+    # Devices still using the directory store read the files in sync_dir
+    if not okay.main('\nDelete the copied files from sync directory?', 'n'):
+        cprint.plain('\nFiles kept in sync directory. Run "filetailor '
+                     + 'migrate" again to update the database.\n')
+        return
+    for file_id in file_ids:
+        remove_path(os.path.join(sync_dir, file_id))
+    cprint.plain(f'\nDeleted {len(file_ids)} file(s) from sync directory.\n')
+
+
+def checkout(file_ids):
+    """Make `file_ids` available in the directory `get_sync_dir` returns
+
+    Called by `backup_or_restore`, `plan`, `render`, and `export`
+    """
+
+    ftconfig.sync_path = get_store().checkout(file_ids)
+
+
+def get_sync_dir():
+    """Return the directory holding files checked out for this run
+
+    Called by `define_paths`, `render_file`, and `export_file`
+    """
+
+    return ftconfig.sync_path or ftconfig.paths['sync_dir']
+
+
+def commit(file_ids):
+    """Save changes to `file_ids` made in the directory from `get_sync_dir`
+
+    Called by `backup_or_restore`
+    """
+
+    if ftconfig.sync_store is not None:
+        ftconfig.sync_store.commit(file_ids)
+
+
+def close():
+    """Close the store at the end of a run
+
+    Called by `main` and `Session.call`
+    """
+
+    if ftconfig.sync_store is not None:
+        ftconfig.sync_store.close()
+        ftconfig.sync_store = None
+    ftconfig.sync_path = None
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Save a summary of each status run so shell prompts can show drift with
+`filetailor status --cached`, without loading YAML or comparing files
+
+The summary records the modification time of every tracked path, so a
+cached status can tell when it is out of date and refresh it in the
+background. Only light modules are imported here to keep prompts fast.
+"""
+
+import json
+import os
+import sys
+import time
+
+import filetailor.config as ftconfig
+from filetailor.helpers import cprint
+
+# Statuses from `filetailor.core.sync`, grouped as shown in prompts
+CATEGORIES = {
+    'same': 'same',
+    'different': 'modified',
+    'metadata': 'modified',
+    'conflict': 'modified',
+    'missing source': 'missing',
+    'missing target': 'missing',
+    'missing both': 'missing',
+}
+
+# Seconds after which a background refresh that has not saved a summary is
+# assumed to have failed
+REFRESH_INTERVAL = 60
+
+
+def get_summary_path():
+    """Return the path of the saved summaries, one for each device"""
+    return os.path.join(ftconfig.dirs.user_cache_dir, 'status.json')
+
+
+def get_mtime(path):
+    """Return the modification time of `path`, or None if it does not exist"""
+
+    try:
+        return os.lstat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_summaries():
+    """Return saved summaries by device name"""
+
+    try:
+        with open(get_summary_path(), 'r', encoding='UTF-8') as summary_file:
+            return json.load(summary_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(results, device_names):
+    """Save counts from a status run of every file under each name in
+    `device_names` (device_id and the name given with `--device`)
+
+    Called by `backup_or_restore`
+    """
+
+    counts = {'same': 0, 'modified': 0, 'missing': 0}
+    drifted = []
+    paths = {ftconfig.paths['yaml']: get_mtime(ftconfig.paths['yaml'])}
+    for result in results:
+        category = CATEGORIES[result['status']]
+        counts[category] += 1
+        if category != 'same':
+            drifted.append(result['file_id'])
+        for path in [result['source'], result['target']]:
+            paths[path] = get_mtime(path)
+
+    summary = {'time': time.time(), 'counts': counts, 'drifted': drifted,
+               'paths': paths}
+    summaries = read_summaries()
+    for name in device_names:
+        summaries[name] = summary
+
+    # Replace in one step so prompts never read a partial file
+    summary_path = get_summary_path()
+    os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+    partial = f'{summary_path}.{os.getpid()}'
+    with open(partial, 'w', encoding='UTF-8') as summary_file:
+        json.dump(summaries, summary_file)
+    os.replace(partial, summary_path)
+
+    import logging  # pylint: disable=import-outside-toplevel
+    logging.debug('Saved status summary for %s', device_names)
+
+
+def is_stale(summary):
+    """Return True if a tracked path changed since `summary` was saved
+
+    Only the top level of directories is checked, like their modification
+    time
+    """
+
+    return any(get_mtime(path) != mtime
+               for (path, mtime) in summary['paths'].items())
+
+
+def lock_marker(fd):
+    """Return True if no running refresh holds the lock on the marker file
+    open as `fd`, taking the lock for the refresh about to start
+    """
+
+    try:
+        import fcntl  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        # Windows, where only the time the marker was written is checked
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+
+    return True
+
+
+def refresh(device, saved=None):
+    """Run status for `device` in the background to update its summary,
+    without running YAML scripts
+
+    The refresh holds a lock on a marker file until it exits, so refreshes
+    never overlap. If the time the summary was `saved` is given, nothing is
+    started either while a refresh started after it may still be running.
+    Called by `call_sync_backup`, `call_sync_restore`, and `show_cached`
+    """
+
+    marker = f'{get_summary_path()}.refresh'
+    started = get_mtime(marker)
+    if (saved is not None and started is not None
+            and started / 1e9 > max(saved, time.time() - REFRESH_INTERVAL)):
+        return
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+
+    # Only imported when needed since they are slow to import
+    import logging  # pylint: disable=import-outside-toplevel
+    import subprocess  # pylint: disable=import-outside-toplevel
+    fd = os.open(marker, os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        if not lock_marker(fd):
+            logging.debug('Status summary for %s is already refreshing',
+                          device)
+            return
+        os.utime(marker)
+        logging.debug('Refreshing status summary for %s', device)
+        # The lock is inherited with `fd` and held until the refresh exits
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, '-m', 'filetailor', 'status', '-q', '-y',
+             '--no-scripts', '-d', device],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, start_new_session=True,
+            pass_fds=[fd] if os.name == 'posix' else [])
+    finally:
+        os.close(fd)
+
+
+def format_age(seconds):
+    """Return `seconds` as a short age, such as "5m\""""
+
+    for (unit, size) in [('d', 86400), ('h', 3600), ('m', 60)]:
+        if seconds >= size:
+            return f'{int(seconds // size)}{unit}'
+    return f'{int(seconds)}s'
+
+
+def show_cached(device):
+    """Print the saved summary for `device`, refreshing it in the background
+    if tracked paths changed since
+
+    Called by `call_sync_status`
+    """
+
+    summary = read_summaries().get(device)
+    if summary is None:
+        cprint.plain('No cached status yet, refreshing in the background.')
+        refresh(device, 0)
+        return
+
+    stale = is_stale(summary)
+    if stale:
+        refresh(device, summary['time'])
+    counts = summary['counts']
+    age = format_age(time.time() - summary['time'])
+    cprint.plain(f'{counts["same"]} same, {counts["modified"]} modified, '
+                 + f'{counts["missing"]} missing ({age} ago'
+                 + f'{", stale" if stale else ""})')
@@ -4,35 +4,60 @@
 # pylint: disable=no-member
 
 import copy
-import filecmp
 import logging
 import os
-import re
 import shutil
 import stat
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import filetailor.config as ftconfig
+import filetailor.core.fsck
+import filetailor.core.git_status
+import filetailor.core.journal
+import filetailor.core.snapshot
+import filetailor.core.store
+import filetailor.core.summary
 import filetailor.helpers.get_key_list
+import filetailor.helpers.metadata
+import filetailor.helpers.pathspec
+import filetailor.helpers.runs
+import filetailor.helpers.stat_cache as stat_cache
 import filetailor.helpers.okay_to_continue as okay
 import filetailor.helpers.tailor_lines
+import filetailor.helpers.throttle
 from filetailor.helpers import cprint
+from filetailor.helpers.compare_files import main as compare_files
 from filetailor.helpers.diff import diff
+from filetailor.helpers.fast_copy import copy_verified
+from filetailor.helpers.fast_copy import main as fast_copy
+from filetailor.helpers.fast_copy import update as update_copy
 from filetailor.helpers.get_option import main as get_option
+from filetailor.helpers.hash_file import hash_bytes, main as hash_file
+from filetailor.helpers.read_ahead import ReadAhead
 
 STATUS = 'status'
 BACKUP = 'backup'
 RESTORE = 'restore'
+PLAN = 'plan'
 SAME = 'same'
 DIFFERENT = 'different'
 MISSING_SOURCE = 'missing source'
 MISSING_TARGET = 'missing target'
 MISSING_BOTH = 'missing both'
+METADATA = 'metadata'
 SKIP = 'skip'
+# A file and directory of the same name block each other
+CONFLICT = 'conflict'
 UPDATE = 'Update'
 ADD_NEW = 'Add new'
 DELETE = 'Delete'
+FIX_METADATA = 'Fix permissions of'
+
+# Number of upcoming files tailored in the background while the user answers
+# prompts for the current file
+PREFETCH = 8
 
 
 class CDevice():
@@ -41,9 +66,9 @@ class CDevice():
 
     def __init__(self, device_id, yaml_devices):
         self.device_id = device_id
-        self.yaml_default = YAML_DEFAULT
+        self.yaml_default = ftconfig.yaml_default_copy
         self.yaml_device = self.tailor_yaml(
-                YAML_DEFAULT, yaml_devices[device_id])
+                ftconfig.yaml_default_copy, yaml_devices[device_id])
 
     def replace_dict_values(self, d, find, replace):
         # pylint: disable=invalid-name
@@ -60,17 +85,17 @@ class CDevice():
     def tailor_yaml(self, yaml_device, yaml_file=None):
         """Replace vars in yaml"""
         key_list = filetailor.helpers.get_key_list.main(
-                YAML_DEFAULT, yaml_device, yaml_file, 'yaml')
+                ftconfig.yaml_default_copy, yaml_device, yaml_file, 'yaml')
 
         # pylint: disable=consider-using-dict-items
         for key in key_list:
             var = key_list[key]
             if yaml_file:
                 # Replace vars in `yaml_file` from `yaml_device` and
-                # `YAML_DEFAULT`
+                # `yaml_default`
                 self.replace_dict_values(yaml_file, key, var)
             # else:
-            #     # Replace vars in `yaml_device` from `YAML_DEFAULT`
+            #     # Replace vars in `yaml_device` from `yaml_default`
             #     self.replace_dict_values(yaml_device, key, var)
 
         if yaml_file:
@@ -82,14 +107,15 @@ class CFile(CDevice):
     """Current file"""
     type = 'file'
 
-    def __init__(self, file_id, cdevice):
+    def __init__(self, file_id, cdevice, yaml_file=None):
         # super().__init__(device_id, yaml_device)
+        if yaml_file is None:
+            yaml_file = ftconfig.yaml_files_copy[file_id]
         self.device = cdevice
         self.device_id = cdevice.device_id
-        self.yaml_default = YAML_DEFAULT
+        self.yaml_default = ftconfig.yaml_default_copy
         self.yaml_device = cdevice.yaml_device
-        self.yaml_file = self.tailor_yaml(
-            cdevice.yaml_device, yaml_files[file_id])
+        self.yaml_file = self.tailor_yaml(cdevice.yaml_device, yaml_file)
         self.file_id = self.get_file_id(file_id, cdevice)
         self.local = None
         self.sync = None
@@ -98,11 +124,18 @@ class CFile(CDevice):
         self.target = None
         self.target_parent = None
         self.in_progress = None
+        # Hash of `in_progress` if `tailor_file` wrote it from memory
+        self.in_progress_hash = None
         self.stats = None
 
         self.new = None
         self.delete = None
         self.changed = []
+        self.metadata = []
+        self.warnings = []
+        self.subfiles = {}
+        # Hashes of subfiles `tailor_file` wrote from memory, by name
+        self.in_progress_hashes = {}
 
     def get_file_id(self, file_id, cdevice):
         """Prefix `file_id` with device name if `unique = True`"""
@@ -111,48 +144,103 @@ class CFile(CDevice):
                 return f'{file_id}_{cdevice.device_id}'
         return file_id
 
-    def set_paths(self, source, target, parent=None):
-        """Set paths and associated attributes"""
+    def set_paths(self, source, target, parent=None, in_progress=True):
+        """Set paths and associated attributes, leaving `in_progress` None
+        unless `in_progress`, so the run's directory is not created
+        """
         self.source = source
         self.target = target
         self.target_parent = self.target.parent.absolute()
 
+        if not in_progress:
+            self.in_progress = None
+            return
+        in_progress_dir = filetailor.helpers.runs.get_in_progress_dir()
         if parent:
             self.in_progress = Path(os.path.join(
-                ftconfig.paths['in-progress_dir'], parent, self.file_id))
+                in_progress_dir, parent, self.file_id))
         else:
             self.in_progress = Path(os.path.join(
-                ftconfig.paths['in-progress_dir'], self.file_id))
+                in_progress_dir, self.file_id))
+
+    def get_subfile(self, file_id):
+        """Return the `SubFile` named `file_id`, created once per name"""
+        if file_id not in self.subfiles:
+            self.subfiles[file_id] = SubFile(file_id, self)
+        return self.subfiles[file_id]
 
     def clean_in_progress_file(self):
         """Remove in_progress_file"""
         if not get_option('dry_run', self, self.device):
-            if self.in_progress.is_file():
+            if (stat_cache.is_file(self.in_progress)
+                    or stat_cache.is_link(self.in_progress)):
                 os.remove(self.in_progress)
-            elif self.in_progress.is_dir():
+                stat_cache.invalidate(self.in_progress)
+            elif stat_cache.is_dir(self.in_progress):
                 shutil.rmtree(self.in_progress)
+                stat_cache.invalidate_tree(self.in_progress)
 
 
-class SubFile(CFile):
-    """Subfile of a directory (class CFile)"""
+class SubFile():
+    """Subfile of a directory (class CFile)
+
+    Only the name and the parent are stored, with paths joined to those of
+    the parent when used and settings taken from it, so directories with
+    many entries stay small
+    """
     type = 'subfile'
+    __slots__ = ['parent', 'file_id']
+
     def __init__(self, file_id, cfile):
-        self.device = cfile.device
-        self.device_id = cfile.device_id
-        self.yaml_default = YAML_DEFAULT
+        self.parent = cfile
         self.file_id = file_id
-        self.yaml_device = cfile.yaml_device
-        self.yaml_file = cfile.yaml_file
-        CFile.set_paths(self,
-                        Path(os.path.join(cfile.source, file_id)),
-                        Path(os.path.join(cfile.target, file_id)),
-                        cfile.file_id)
+
+    device = property(lambda self: self.parent.device)
+    device_id = property(lambda self: self.parent.device_id)
+    yaml_default = property(lambda self: self.parent.yaml_default)
+    yaml_device = property(lambda self: self.parent.yaml_device)
+    yaml_file = property(lambda self: self.parent.yaml_file)
+    warnings = property(lambda self: self.parent.warnings)
+    # Owner and group come from the directory
+    stats = property(lambda self: self.parent.stats)
+
+    @property
+    def source(self):
+        """Path of the subfile within `source` of the directory"""
+        return Path(os.path.join(self.parent.source, self.file_id))
+
+    @property
+    def target(self):
+        """Path of the subfile within `target` of the directory"""
+        return Path(os.path.join(self.parent.target, self.file_id))
+
+    @property
+    def target_parent(self):
+        """Absolute path of the directory holding `target`"""
+        return self.target.parent.absolute()
+
+    @property
+    def in_progress(self):
+        """Path of the subfile within `in_progress` of the directory"""
+        return Path(os.path.join(self.parent.in_progress, self.file_id))
+
+    @property
+    def in_progress_hash(self):
+        """Hash of `in_progress` if `tailor_file` wrote it from memory"""
+        return self.parent.in_progress_hashes.get(self.file_id)
+
+    @in_progress_hash.setter
+    def in_progress_hash(self, file_hash):
+        self.parent.in_progress_hashes[self.file_id] = file_hash
+
+    clean_in_progress_file = CFile.clean_in_progress_file
 
 
 def check_for_sudo(xfile, device):
     """Check if filetailor should use sudo
 
-    Called by `copy_file`, `create_dir`, and `backup_or_restore`
+    Called by `copy_file`, `create_dir`, `copy_files`, and
+    `backup_or_restore`
     """
     if ftconfig.sync == RESTORE and get_option('sudo', xfile, device):
         use_sudo = True
@@ -162,45 +250,154 @@ def check_for_sudo(xfile, device):
     return use_sudo
 
 
-def copy_file_with_sudo(in_progress, target, delete):
+def is_preserved_link(xfile, path):
+    """Return True if `path` is a symlink that `xfile` keeps as a link, set
+    by `symlinks: preserve` in YAML, rather than following it
+
+    Called by `tailor_file`, `copy_file`, `diff_dir`, `get_file_status`,
+    `render_file`, and `export_file`
+    """
+
+    return (stat_cache.is_link(path)
+            and get_option('symlinks', xfile, xfile.device) == 'preserve')
+
+
+def copy_link(link, target):
+    """Replace `target` with a symlink pointing where `link` points
+
+    Called by `copy_file`, `tailor_file`, and `write_tailored`
+    """
+
+    if stat_cache.lexists(target):
+        os.remove(target)
+    os.symlink(os.readlink(link), target)
+    stat_cache.invalidate(target)
+
+
+def get_in_progress_hash(in_progress, xfile):
+    """Return the hash of `in_progress`, as computed by `tailor_file` if it
+    wrote the contents from memory, so backup does not read it again
+    """
+
+    if xfile.in_progress_hash is not None:
+        return xfile.in_progress_hash
+    return hash_file(in_progress)
+
+
+def copy_file_with_sudo(in_progress, target, xfile, delete):
     """Copy file with permissions and sudo
 
     Called by `copy_file` (for files and dirs)
     """
 
+    file_hash = None
     if delete:
         shutil.os.system(f'sudo rm "{target}"')
+    elif stat_cache.is_link(in_progress):
+        shutil.os.system(f'sudo ln -sfn "{os.readlink(in_progress)}" '
+                         + f'"{target}"')
     else:
         shutil.os.system(f'sudo cp "{in_progress}" "{target}"')
         # subprocess.run(f'cp --preserve --recursive {source} {target}')
+        if ftconfig.sync == BACKUP:
+            file_hash = get_in_progress_hash(in_progress, xfile)
+    stat_cache.invalidate(target)
+    if ftconfig.sync == BACKUP:
+        filetailor.core.fsck.record(target, file_hash)
 
     return True
 
 
-def copy_file(in_progress, target, xfile, delete):
-    """Copy file with permissions
+def get_metadata(xfile, owner=True, restrict=True):
+    """Return the metadata `xfile.target` should have: the mode, timestamps,
+    and (with the `xattrs` option) extended attributes of `xfile.source`, plus
+    the owner from `xfile.stats` when restoring on Linux
+
+    When restoring over an existing file, only the executable bits of its
+    mode are changed unless `restrict` is False or the `preserve_mode` option
+    is set, so private files are not opened up. Called by `copy_file`,
+    `fix_metadata`, `get_metadata_status`, `plan_chmod`, `render_file`, and
+    `get_mode`
+    """
+
+    metadata = filetailor.helpers.metadata.read(
+        xfile.source, xattrs=get_option('xattrs', xfile, xfile.device))
+    if (restrict and ftconfig.sync in [RESTORE, PLAN]
+            and not get_option('preserve_mode', xfile, xfile.device)):
+        current = stat_cache.stat(xfile.target)
+        if current is not None and stat.S_ISREG(current.st_mode):
+            metadata = metadata._replace(
+                mode=filetailor.helpers.metadata.restrict_mode(
+                    metadata.mode, stat.S_IMODE(current.st_mode)))
+    if (owner and ftconfig.sync == RESTORE and xfile.stats
+            and sys.platform.startswith('linux')):
+        metadata = metadata._replace(uid=xfile.stats[stat.ST_UID],
+                                     gid=xfile.stats[stat.ST_GID])
+
+    return metadata
+
+
+def get_metadata_status(xfile):
+    """Return True if `xfile.target` has the same contents as `xfile.source`
+    but different permissions or extended attributes
+
+    Called by `get_file_status` (for files) and `diff_dir` (for dirs)
+    """
+
+    differences = filetailor.helpers.metadata.get_differences(
+        get_metadata(xfile, owner=False), xfile.target)
+    if differences:
+        logging.debug('Metadata of %s differs: %s', xfile.target, differences)
+
+    return bool(differences)
+
+
+def copy_file(in_progress, target, xfile, delete, metadata=None):
+    """Copy file with permissions, using `metadata` if given and otherwise
+    the metadata of `xfile.source`
 
     Called by `copy_files` (for files and dirs)
     """
 
     copied = False
     if check_for_sudo(xfile, xfile.device):
-        copy_file_with_sudo(in_progress, target, delete)
+        copy_file_with_sudo(in_progress, target, xfile, delete)
     else:
         try:
+            file_hash = None
             if delete:
                 os.remove(target)
+            elif stat_cache.is_link(in_progress):
+                copy_link(in_progress, target)
             else:
-                shutil.copy2(in_progress, target)
-            if ftconfig.sync == RESTORE and sys.platform.startswith('linux'):
-                # Apply permissions
-                os.chown(target, xfile.stats[stat.ST_UID],
-                         xfile.stats[stat.ST_GID])
+                if is_preserved_link(xfile, target):
+                    # Replace the link rather than writing through it
+                    os.remove(target)
+                if metadata is None:
+                    metadata = get_metadata(xfile)
+                if get_option('verify', xfile, xfile.device):
+                    file_hash = copy_verified(
+                        in_progress, target,
+                        get_in_progress_hash(in_progress, xfile), metadata)
+                    if file_hash is None:
+                        stat_cache.invalidate(target)
+                        cprint.error(f'ERROR: Copy of "{in_progress}" does '
+                                     + 'not match it, so '
+                                     + f'"{target}" was not changed.', xfile)
+                        return False
+                else:
+                    update_copy(in_progress, target, metadata)
+                    if ftconfig.sync == BACKUP:
+                        file_hash = get_in_progress_hash(in_progress, xfile)
+            stat_cache.invalidate(target)
+            if ftconfig.sync == BACKUP:
+                filetailor.core.fsck.record(target, file_hash)
             copied = True
         except PermissionError:
             if okay.main(f'Insufficient permissions to create "{target}". '
                          + 'Try with "sudo"?', 'n'):
-                copied = copy_file_with_sudo(in_progress, target, delete)
+                copied = copy_file_with_sudo(in_progress, target, xfile,
+                                             delete)
             else:
                 copied = False
 
@@ -227,7 +424,7 @@ def create_dir(path, xfile):
     `copy_files` (for files and dirs) and `copy_subfiles` (for dirs)
     """
 
-    if path.is_dir():
+    if stat_cache.is_dir(path):
         dir_exists = True
     else:
         dir_exists = False
@@ -252,6 +449,9 @@ def create_dir(path, xfile):
                         dir_exists = create_dir_with_sudo(path)
                     else:
                         dir_exists = False
+            # Parents may have been created as well
+            for created in [path, *path.parents]:
+                stat_cache.invalidate(created)
 
     return dir_exists
 
@@ -269,12 +469,18 @@ def copy_files(xfile, delete=False):
     if (ftconfig.sync == RESTORE
             and not get_option('no_backup', xfile, xfile.device)
             and not get_option('dry_run', xfile, xfile.device)):
-        # Create backup
-        if xfile.target.is_file():
-            copy_file(xfile.target, xfile.target.with_suffix('.filetailor_backup'),
-                      xfile, False)
+        # Save target to this run's snapshot
+        try:
+            filetailor.core.snapshot.save(
+                xfile.target, check_for_sudo(xfile, xfile.device))
+        except OSError as error:
+            # Without its snapshot the target could not be rolled back
+            cprint.error(f'ERROR: Could not save "{xfile.target}" to snapshot '
+                         + f'({error}), so it was not changed.', xfile)
+            print()
+            return
 
-    if not args.dry_run:
+    if not ftconfig.args.dry_run:
         if copy_file(xfile.in_progress, xfile.target, xfile, delete):
             if delete:
                 cprint.success(f'Deleted "{xfile.target}".')
@@ -283,6 +489,38 @@ def copy_files(xfile, delete=False):
             print()
 
 
+def fix_metadata(xfile):
+    """Apply permissions and extended attributes of `xfile.source` to
+    `xfile.target` without copying its contents
+
+    Called by `handle_file_status` (for files) and `copy_subfiles` (for dirs)
+    """
+
+    metadata = get_metadata(xfile)
+    if check_for_sudo(xfile, xfile.device):
+        shutil.os.system(f'sudo chmod {metadata.mode:o} "{xfile.target}"')
+    else:
+        try:
+            filetailor.helpers.metadata.apply(xfile.target, metadata)
+        except PermissionError:
+            cprint.error('Insufficient permissions to update '
+                         + f'"{xfile.target}".')
+            return
+    stat_cache.invalidate(xfile.target)
+    cprint.success(f'Updated permissions of "{xfile.target}".')
+    print()
+
+
+def get_prompt_contents(xfile, verb):
+    """Return the hash of the file a prompt to apply `verb` to `xfile` is
+    about, so an answer is only reused for the same contents
+    """
+
+    if verb in [DELETE, FIX_METADATA]:
+        return hash_file(xfile.target)
+    return hash_file(xfile.in_progress)
+
+
 def copy_subfiles(cfile, subfiles_list, verb):
     """Tailor subfiles within a directory
 
@@ -291,51 +529,94 @@ def copy_subfiles(cfile, subfiles_list, verb):
 
     if subfiles_list and len(subfiles_list):
         delete = (verb == DELETE)
-        response = okay.get_response(f'\n{verb} files?', 'a')
+        response = filetailor.core.journal.answer(
+            f'{verb}:{cfile.file_id}', lambda: sorted(subfiles_list),
+            lambda: okay.get_response(f'\n{verb} files?', 'a'))
         if response != 'n':
             if not create_dir(cfile.target, cfile):
                 return
             for file_id in subfiles_list:
-                subfile = SubFile(file_id, cfile)
-                subfile.stats = cfile.stats
-                if verb == UPDATE:
+                subfile = cfile.get_subfile(file_id)
+                if (verb == UPDATE
+                        and not get_option('no_diff', cfile, cfile.device)):
                     diff(subfile.target, subfile.in_progress)
-                if response == 'a':
-                    # Copy/delete each file without asking
-                    if not get_option('dry_run', cfile, cfile.device):
-                        copy_files(subfile, delete)
-                elif okay.main(f'{verb} "{file_id}"?', 'd',
-                               obj1=cfile, obj2=cfile.device,
-                               src=subfile.source, dst=subfile.target):
-                    # Asked to copy/delete file, answer was yes
-                    if not get_option('dry_run', cfile, cfile.device):
+                # Copy/delete each file without asking if answer was "a"
+                if (response == 'a'
+                        or filetailor.core.journal.answer(
+                            f'{verb}:{cfile.file_id}/{file_id}',
+                            lambda subfile=subfile: get_prompt_contents(
+                                subfile, verb),
+                            lambda subfile=subfile, file_id=file_id: okay.main(
+                                f'{verb} "{file_id}"?',
+                                'y' if verb == FIX_METADATA else 'd',
+                                obj1=cfile, obj2=cfile.device,
+                                src=subfile.source, dst=subfile.target))):
+                    if get_option('dry_run', cfile, cfile.device):
+                        pass
+                    elif verb == FIX_METADATA:
+                        fix_metadata(subfile)
+                    else:
                         copy_files(subfile, delete)
                 subfile.clean_in_progress_file()
 
 
-def tailor_file(xfile):
+def write_bytes(path, data):
+    """Write `data` to `path` in one call"""
+
+    with open(path, 'wb', buffering=0) as write_file:
+        write_file.write(data)
+    filetailor.helpers.throttle.wait(len(data))
+
+
+def tailor_file(xfile, read_ahead=None):
     """Backup or restore a single file; return True if files differ
 
-    Called by `get_file_status` (for files) and `diff_dir` (for dirs)
+    Contents of the source and target are taken from `read_ahead` where it
+    read them. Called by `get_file_status` (for files) and `diff_dir` (for
+    dirs)
     """
 
     logging.debug('xfile.source = %s', xfile.source)
     logging.debug('target = %s', xfile.target)
 
+    (source_data, target_data) = (None, None)
+    if read_ahead is not None:
+        source_data = read_ahead.get(xfile.source)
+        target_data = read_ahead.get(xfile.target)
+
+    if is_preserved_link(xfile, xfile.source):
+        # Compare where the links point instead of their contents
+        copy_link(xfile.source, xfile.in_progress)
+        return not (stat_cache.is_link(xfile.target)
+                    and os.readlink(xfile.target) == os.readlink(xfile.source))
+    if is_preserved_link(xfile, xfile.target):
+        # Replacing a link with a file
+        fast_copy(xfile.source, xfile.in_progress)
+        stat_cache.invalidate(xfile.in_progress)
+        return True
+
     # Convert all variables in source_text
-    source_tailored = filetailor.helpers.tailor_lines.main(xfile)
+    source_tailored = filetailor.helpers.tailor_lines.main(xfile, source_data)
     logging.debug('source_tailored = %s', source_tailored)
 
-    # Write source_tailored to a file (in_progress_file)
-    with open(xfile.in_progress, 'w', encoding='UTF-8') as in_progress_file:
-        if source_tailored:
-            in_progress_file.writelines(source_tailored)
-        else:
-            in_progress_file = xfile
-
-    # Compare files
-    if (xfile.target.is_file()
-            and filecmp.cmp(xfile.in_progress, xfile.target, shallow=False)):
+    if source_tailored is False and source_data is None:
+        # Binary or untailored, so copy as is (a reflink where supported)
+        fast_copy(xfile.source, xfile.in_progress)
+    else:
+        if source_tailored is not False:
+            # Line endings as writing in text mode would give
+            source_data = ''.join(source_tailored).replace(
+                '\n', os.linesep).encode('UTF-8')
+        write_bytes(xfile.in_progress, source_data)
+    stat_cache.invalidate(xfile.in_progress)
+
+    # Compare files, in memory if both were read
+    if target_data is not None:
+        files_same = target_data == source_data
+    else:
+        files_same = (stat_cache.is_file(xfile.target)
+                      and compare_files(xfile.in_progress, xfile.target))
+    if files_same:
         # Files are identical
         logging.debug('Skipping %s, identical', xfile.source)
         files_differ = False
@@ -344,27 +625,75 @@ def tailor_file(xfile):
         # Files differ
         logging.debug('Diffing %s', xfile.source)
         files_differ = True
+        if source_data is not None and (
+                ftconfig.sync == BACKUP
+                or get_option('verify', xfile, xfile.device)):
+            # Recorded or checked by `copy_file` without reading the file
+            # again
+            xfile.in_progress_hash = hash_bytes(source_data)
 
     return files_differ
 
 
-def filter_subfiles(search_criteria, subfiles, return_matching):
-    """Return list of `subfiles` matching `p` if `return_matching` is True
-    and return list of subfiles not matching `p` if `return_matching` is False
+def get_content_filter(cfile):
+    """Return the filter for subfiles set by `include_contents` and
+    `exclude_contents`, compiled once for each entry in YAML
+
+    Called by `get_ignores` and `diff_dir`
+    """
+
+    def freeze(value):
+        # Lists from YAML cannot be cache keys
+        if value is None or isinstance(value, str):
+            return value
+        return tuple(value)
+
+    # Also ignore `.filetailor_backup` files left by older versions
+    return filetailor.helpers.pathspec.main(
+        freeze(cfile.yaml_file.get('include_contents')),
+        freeze(cfile.yaml_file.get('exclude_contents')),
+        r'\.filetailor_backup$')
+
+
+def get_ignores(cfile, subfiles):
+    """Return the `subfiles` excluded by `cfile` settings and backups
+
+    Called by `render_file` and `export_file`
+    """
+
+    content_filter = get_content_filter(cfile)
+    return [subfile for subfile in subfiles
+            if content_filter.is_ignored(subfile)]
+
+
+def list_subfiles(cfile, path):
+    """Return (files, links) directly within `path` that are synced, where
+    `links` are symlinks kept by `symlinks: preserve`; subdirectories are
+    not synced and not entered
 
     Called by `diff_dir` (for dirs)
     """
 
-    matching = []
-    for subfile in subfiles:
-        matches = search_criteria.search(subfile)
-        if ((matches and return_matching)
-                or (not matches and not return_matching)):
-            # Ignore all files that match the filter
-            # and ignore all files not matching the filter
-            matching.append(subfile)
+    if not stat_cache.is_dir(path):
+        return (set(), set())
+    (_, dirs, files) = next(filetailor.helpers.pathspec.walk(
+        path, get_content_filter(cfile)))
+    links = {file_id for file_id in dirs + files
+             if is_preserved_link(cfile, path / file_id)}
+
+    return (set(files) - links, links)
 
-    return matching
+
+def get_signature(path):
+    """Return the type, size, and modification time of `path`, which
+    `filecmp` treats as the same contents when they match, or None if it
+    does not exist
+    """
+
+    stats = stat_cache.stat(path)
+    if stats is None:
+        return None
+    return (stat.S_IFMT(stats.st_mode), stats.st_size, stats.st_mtime)
 
 
 def diff_dir(cfile):
@@ -375,58 +704,64 @@ def diff_dir(cfile):
     Called by `get_file_status` (for dirs)
     """
 
-    # Ignore subdirectories
-    # os.walk returns root, dirs, files, so os.walk(cfile.source))[1] returns all dirs
-    ignores = next(os.walk(cfile.source))[1]
-    try:
-        if ftconfig.sync in [STATUS, RESTORE]:
-            ignores += next(os.walk(cfile.local))[1]
-    except StopIteration:
-        pass
-
-    # Get subfiles from source and target
-    if cfile.target.is_dir():
-        subfiles = os.listdir(cfile.source) + os.listdir(cfile.target)
-    else:
-        subfiles = os.listdir(cfile.source)
-
-    # Ignore `.filetailor_backup` files
-    search_criteria = re.compile(r'\.filetailor_backup$')
-    ignores += filter_subfiles(search_criteria, subfiles, True)
-
-    # Update ignores based on YAML
-    if 'include_contents' in cfile.yaml_file:
-        search_criteria = re.compile(cfile.yaml_file['include_contents'])
-        ignores += filter_subfiles(search_criteria, subfiles, False)
-    if 'exclude_contents' in cfile.yaml_file:
-        search_criteria = re.compile(cfile.yaml_file['exclude_contents'])
-        ignores += filter_subfiles(search_criteria, subfiles, True)
-
-    # Create cfile in in-progress_dir
-    if not cfile.in_progress.is_dir():
-        if not get_option('dry_run', cfile, cfile.device):
-            os.mkdir(cfile.in_progress)
-
-    # Compare source to target directory
-    if cfile.target.is_dir():
-        dircmp_report = filecmp.dircmp(cfile.source, cfile.target,
-                                       ignore=ignores)
-        # Get subfiles changed, new, and delete
-        if dircmp_report.diff_files:
-            for file_id in dircmp_report.diff_files:
-                subfile = SubFile(file_id, cfile)
-                if tailor_file(subfile):
-                    cfile.changed.append(subfile.file_id)
-        cfile.new = dircmp_report.left_only
-        cfile.delete = dircmp_report.right_only
-    else:
-        # Target directory does not exist, all files are new
-        cfile.new = set(subfiles) - set(ignores)
-
-    if cfile.new:
+    (source_files, source_links) = list_subfiles(cfile, cfile.source)
+    (target_files, target_links) = list_subfiles(cfile, cfile.target)
+
+    # Create cfile in in-progress_dir, even on dry runs since subfiles are
+    # still tailored there to compare them
+    if not stat_cache.is_dir(cfile.in_progress):
+        os.mkdir(cfile.in_progress)
+        stat_cache.invalidate(cfile.in_progress)
+
+    # Compare source to target directory, files found in both by size and
+    # modification time first. Others are tailored and compared in full, so
+    # are not read here as well.
+    (same_files, diff_files) = ([], [])
+    for file_id in sorted(source_files & target_files):
+        source_signature = get_signature(
+            os.path.join(cfile.source, file_id))
+        target_signature = get_signature(
+            os.path.join(cfile.target, file_id))
+        if None in (source_signature, target_signature):
+            # Broken symlinks, which `filecmp` also skips
+            continue
+        if source_signature == target_signature:
+            same_files.append(file_id)
+        else:
+            diff_files.append(file_id)
+    cfile.new = sorted(source_files - target_files)
+    cfile.delete = sorted(target_files - source_files)
+
+    # Read the next files while each is tailored, in the order they are
+    paths = []
+    for file_id in diff_files:
+        subfile = cfile.get_subfile(file_id)
+        paths += [subfile.source, subfile.target]
+    paths += [cfile.get_subfile(file_id).source for file_id in cfile.new]
+    with ReadAhead(paths) as read_ahead:
+        for file_id in diff_files:
+            subfile = cfile.get_subfile(file_id)
+            if tailor_file(subfile, read_ahead):
+                cfile.changed.append(subfile.file_id)
+            elif get_metadata_status(subfile):
+                cfile.metadata.append(subfile.file_id)
         for file_id in cfile.new:
-            subfile = SubFile(file_id, cfile)
+            tailor_file(cfile.get_subfile(file_id), read_ahead)
+    for file_id in same_files:
+        subfile = cfile.get_subfile(file_id)
+        if get_metadata_status(subfile):
+            cfile.metadata.append(subfile.file_id)
+
+    # Compare preserved links separately, without descending into them
+    for file_id in sorted(source_links | target_links):
+        subfile = cfile.get_subfile(file_id)
+        if not stat_cache.lexists(subfile.source):
+            cfile.delete.append(file_id)
+        elif not stat_cache.lexists(subfile.target):
+            cfile.new.append(file_id)
             tailor_file(subfile)
+        elif tailor_file(subfile):
+            cfile.changed.append(file_id)
 
     # Determine if directories differ
     files_differ = cfile.changed or cfile.new or cfile.delete
@@ -434,31 +769,29 @@ def diff_dir(cfile):
     return files_differ
 
 
-def get_file_status(cfile, cdevice):
-    """Tailor file and return if files differ
+def is_for_device(cfile):
+    """Return False if `include_devices` or `exclude_devices` in YAML leave
+    out the device of `cfile`
 
-    Called by `status` and `backup_or_restore`
+    Called by `get_file_status`, `render_file`, and `export`
     """
 
-    # Loop through each file to perform the sync operation
-    logging.debug('Beginning %s', cfile.file_id)
-
-    # Check if file is for this device
     if 'include_devices' in cfile.yaml_file:
-        if cdevice.device_id not in cfile.yaml_file['include_devices']:
-            logging.debug('Skipping %s, host not in included list',
-                          cfile.file_id)
-            return SKIP
-    elif 'exclude_devices' in cfile.yaml_file:
-        if cdevice.device_id in cfile.yaml_file['exclude_devices']:
-            logging.debug('Skipping %s, host in excluded list',
-                          cfile.file_id)
-            return SKIP
+        return cfile.device_id in cfile.yaml_file['include_devices']
+    if 'exclude_devices' in cfile.yaml_file:
+        return cfile.device_id not in cfile.yaml_file['exclude_devices']
+    return True
 
-    run_script(cfile, 'before', ftconfig.sync)
+
+def define_paths(cfile):
+    """Set the `sync`, `local`, `source`, `target`, and `in_progress` paths
+
+    Called by `get_file_status` and `can_prefetch`
+    """
 
     # Define file locations `sync` and `local`
-    cfile.sync = Path(os.path.join(ftconfig.paths['sync_dir'], cfile.file_id))
+    cfile.sync = Path(os.path.join(filetailor.core.store.get_sync_dir(),
+                                   cfile.file_id))
     staging_dir = get_option('staging', cfile, cfile.device)
     if staging_dir:
         cfile.local = Path(os.path.join(
@@ -473,7 +806,7 @@ def get_file_status(cfile, cdevice):
         source = cfile.local
         target = cfile.sync
 
-    elif ftconfig.sync in [STATUS, RESTORE]:
+    elif ftconfig.sync in [STATUS, RESTORE, PLAN]:
         source = cfile.sync
         target = cfile.local
 
@@ -481,25 +814,56 @@ def get_file_status(cfile, cdevice):
     # also set `in_progress` path
     cfile.set_paths(source, target)
 
+
+def get_file_status(cfile, cdevice):
+    """Tailor file and return if files differ
+
+    Called by `status` and `backup_or_restore`
+    """
+
+    # Loop through each file to perform the sync operation
+    logging.debug('Beginning %s', cfile.file_id)
+
+    # Check if file is for this device
+    if not is_for_device(cfile):
+        logging.debug('Skipping %s, host not included or excluded',
+                      cfile.file_id)
+        return SKIP
+
+    run_script(cfile, 'before', ftconfig.sync)
+
+    define_paths(cfile)
+
+    if (ftconfig.sync == STATUS and ftconfig.git_saved
+            and filetailor.core.git_status.is_unchanged(cfile)):
+        logging.debug('Skipping %s, unchanged since it last matched',
+                      cfile.file_id)
+        return SAME
+    if (ftconfig.journal_entries
+            and filetailor.core.journal.is_done(cfile)):
+        logging.debug('Skipping %s, done by the interrupted run',
+                      cfile.file_id)
+        return SAME
+
     # Copy owner and group from `local` (same as `target`)
     if ftconfig.sync in [RESTORE]:
 
-        if not cfile.target.exists() and not cfile.target_parent.is_dir():
+        if not stat_cache.exists(cfile.target) and not stat_cache.is_dir(cfile.target_parent):
             # Target nor its parent exist, so offer to create parent dir
             cprint.plain(f'For "{cfile.file_id}", local file\'s parent directory '
                          + f'"{cfile.target_parent}" does not exist.')
             if not create_dir(cfile.target_parent, cfile):
                 return SKIP
 
-        if cfile.target.exists():
+        if stat_cache.exists(cfile.target):
             # Target exists
-            cfile.stats = os.stat(cfile.local)
+            cfile.stats = stat_cache.stat(cfile.local)
             logging.debug('stats[stat.ST_UID] = %s', cfile.stats[stat.ST_UID])
             logging.debug('stats[stat.ST_GID] = %s', cfile.stats[stat.ST_GID])
             logging.debug('stats[stat.st_mode] = %s', cfile.stats[stat.ST_MODE])
         else:
             # Parent of target exists
-            cfile.stats = os.stat(cfile.target_parent)
+            cfile.stats = stat_cache.stat(cfile.target_parent)
             logging.debug('stats[stat.ST_UID] = %s', cfile.stats[stat.ST_UID])
             logging.debug('stats[stat.ST_GID] = %s', cfile.stats[stat.ST_GID])
             logging.debug('stats[stat.st_mode] = %s', cfile.stats[stat.ST_MODE])
@@ -507,37 +871,50 @@ def get_file_status(cfile, cdevice):
     # Tailor and compare files
     # First check if a file/directory of opposite type will block creating
     # a new file.
-    if cfile.source.is_file():
+    if is_preserved_link(cfile, cfile.source):
+        # For symlinks kept as links
+        files_differ = tailor_file(cfile)
+        if not stat_cache.lexists(cfile.target):
+            file_status = MISSING_TARGET
+        elif files_differ:
+            file_status = DIFFERENT
+        else:
+            file_status = SAME
+    elif stat_cache.is_file(cfile.source):
         # For files
-        if cfile.target.is_dir():
+        if stat_cache.is_dir(cfile.target):
             cprint.plain(f'Trying to copy file "{cfile.file_id}" to '
                          + f'"{cfile.target}", but a directory (not file) of '
                          + 'the same name already exists. Skipping.')
-            return
+            return CONFLICT
         files_differ = tailor_file(cfile)
-        if cfile.target.is_file():
+        if stat_cache.is_file(cfile.target):
             if files_differ:
                 file_status = DIFFERENT
+            elif get_metadata_status(cfile):
+                file_status = METADATA
             else:
                 file_status = SAME
         else:
             file_status = MISSING_TARGET
-    elif cfile.source.is_dir():
+    elif stat_cache.is_dir(cfile.source):
         # For directories
-        if cfile.target.is_file():
+        if stat_cache.is_file(cfile.target):
             cprint.plain(f'Trying to copy directory "{cfile.file_id}" to '
                          + f'"{cfile.target}", but a file (not directory) of '
                          + 'the same name already exists. Skipping.')
-            return
+            return CONFLICT
         files_differ = diff_dir(cfile)
-        if cfile.target.is_dir():
+        if stat_cache.is_dir(cfile.target):
             if files_differ:
                 file_status = DIFFERENT
+            elif cfile.metadata:
+                file_status = METADATA
             else:
                 file_status = SAME
         else:
             file_status = MISSING_TARGET
-    elif cfile.target.exists():
+    elif stat_cache.exists(cfile.target):
         file_status = MISSING_SOURCE
     else:
         file_status = MISSING_BOTH
@@ -545,6 +922,20 @@ def get_file_status(cfile, cdevice):
     return file_status
 
 
+def copy_yaml():
+    """Copy YAML so vars can be replaced without modifying `ftconfig`; return
+    the copy of the devices
+
+    Called by `setup` and `init_worker`
+    """
+
+    # Get YAML
+    ftconfig.yaml_default_copy = copy.deepcopy(ftconfig.yaml_default)
+    ftconfig.yaml_files_copy = copy.deepcopy(ftconfig.yaml_files)
+
+    return copy.deepcopy(ftconfig.yaml_devices)
+
+
 def setup():
     """Get current device with YAML and files to sync
 
@@ -552,15 +943,7 @@ def setup():
     """
 
     logging.debug('Running setup')
-    global args
-    args = ftconfig.args
-
-    # Get YAML
-    global YAML_DEFAULT
-    YAML_DEFAULT = copy.deepcopy(ftconfig.yaml_default)
-    yaml_devices = copy.deepcopy(ftconfig.yaml_devices)
-    global yaml_files
-    yaml_files = copy.deepcopy(ftconfig.yaml_files)
+    yaml_devices = copy_yaml()
 
     # Get current device
     device_id = ftconfig.device_id
@@ -574,13 +957,14 @@ def setup():
     cdevice = CDevice(device_id, yaml_devices)
 
     # Get list of files to operate on
-    if args.FILES == []:
+    yaml_files = ftconfig.yaml_files_copy
+    if ftconfig.args.FILES == []:
         # Use all files in YAML if user didn't specify any
         files = yaml_files.keys()
     else:
         # If the user specified files, use those
         files = []
-        for file_id in args.FILES:
+        for file_id in ftconfig.args.FILES:
             if file_id in yaml_files:
                 # Check file exists in the YAML
                 files.append(file_id)
@@ -596,6 +980,9 @@ def run_script(cfile, time, operation):
     Called by `backup_or_restore`
     """
 
+    if get_option('no_scripts'):
+        # Background refreshes of the status summary
+        return
     if time == 'before':
         if operation in [STATUS, BACKUP]:
             script_name = 'before_backup'
@@ -612,10 +999,76 @@ def run_script(cfile, time, operation):
         cprint.plain(f'For file "{cfile.file_id}", running {script_name} '
                      + f'script "{script_command}"')
         shutil.os.system(script_command)
+        # Scripts may change any path
+        stat_cache.clear()
     except (KeyError, TypeError, UnboundLocalError):
         pass
 
 
+def has_scripts(cfile):
+    """Return True if YAML scripts will run for `cfile`
+
+    Called by `can_prefetch` and `backup_or_restore`
+    """
+    return 'scripts' in cfile.yaml_file and not get_option('no_scripts')
+
+
+def can_prefetch(cfile):
+    """Return True if `get_file_status` will neither prompt, print, nor run
+    scripts for `cfile`, so it can run ahead of time in a worker thread
+
+    Called by `backup_or_restore`
+    """
+
+    if has_scripts(cfile):
+        # Scripts must run in order, right before the file is tailored
+        return False
+
+    define_paths(cfile)
+    if (ftconfig.sync == RESTORE
+            and not stat_cache.exists(cfile.target)
+            and not stat_cache.is_dir(cfile.target_parent)):
+        # Asks to create parent directory
+        return False
+    if ((stat_cache.is_file(cfile.source) and stat_cache.is_dir(cfile.target))
+            or (stat_cache.is_dir(cfile.source) and stat_cache.is_file(cfile.target))):
+        # Reports file and directory conflict
+        return False
+
+    return True
+
+
+def report_warnings(cfile):
+    """Show warnings found while tailoring `cfile`
+
+    Called by `backup_or_restore`
+    """
+
+    for warning in cfile.warnings:
+        cprint.error(warning, cfile)
+        if not get_option('assumeyes', cfile, cfile.device):
+            input('Press return to continue.')
+
+
+def get_result(cfile, file_status):
+    """Return the status of `cfile` as a dictionary, for `Session`
+
+    Called by `backup_or_restore`
+    """
+
+    return {
+        'file_id': cfile.file_id,
+        'status': file_status,
+        'source': str(cfile.source),
+        'target': str(cfile.target),
+        'changed': list(cfile.changed),
+        'new': list(cfile.new or []),
+        'delete': list(cfile.delete or []),
+        'metadata': list(cfile.metadata),
+        'warnings': list(cfile.warnings),
+    }
+
+
 def backup_or_restore():
     """Copy files from/to local machine and sync_dir
 
@@ -623,75 +1076,154 @@ def backup_or_restore():
     """
 
     (cdevice, files) = setup()
-    for file_id in files:
-
-        # Replace vars in file YAML
-        cfile = CFile(file_id, cdevice)
+    stat_cache.clear()
+    ftconfig.results = []
+    ftconfig.manifest_updates = {}
+    filetailor.helpers.throttle.setup()
+
+    # Replace vars in file YAML
+    cfiles = [CFile(file_id, cdevice) for file_id in files]
+    since = get_option('since')
+    if since:
+        # Only files changed in sync_dir since the revision
+        changed = filetailor.core.git_status.get_changed_since(since)
+        cfiles = [cfile for cfile in cfiles if cfile.file_id in changed]
+    file_ids = [cfile.file_id for cfile in cfiles if is_for_device(cfile)]
+    filetailor.core.store.checkout(file_ids)
+
+    # Skip comparing files unchanged since they last matched
+    incremental = ftconfig.sync == STATUS and not get_option('staging')
+    if incremental:
+        filetailor.core.git_status.load()
+    filetailor.core.journal.start()
+
+    # Tailor and compare upcoming files in the background while the user
+    # answers prompts, but handle each file in YAML order. Files after one
+    # with scripts wait for it, since its scripts may change them.
+    with ThreadPoolExecutor() as executor:
+        prefetched = {}
+        for (index, cfile) in enumerate(cfiles):
+            for upcoming in cfiles[index:index + PREFETCH]:
+                if has_scripts(upcoming):
+                    break
+                if upcoming.file_id not in prefetched and can_prefetch(upcoming):
+                    prefetched[upcoming.file_id] = executor.submit(
+                        ftconfig.bind(get_file_status), upcoming, cdevice)
+            if cfile.file_id in prefetched:
+                file_status = prefetched[cfile.file_id].result()
+            else:
+                file_status = get_file_status(cfile, cdevice)
+            if file_status == SKIP:
+                continue
+            report_warnings(cfile)
+            ftconfig.results.append(get_result(cfile, file_status))
+            handle_file_status(cfile, file_status)
+
+    if ftconfig.sync == BACKUP and not ftconfig.args.dry_run:
+        filetailor.core.store.commit(file_ids)
+        filetailor.core.fsck.save()
+    filetailor.core.journal.finish()
+    filetailor.helpers.tailor_lines.prune_templates()
+
+    if incremental:
+        same = {result['file_id'] for result in ftconfig.results
+                if result['status'] == SAME}
+        filetailor.core.git_status.save(
+            [cfile for cfile in cfiles if cfile.file_id in same])
+
+    # Save counts for `status --cached` when every file was checked
+    if (ftconfig.sync == STATUS and ftconfig.args.FILES == []
+            and not since and not get_option('staging')):
+        filetailor.core.summary.save(
+            ftconfig.results, {ftconfig.device_id, ftconfig.args.device})
+
+
+def handle_file_status(cfile, file_status):
+    """Report status of `cfile` or ask to copy it
 
-        file_status = get_file_status(cfile, cdevice)
-        if file_status == SKIP:
-            continue
+    Called by `backup_or_restore`
+    """
 
-        # If running status, report the status
-        if ftconfig.sync == STATUS and file_status == SAME:
-            cprint.same(f'No change: {cfile.file_id}')
-        elif ftconfig.sync == STATUS and file_status == DIFFERENT:
-            cprint.differ(f'Modified: {cfile.file_id}')
-        elif ftconfig.sync == STATUS and file_status == MISSING_TARGET:
+    # If running status, report the status
+    if ftconfig.sync == STATUS and file_status == SAME:
+        cprint.same(f'No change: {cfile.file_id}')
+    elif ftconfig.sync == STATUS and file_status == DIFFERENT:
+        cprint.differ(f'Modified: {cfile.file_id}')
+    elif ftconfig.sync == STATUS and file_status == METADATA:
+        cprint.differ(f'Permissions changed: {cfile.file_id}')
+    elif ftconfig.sync == STATUS and file_status == MISSING_TARGET:
+        cprint.differ(f'Not in local directory: "{cfile.file_id}" does '
+                      + f'not exist at "{cfile.target}".')
+
+    # Report issue if missing source
+    elif file_status in [MISSING_SOURCE, MISSING_BOTH]:
+        if ftconfig.sync in [BACKUP]:
             cprint.differ(f'Not in local directory: "{cfile.file_id}" does '
-                          + f'not exist at "{cfile.target}".')
-
-        # Report issue if missing source
-        elif file_status in [MISSING_SOURCE, MISSING_BOTH]:
-            if ftconfig.sync in [BACKUP]:
-                cprint.differ(f'Not in local directory: "{cfile.file_id}" does '
-                              + f'not exist at "{cfile.source}".')
-            if ftconfig.sync in [STATUS, RESTORE]:
-                cprint.differ(f'Not in sync directory: "{cfile.file_id}" does '
-                              + f'not exist at "{cfile.source}".')
-
-        # If running backup/restore and not missing source, update files
-        elif file_status in [DIFFERENT, MISSING_TARGET]:
-
-            if cfile.source.is_file():
-                # For files
-                # Print diff or state target doesn't exist
-                if file_status == DIFFERENT:
-                    if not get_option('no_diff', cfile, cfile.device):
-                        diff(cfile.target, cfile.in_progress)
-                elif file_status == MISSING_TARGET:
-                    cprint.plain(f'For "{cfile.file_id}", '
-                                 + f'"{cfile.target}" does not exist.')
-                cprint.plain('')
-
-                # Copy file
-                if check_for_sudo(cfile, cfile.device):
-                    cprint.plain('Using "sudo"...')
-                if okay.main(f'Copy file "{cfile.file_id}"?', 'd',
-                             obj1=cfile, obj2=cfile.device,
-                             src=cfile.in_progress, dst=cfile.target):
-                    copy_files(cfile)
-
-            elif cfile.source.is_dir():
-                # For directories
-                cprint.differ(f'\nDIRECTORY: {cfile.file_id}')
-                if cfile.changed:
-                    cprint.plain('\nFiles to update:')
-                    cprint.plain(cfile.changed)
-                if cfile.new:
-                    cprint.plain('\nNew files to add:')
-                    cprint.plain(cfile.new)
-                if cfile.delete:
-                    cprint.plain('\nOld files to delete:')
-                    cprint.plain(cfile.delete)
-                copy_subfiles(cfile, cfile.changed, UPDATE)
-                copy_subfiles(cfile, cfile.new, ADD_NEW)
-                copy_subfiles(cfile, cfile.delete, DELETE)
-
-        if file_status != SKIP:
-            if ftconfig.sync == STATUS:
-                cfile.clean_in_progress_file()
-            run_script(cfile, 'after', ftconfig.sync)
+                          + f'not exist at "{cfile.source}".')
+        if ftconfig.sync in [STATUS, RESTORE, PLAN]:
+            cprint.differ(f'Not in sync directory: "{cfile.file_id}" does '
+                          + f'not exist at "{cfile.source}".')
+
+    # Only permissions differ, so update them without copying
+    elif file_status == METADATA and stat_cache.is_file(cfile.source):
+        if filetailor.core.journal.answer(
+                f'{FIX_METADATA}:{cfile.file_id}',
+                lambda: get_prompt_contents(cfile, FIX_METADATA),
+                lambda: okay.main(f'Fix permissions of "{cfile.file_id}"?',
+                                  'y', obj1=cfile, obj2=cfile.device)):
+            if not get_option('dry_run', cfile, cfile.device):
+                fix_metadata(cfile)
+
+    # If running backup/restore and not missing source, update files
+    elif file_status in [DIFFERENT, MISSING_TARGET, METADATA]:
+
+        if stat_cache.is_file(cfile.source) or is_preserved_link(cfile, cfile.source):
+            # For files
+            # Print diff or state target doesn't exist
+            if file_status == DIFFERENT:
+                if not get_option('no_diff', cfile, cfile.device):
+                    diff(cfile.target, cfile.in_progress)
+            elif file_status == MISSING_TARGET:
+                cprint.plain(f'For "{cfile.file_id}", '
+                             + f'"{cfile.target}" does not exist.')
+            cprint.plain('')
+
+            # Copy file
+            if check_for_sudo(cfile, cfile.device):
+                cprint.plain('Using "sudo"...')
+            if filetailor.core.journal.answer(
+                    f'{UPDATE}:{cfile.file_id}',
+                    lambda: get_prompt_contents(cfile, UPDATE),
+                    lambda: okay.main(f'Copy file "{cfile.file_id}"?', 'd',
+                                      obj1=cfile, obj2=cfile.device,
+                                      src=cfile.in_progress,
+                                      dst=cfile.target)):
+                copy_files(cfile)
+
+        elif stat_cache.is_dir(cfile.source):
+            # For directories
+            cprint.differ(f'\nDIRECTORY: {cfile.file_id}')
+            if cfile.changed:
+                cprint.plain('\nFiles to update:')
+                cprint.plain(cfile.changed)
+            if cfile.new:
+                cprint.plain('\nNew files to add:')
+                cprint.plain(cfile.new)
+            if cfile.delete:
+                cprint.plain('\nOld files to delete:')
+                cprint.plain(cfile.delete)
+            if cfile.metadata:
+                cprint.plain('\nFiles with permissions to fix:')
+                cprint.plain(cfile.metadata)
+            copy_subfiles(cfile, cfile.changed, UPDATE)
+            copy_subfiles(cfile, cfile.new, ADD_NEW)
+            copy_subfiles(cfile, cfile.delete, DELETE)
+            copy_subfiles(cfile, cfile.metadata, FIX_METADATA)
+
+    if ftconfig.sync == STATUS:
+        cfile.clean_in_progress_file()
+    run_script(cfile, 'after', ftconfig.sync)
+    filetailor.core.journal.done(cfile)
 
 
 def status():
@@ -712,4 +1244,5 @@ def restore():
     """Copy files from sync_dir to local machine"""
     logging.debug('Running restore')
     backup_or_restore()
+    filetailor.core.snapshot.finish()
     cprint.plain('\nRestore complete!\n')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Compare file contents, reading only the data extents of sparse files"""
+
+import os
+
+import filetailor.helpers.throttle
+from filetailor.helpers.fast_copy import BUFFER_SIZE, get_data_extents, is_sparse
+
+
+def get_ranges(fd1, fd2, stats1, stats2):
+    """Return ranges that may differ, merging data extents of sparse files
+    since holes read as zeros in both
+    """
+
+    size = stats1.st_size
+    if not (is_sparse(stats1) or is_sparse(stats2)):
+        return [(0, size)]
+
+    extents = sorted(get_data_extents(fd1, size)
+                     + get_data_extents(fd2, size))
+    ranges = []
+    for (start, end) in extents:
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+        else:
+            ranges.append((start, end))
+
+    return ranges
+
+
+def main(path1, path2):
+    """Return True if `path1` and `path2` have the same contents
+
+    Called by `tailor_file`
+    """
+
+    with open(path1, 'rb') as file1, open(path2, 'rb') as file2:
+        (fd1, fd2) = (file1.fileno(), file2.fileno())
+        (stats1, stats2) = (os.fstat(fd1), os.fstat(fd2))
+        if stats1.st_size != stats2.st_size:
+            return False
+
+        for (start, end) in get_ranges(fd1, fd2, stats1, stats2):
+            position = start
+            while position < end:
+                length = min(BUFFER_SIZE, end - position)
+                block1 = os.pread(fd1, length, position)
+                block2 = os.pread(fd2, length, position)
+                filetailor.helpers.throttle.wait(len(block1) + len(block2), 2)
+                if block1 != block2:
+                    return False
+                if not block1:
+                    break
+                position += len(block1)
+
+    return True
@@ -3,6 +3,7 @@
 
 import difflib
 import logging
+import os
 import subprocess
 
 import filetailor.config as ftconfig
@@ -25,6 +26,13 @@ def get_diff_program(src, dst, ftconfig_name, gitconfig_name):
 
     logging.debug('Getting diff program')
 
+    if os.path.islink(dst):
+        # Symlinks kept by `symlinks: preserve` differ only in where they point
+        src_link = os.readlink(src) if os.path.islink(src) else '(not a link)'
+        print(f'--- {src} -> {src_link}')
+        print(f'+++ {dst} -> {os.readlink(dst)}')
+        return
+
     # Get diff program from ftconfig
     diff_program = ftconfig.tools.get('diff_pager', 'none')
     if diff_program.lower() == 'none':
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""Copy files with the cheapest method the filesystem supports: a reflink
+(FICLONE) on btrfs/XFS, then `copy_file_range`, then a buffered copy. Holes
+in sparse files are kept rather than written out as zeros.
+
+Existing files of the same size are updated by writing only the blocks that
+changed, so small edits to large files do not rewrite them, or grow
+snapshots on copy-on-write filesystems. Other files are copied to a new
+file that then replaces the old one in one step.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import stat
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+import filetailor.helpers.metadata
+import filetailor.helpers.throttle
+from filetailor.helpers.hash_file import main as hash_file
+
+# From <linux/fs.h>, only defined by `fcntl` in newer versions of Python
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+
+BUFFER_SIZE = 1024 * 1024
+
+# Blocks compared when updating a file, matching common filesystem blocks
+DELTA_BLOCK_SIZE = 4096
+# Smaller files are replaced rather than compared block by block
+DELTA_MIN_SIZE = BUFFER_SIZE
+
+# Errors meaning a method is not supported here, so the next one is tried
+UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+               errno.EOPNOTSUPP, errno.EBADF, errno.ETXTBSY}
+
+
+def reflink(src_fd, dst_fd):
+    """Share the data blocks of `src_fd` with `dst_fd` without copying"""
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    filetailor.helpers.throttle.wait(0)
+
+
+def copy_range(src_fd, dst_fd, size):
+    """Copy `size` bytes within the kernel"""
+
+    remaining = size
+    while remaining > 0:
+        # In blocks when throttled, so the limits apply while copying
+        count = remaining
+        if filetailor.helpers.throttle.is_throttled():
+            count = min(remaining, BUFFER_SIZE)
+        copied = os.copy_file_range(src_fd, dst_fd, count)
+        if copied == 0:
+            break
+        filetailor.helpers.throttle.wait(copied * 2, 2)
+        remaining -= copied
+
+
+def hash_contents(src_fd, sha256):
+    """Add the contents of `src_fd` to `sha256`, for copies made without
+    reading them
+    """
+
+    position = 0
+    while True:
+        block = os.pread(src_fd, BUFFER_SIZE, position)
+        if not block:
+            break
+        sha256.update(block)
+        filetailor.helpers.throttle.wait(len(block))
+        position += len(block)
+
+
+def copy_buffered(src_fd, dst_fd, sha256=None):
+    """Copy through a large buffer in user space"""
+
+    while True:
+        block = os.read(src_fd, BUFFER_SIZE)
+        if not block:
+            break
+        if sha256 is not None:
+            sha256.update(block)
+        os.write(dst_fd, block)
+        filetailor.helpers.throttle.wait(len(block) * 2, 2)
+
+
+def is_sparse(stats):
+    """Return True if fewer blocks are allocated than the size needs"""
+
+    return (hasattr(os, 'SEEK_DATA')
+            and hasattr(stats, 'st_blocks')
+            and stats.st_blocks * 512 < stats.st_size)
+
+
+def get_data_extents(fd, size):
+    """Return (start, end) of each range of `fd` holding data, skipping holes
+
+    Called by `copy_sparse` and `compare_files`
+    """
+
+    extents = []
+    position = 0
+    while position < size:
+        try:
+            start = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError as error:
+            if error.errno == errno.ENXIO:
+                # Only a hole remains
+                break
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        extents.append((start, end))
+        position = end
+
+    return extents
+
+
+def hash_hole(sha256, size):
+    """Add `size` zero bytes, as read from a hole, to `sha256`"""
+
+    while size > 0:
+        zeros = bytes(min(size, BUFFER_SIZE))
+        sha256.update(zeros)
+        size -= len(zeros)
+
+
+def copy_sparse(src_fd, dst_fd, size, sha256=None):
+    """Copy only the data extents, leaving holes in `dst_fd`"""
+
+    hashed = 0
+    for (start, end) in get_data_extents(src_fd, size):
+        position = start
+        while position < end:
+            block = os.pread(src_fd, min(BUFFER_SIZE, end - position),
+                             position)
+            if not block:
+                break
+            if sha256 is not None:
+                hash_hole(sha256, position - hashed)
+                sha256.update(block)
+                hashed = position + len(block)
+            os.pwrite(dst_fd, block, position)
+            filetailor.helpers.throttle.wait(len(block) * 2, 2)
+            position += len(block)
+
+    # Keep a trailing hole
+    os.ftruncate(dst_fd, size)
+    if sha256 is not None:
+        hash_hole(sha256, size - hashed)
+
+
+def restart(src_fd, dst_fd):
+    """Discard anything written by a failed method before trying the next"""
+
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    os.ftruncate(dst_fd, 0)
+
+
+def copy_contents(src_fd, dst_fd, sha256=None):
+    """Copy contents of `src_fd` to `dst_fd`, adding them to `sha256` if
+    given; return the method used
+
+    A method failing partway leaves part of the contents in `sha256`, so a
+    hashed copy then never matches rather than matching wrongly.
+    """
+
+    src_stat = os.fstat(src_fd)
+    dst_stat = os.fstat(dst_fd)
+
+    if (fcntl is not None and sys.platform.startswith('linux')
+            and src_stat.st_dev == dst_stat.st_dev):
+        try:
+            reflink(src_fd, dst_fd)
+            if sha256 is not None:
+                # Shared blocks are the same, so only the source is read
+                hash_contents(src_fd, sha256)
+            return 'reflink'
+        except OSError as error:
+            if error.errno not in UNSUPPORTED:
+                raise
+            restart(src_fd, dst_fd)
+
+    # `copy_file_range` fills holes when it cannot share blocks
+    if is_sparse(src_stat):
+        try:
+            copy_sparse(src_fd, dst_fd, src_stat.st_size, sha256)
+            return 'sparse'
+        except OSError as error:
+            if error.errno not in UNSUPPORTED:
+                raise
+            restart(src_fd, dst_fd)
+
+    # Files such as those in /proc report a size of 0 but are not empty.
+    # Hashed copies are buffered, since they are read either way.
+    if (hasattr(os, 'copy_file_range') and src_stat.st_size > 0
+            and sha256 is None):
+        try:
+            copy_range(src_fd, dst_fd, src_stat.st_size)
+            return 'copy_file_range'
+        except OSError as error:
+            if error.errno not in UNSUPPORTED:
+                raise
+            restart(src_fd, dst_fd)
+
+    copy_buffered(src_fd, dst_fd, sha256)
+    return 'buffered'
+
+
+def main(src, dst, metadata=None, sha256=None):
+    """Copy `src` to `dst` with permissions and timestamps, like
+    `shutil.copy2`, or with `metadata` if given; return the method used
+
+    The contents are added to `sha256` if given, and `dst` is flushed to
+    storage. Called by `replace`, `update`, `copy_verified`, `tailor_file`,
+    and `write_tailored`
+    """
+
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # Already hard linked, and opening `dst` would truncate `src`
+        logging.debug('Skipping copy of %s, same file as %s', src, dst)
+        return 'same file'
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        if metadata is None:
+            metadata = filetailor.helpers.metadata.read(
+                src_file.fileno(), xattrs=True)
+        method = copy_contents(src_file.fileno(), dst_file.fileno(), sha256)
+        if hasattr(os, 'fchmod'):
+            # Owner, mode, times, and xattrs while `dst` is still open
+            filetailor.helpers.metadata.apply_fd(dst_file.fileno(), metadata)
+        if sha256 is not None:
+            os.fsync(dst_file.fileno())
+    if not hasattr(os, 'fchmod'):
+        filetailor.helpers.metadata.apply(dst, metadata)
+    logging.debug('Copied %s to %s using %s', src, dst, method)
+
+    return method
+
+
+def write_delta(src_fd, dst_fd, size):
+    """Write the blocks of `dst_fd` that differ from `src_fd`, which has the
+    same `size`; return the number of bytes written
+    """
+
+    written = 0
+    for position in range(0, size, BUFFER_SIZE):
+        new = os.pread(src_fd, BUFFER_SIZE, position)
+        old = os.pread(dst_fd, len(new), position)
+        filetailor.helpers.throttle.wait(len(new) + len(old), 2)
+        if new == old:
+            continue
+
+        # Write each run of changed blocks at once
+        start = None
+        for offset in range(0, len(new) + DELTA_BLOCK_SIZE, DELTA_BLOCK_SIZE):
+            block = new[offset:offset + DELTA_BLOCK_SIZE]
+            if block and block != old[offset:offset + DELTA_BLOCK_SIZE]:
+                if start is None:
+                    start = offset
+            elif start is not None:
+                os.pwrite(dst_fd, new[start:offset], position + start)
+                filetailor.helpers.throttle.wait(len(new[start:offset]))
+                written += len(new[start:offset])
+                start = None
+
+    return written
+
+
+def replace(src, dst, metadata=None):
+    """Copy `src` to a new file that then replaces `dst`, so `dst` is never
+    left partly written; return the method used
+    """
+
+    try:
+        (fd, partial) = tempfile.mkstemp(prefix=f'.{os.path.basename(dst)}.',
+                                         dir=os.path.dirname(dst) or '.')
+    except PermissionError:
+        if not os.path.exists(dst):
+            raise
+        # Only the file is writable, not its directory
+        return main(src, dst, metadata)
+    os.close(fd)
+    try:
+        method = main(src, partial, metadata)
+        os.replace(partial, dst)
+    finally:
+        if os.path.lexists(partial):
+            os.remove(partial)
+
+    return method
+
+
+def update(src, dst, metadata=None):
+    """Make `dst` a copy of `src` like `main`, writing only the blocks that
+    differ if `dst` is a large file of the same size and otherwise replacing
+    it in one step; return the method used
+
+    Symlinks and files with other hard links are written in place, since
+    replacing them would break the links. Called by `copy_file`
+    """
+
+    try:
+        dst_stats = os.lstat(dst)
+    except FileNotFoundError:
+        dst_stats = None
+    if dst_stats is not None and (not stat.S_ISREG(dst_stats.st_mode)
+                                  or dst_stats.st_nlink > 1
+                                  or os.path.samefile(src, dst)):
+        return main(src, dst, metadata)
+
+    size = os.stat(src).st_size
+    if (dst_stats is None or dst_stats.st_size != size
+            or size < DELTA_MIN_SIZE or not hasattr(os, 'pread')):
+        return replace(src, dst, metadata)
+
+    with open(src, 'rb') as src_file, open(dst, 'r+b') as dst_file:
+        if metadata is None:
+            metadata = filetailor.helpers.metadata.read(
+                src_file.fileno(), xattrs=True)
+        written = write_delta(src_file.fileno(), dst_file.fileno(), size)
+        filetailor.helpers.metadata.apply_fd(dst_file.fileno(), metadata)
+    logging.debug('Updated %s from %s, writing %s of %s bytes', dst, src,
+                  written, size)
+
+    return 'delta'
+
+
+def copy_verified(src, dst, expected, metadata=None):
+    """Copy `src` to a new file that then replaces `dst` like `replace`,
+    hashing the contents as they are copied; return the hash, or None if it
+    is not `expected`, the hash of `src` when it was tailored, leaving `dst`
+    unchanged
+
+    Symlinks and files with other hard links are written in place like
+    `update` does, so are only checked once written. Called by `copy_file`
+    for `--verify`
+    """
+
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return expected if hash_file(src) == expected else None
+
+    sha256 = hashlib.sha256()
+    try:
+        dst_stats = os.lstat(dst)
+    except FileNotFoundError:
+        dst_stats = None
+    if dst_stats is not None and (not stat.S_ISREG(dst_stats.st_mode)
+                                  or dst_stats.st_nlink > 1):
+        method = main(src, dst, metadata, sha256)
+    else:
+        (fd, partial) = tempfile.mkstemp(
+            prefix=f'.{os.path.basename(dst)}.',
+            dir=os.path.dirname(dst) or '.')
+        os.close(fd)
+        try:
+            method = main(src, partial, metadata, sha256)
+            if sha256.hexdigest() == expected:
+                os.replace(partial, dst)
+        finally:
+            if os.path.lexists(partial):
+                os.remove(partial)
+
+    if sha256.hexdigest() != expected:
+        logging.debug('Verifying copy of %s to %s failed', src, dst)
+        return None
+    logging.debug('Copied and verified %s to %s using %s', src, dst, method)
+
+    return expected
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""Gets a directory for data filetailor can recreate at any time"""
+
+import os
+from pathlib import Path
+
+import filetailor.config as ftconfig
+
+
+def main(name):
+    """Return the cache directory `name`, creating it if needed
+
+    Uses "cache_dir" from "filetailor.ini" if set, otherwise the OS default
+    """
+
+    cache_dir = ftconfig.paths.get('cache_dir') if ftconfig.paths else None
+    if not cache_dir:
+        cache_dir = os.path.join(ftconfig.dirs.user_cache_dir, 'cache')
+    path = Path(os.path.expanduser(cache_dir), name)
+    path.mkdir(parents=True, exist_ok=True)
+
+    return path
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""Gets the device_id of a device name or hostname"""
+
+
+def main(yaml_devices, device):
+    """Given device (device_id or hostname), returns the device_id
+
+    Example YAML:
+    ```yaml
+    device DEVICE_ID:
+      hostname: HOSTNAME
+    ```
+    """
+
+    device_id = device
+    if device not in yaml_devices:
+        # Search hostnames
+        for key in yaml_devices.keys():
+            if yaml_devices[key] and 'hostname' in yaml_devices[key]:
+                if device == yaml_devices[key]['hostname']:
+                    device_id = key
+
+    return device_id
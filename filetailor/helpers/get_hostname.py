@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""Gets the hostname of the machine"""
+
+import os
+
+
+def main():
+    """Returns the hostname of the machine
+
+    Read with `os.uname` where available, since importing `platform` or
+    `socket` would slow down `status --cached`
+    """
+
+    if hasattr(os, 'uname'):
+        return os.uname().nodename
+
+    import socket  # pylint: disable=import-outside-toplevel
+    return socket.gethostname()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""Hash file contents to detect changes between runs"""
+
+import hashlib
+
+import filetailor.helpers.throttle
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of `data`"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def main(path):
+    """Return the SHA-256 hex digest of the file at `path`, or None if it is
+    not a file
+    """
+
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, 'rb') as hashed_file:
+            for block in iter(lambda: hashed_file.read(BLOCK_SIZE), b''):
+                filetailor.helpers.throttle.wait(len(block))
+                sha256.update(block)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+
+    return sha256.hexdigest()
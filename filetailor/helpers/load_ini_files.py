@@ -21,7 +21,7 @@ def check_paths(paths):
 
 
 def read_filetailor_ini(filetailor_ini_path):
-    """Loads values from filetailor.ini, called by __main__.py when functions
+    """Loads values from filetailor.ini, called by cli.py when functions
     are called
     """
 
@@ -60,7 +60,7 @@ def find_filetailor_ini():
 
 
 def load_config_ini():
-    """Loads values from config.ini, called by __main__.py, even when no
+    """Loads values from config.ini, called by cli.py, even when no
     functions are called (such as `filetailor --help`)
     """
 
@@ -11,10 +11,12 @@ from filetailor.helpers import cprint
 from filetailor.helpers.load_ini_files import find_filetailor_ini
 
 DEFAULT_KEYS = ['vars', 'yaml_only', 'file_only', 'quiet', 'no_diff',
-                'no_backup', 'assumeyes', 'dry_run', 'sudo', 'staging']
+                'no_backup', 'assumeyes', 'dry_run', 'sudo', 'staging', 'xattrs',
+                'preserve_mode', 'symlinks']
 FILE_KEYS = ['path', 'vars', 'quiet', 'no_diff', 'no_backup', 'assumeyes', 'dry_run',
              'sudo', 'staging', 'unique', 'include_devices', 'exclude_devices',
-             'include_contents', 'exclude_contents', 'scripts']
+             'include_contents', 'exclude_contents', 'scripts', 'xattrs',
+             'preserve_mode', 'symlinks']
 
 
 def check_for_duplicates(paths, dictionary, key):
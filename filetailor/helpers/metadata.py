@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Read and apply file owner, mode, timestamps, and extended attributes,
+using a single open file descriptor where the OS supports it
+"""
+
+import errno
+import logging
+import os
+import stat
+from collections import namedtuple
+
+# `uid` and `gid` are None when the owner should not be changed and `xattrs`
+# is None when extended attributes should not be copied
+Metadata = namedtuple('Metadata',
+                      ['mode', 'uid', 'gid', 'atime_ns', 'mtime_ns', 'xattrs'])
+
+XATTR_IGNORED = {errno.EPERM, errno.ENOTSUP, errno.ENODATA, errno.EINVAL,
+                 errno.EACCES}
+
+
+def read_xattrs(path_or_fd):
+    """Return extended attributes as a dictionary, or {} if unsupported"""
+
+    if not hasattr(os, 'listxattr'):
+        return {}
+    try:
+        return {name: os.getxattr(path_or_fd, name)
+                for name in os.listxattr(path_or_fd)}
+    except OSError as error:
+        logging.debug('Cannot read xattrs: %s', error)
+        return {}
+
+
+def read(path_or_fd, owner=False, xattrs=False):
+    """Return the metadata of a file, including the owner and extended
+    attributes only if requested
+    """
+
+    stats = os.stat(path_or_fd)
+    return Metadata(stat.S_IMODE(stats.st_mode),
+                    stats.st_uid if owner else None,
+                    stats.st_gid if owner else None,
+                    stats.st_atime_ns, stats.st_mtime_ns,
+                    read_xattrs(path_or_fd) if xattrs else None)
+
+
+def apply_fd(fd, metadata):
+    """Apply `metadata` to the open file `fd`
+
+    The owner is changed first since `fchown` may clear setuid/setgid bits
+    """
+
+    if metadata.uid is not None and hasattr(os, 'fchown'):
+        os.fchown(fd, metadata.uid, metadata.gid)
+    os.fchmod(fd, metadata.mode)
+    os.utime(fd, ns=(metadata.atime_ns, metadata.mtime_ns))
+    for (name, value) in (metadata.xattrs or {}).items():
+        try:
+            os.setxattr(fd, name, value)
+        except OSError as error:
+            # Same errors `shutil.copystat` ignores, e.g. "security.*" names
+            # without root or filesystems without xattrs
+            if error.errno not in XATTR_IGNORED:
+                raise
+            logging.debug('Cannot set xattr %s: %s', name, error)
+
+
+def apply(path, metadata):
+    """Apply `metadata` to the file at `path`
+
+    Called by `fix_metadata` and `write_tailored`
+    """
+
+    if not hasattr(os, 'fchmod'):
+        # Windows only supports mode and timestamps by path
+        os.chmod(path, metadata.mode)
+        os.utime(path, ns=(metadata.atime_ns, metadata.mtime_ns))
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        apply_fd(fd, metadata)
+    finally:
+        os.close(fd)
+
+
+def restrict_mode(mode, current_mode):
+    """Return `current_mode` with its executable bits set as in `mode`, so a
+    file is never made readable or writable by more users
+
+    Like git, executable files are executable by whoever can read them.
+    Called by `get_metadata`
+    """
+
+    if mode & stat.S_IXUSR:
+        return current_mode | (current_mode & 0o444) >> 2
+    return current_mode & ~0o111
+
+
+def get_differences(metadata, path):
+    """Return names of the fields of `metadata` that differ from `path`,
+    ignoring timestamps and fields that are None
+
+    Called by `get_file_status` and `diff_dir`
+    """
+
+    current = read(path, metadata.uid is not None,
+                   metadata.xattrs is not None)
+    differences = []
+    if metadata.mode != current.mode:
+        differences.append('mode')
+    if metadata.uid is not None and (metadata.uid, metadata.gid) != (
+            current.uid, current.gid):
+        differences.append('owner')
+    if metadata.xattrs is not None and metadata.xattrs != current.xattrs:
+        differences.append('xattrs')
+
+    return differences
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Match paths within directories against `include_contents` and
+`exclude_contents`
+
+A list of patterns is matched like ".gitignore": globs, `**`, negation with
+`!`, and patterns ending in `/` matching directories only. A single string
+is a regular expression searched in each path, as in older versions.
+"""
+
+import functools
+import os
+import re
+
+
+def translate(pattern):
+    """Return a regular expression for the glob `pattern`, where `*`, `?`,
+    and `[...]` do not match `/` but `**` does
+    """
+
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            # Zero or more directories
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            chars = pattern[i + 1:end].replace('\\', '\\\\')
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex += f'[{chars}]'
+            i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+
+    return regex
+
+
+def compile_pattern(pattern):
+    """Return (regex, negate, dir_only) for one gitignore-style pattern, or
+    None for blank lines and comments
+    """
+
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith('#'):
+        return None
+
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+
+    # Patterns without a slash match at any depth, others from the top
+    if '/' in pattern:
+        prefix = ''
+        pattern = pattern.lstrip('/')
+    else:
+        prefix = '(?:.*/)?'
+
+    return (re.compile(prefix + translate(pattern) + '$'), negate, dir_only)
+
+
+class PathSpec():
+    """Compiled list of gitignore-style patterns"""
+
+    def __init__(self, patterns):
+        self.rules = [rule for rule in map(compile_pattern, patterns)
+                      if rule is not None]
+
+    def match_one(self, path, is_dir):
+        """Return True if the last pattern matching `path` is not negated"""
+
+        matched = False
+        for (regex, negate, dir_only) in self.rules:
+            if (not dir_only or is_dir) and regex.match(path):
+                matched = not negate
+        return matched
+
+    def match(self, path, is_dir=False):
+        """Return True if `path` or a directory containing it matches"""
+
+        parts = path.split('/')
+        for depth in range(1, len(parts)):
+            if self.match_one('/'.join(parts[:depth]), True):
+                return True
+        return self.match_one(path, is_dir)
+
+
+class RegexSpec():
+    """Regular expression searched in each path"""
+
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern)
+
+    def match(self, path, is_dir=False):
+        """Return True if the regular expression is found in `path`"""
+        # pylint: disable=unused-argument
+        return bool(self.regex.search(path))
+
+
+def compile_spec(patterns):
+    """Return a compiled spec for a YAML value, or None if not set"""
+
+    if patterns is None:
+        return None
+    if isinstance(patterns, str):
+        return RegexSpec(patterns)
+    return PathSpec(patterns)
+
+
+class ContentFilter():
+    """Paths within a directory that are not synced"""
+
+    def __init__(self, include, exclude, always_exclude):
+        self.include = compile_spec(include)
+        self.exclude = compile_spec(exclude)
+        self.always_exclude = re.compile(always_exclude)
+
+    def is_ignored(self, path, is_dir=False):
+        """Return True if `path`, relative to the directory, is not synced
+
+        Directories are only excluded, never left out for not being included,
+        so included files below them are still found
+        """
+
+        if self.always_exclude.search(path):
+            return True
+        if self.exclude is not None and self.exclude.match(path, is_dir):
+            return True
+        return (not is_dir and self.include is not None
+                and not self.include.match(path))
+
+
+@functools.lru_cache(maxsize=None)
+def main(include, exclude, always_exclude):
+    """Return a `ContentFilter`, compiled once for each set of patterns
+
+    `include` and `exclude` are a regular expression, a tuple of patterns,
+    or None. Called by `get_content_filter`
+    """
+
+    return ContentFilter(include, exclude, always_exclude)
+
+
+def walk(root, content_filter):
+    """Yield (relative_dir, dirs, files) like `os.walk`, leaving out ignored
+    paths and never listing the contents of ignored directories
+
+    Called by `diff_dir`
+    """
+
+    for (dirpath, dirs, files) in os.walk(root):
+        relative = os.path.relpath(dirpath, root)
+        if relative == '.':
+            relative = ''
+        relative = relative.replace(os.sep, '/')
+        # Pruning `dirs` in place stops `os.walk` from entering them
+        dirs[:] = [name for name in dirs if not content_filter.is_ignored(
+            f'{relative}/{name}'.lstrip('/'), True)]
+        files = [name for name in files if not content_filter.is_ignored(
+            f'{relative}/{name}'.lstrip('/'))]
+        yield (relative, dirs, files)
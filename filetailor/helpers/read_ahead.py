@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Read upcoming files in background threads while the current one is
+tailored, so each file on a high-latency mount such as NFS or SSHFS does not
+wait for the round trips of the one before
+
+At most `WINDOW` files of up to `MAX_FILE_SIZE` bytes are held at once, so
+memory use stays bounded; larger files are read or copied directly when
+they are reached.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import filetailor.config as ftconfig
+import filetailor.helpers.throttle
+
+# Files read ahead of the one being tailored
+WINDOW = 32
+# Larger files are left to `fast_copy` and `compare_files`
+MAX_FILE_SIZE = 2 * 1024 * 1024
+WORKERS = 8
+
+
+def read_file(path):
+    """Return the contents of `path`, or None if it cannot be read or is
+    larger than `MAX_FILE_SIZE`
+    """
+
+    try:
+        # Unbuffered, so the whole file is read in as few calls as possible
+        with open(path, 'rb', buffering=0) as read_file_:
+            if os.fstat(read_file_.fileno()).st_size > MAX_FILE_SIZE:
+                return None
+            data = read_file_.read()
+    except OSError:
+        return None
+    filetailor.helpers.throttle.wait(len(data))
+
+    return data
+
+
+class ReadAhead():
+    """Contents of `paths`, read in order up to `WINDOW` files ahead of the
+    last one taken with `get`
+    """
+
+    def __init__(self, paths):
+        self.paths = [os.fspath(path) for path in paths]
+        self.next = 0
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=WORKERS)
+        self.read_file = ftconfig.bind(read_file)
+        self.fill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # Skip reads not started yet (`cancel_futures` needs Python 3.9)
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown()
+
+    def fill(self):
+        """Start reading paths until `WINDOW` are read or being read"""
+
+        while self.next < len(self.paths) and len(self.futures) < WINDOW:
+            path = self.paths[self.next]
+            self.next += 1
+            if path not in self.futures:
+                self.futures[path] = self.executor.submit(self.read_file,
+                                                          path)
+
+    def get(self, path):
+        """Return the contents of `path` and free its place, or None if it
+        was not read ahead
+
+        Called by `tailor_file`
+        """
+
+        future = self.futures.pop(os.fspath(path), None)
+        self.fill()
+        if future is None:
+            return None
+        return future.result()
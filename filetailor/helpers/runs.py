@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Keep runs of filetailor at the same time from writing the same files
+
+Commands that change files hold an advisory lock on sync_dir until they
+finish. Each run tailors files in its own directory within
+"in-progress_dir/runs", so read-only runs, such as status for different
+devices, can run at the same time. Directories left by runs that were killed
+are removed by the next run.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import filetailor.config as ftconfig
+from filetailor.helpers import cprint
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where runs are neither locked nor told apart by locks
+    fcntl = None
+
+RUNS_DIR = 'runs'
+
+# Without `fcntl`, run directories older than this many seconds are removed
+STALE_AGE = 24 * 60 * 60
+
+lock = threading.Lock()
+
+
+def lock_dir(path, blocking=True):
+    """Return a descriptor holding an exclusive lock on directory `path`, or
+    None if not `blocking` and another run holds it
+    """
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def lock_sync_dir():
+    """Wait for other runs changing files to finish, then hold a lock on
+    sync_dir until this run finishes
+
+    Called by `call_sync_backup`, `call_sync_restore`, `call_apply`,
+    `call_rollback`, `call_clean`, `call_fsck`, `call_migrate`, and
+    `Session.sync`
+    """
+
+    if fcntl is None or ftconfig.sync_dir_lock is not None:
+        return
+
+    sync_dir = ftconfig.paths['sync_dir']
+    fd = lock_dir(sync_dir, blocking=False)
+    if fd is None:
+        cprint.plain('Waiting for another filetailor run to finish...')
+        fd = lock_dir(sync_dir)
+    logging.debug('Locked %s', sync_dir)
+    ftconfig.sync_dir_lock = fd
+
+
+def is_stale(run_dir):
+    """Return True if the run that created `run_dir` is no longer running"""
+
+    if fcntl is None:
+        return time.time() - os.stat(run_dir).st_mtime > STALE_AGE
+
+    fd = lock_dir(run_dir, blocking=False)
+    if fd is None:
+        return False
+    os.close(fd)
+    return True
+
+
+def collect_garbage(runs_dir):
+    """Remove directories of runs that ended without removing them"""
+
+    with os.scandir(runs_dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False) and is_stale(entry.path):
+                    logging.debug('Removing stale run %s', entry.name)
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                # Removed by another run at the same time
+                pass
+
+
+def get_in_progress_dir():
+    """Return this run's directory for tailored files, created on first use
+
+    Called by `set_paths`
+    """
+
+    with lock:
+        if ftconfig.in_progress_dir is None:
+            runs_dir = os.path.join(ftconfig.paths['in-progress_dir'],
+                                    RUNS_DIR)
+            os.makedirs(runs_dir, exist_ok=True)
+            collect_garbage(runs_dir)
+            run_dir = tempfile.mkdtemp(prefix=f'{os.getpid()}-', dir=runs_dir)
+            if fcntl is not None:
+                # Held until the run ends, so others know it is in use
+                ftconfig.in_progress_lock = lock_dir(run_dir)
+            ftconfig.in_progress_dir = run_dir
+
+    return ftconfig.in_progress_dir
+
+
+def finish():
+    """Remove this run's directory and release its locks
+
+    Called by `main` and `Session.sync`
+    """
+
+    if ftconfig.in_progress_dir is not None:
+        shutil.rmtree(ftconfig.in_progress_dir, ignore_errors=True)
+        ftconfig.in_progress_dir = None
+    for name in ['in_progress_lock', 'sync_dir_lock']:
+        if getattr(ftconfig, name) is not None:
+            os.close(getattr(ftconfig, name))
+            setattr(ftconfig, name, None)
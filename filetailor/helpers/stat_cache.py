@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Cache `lstat` results for a single run, so each path is checked once no
+matter how often its type, existence, or owner is needed
+
+Paths filetailor writes must be passed to `invalidate` afterwards.
+"""
+
+import errno
+import os
+import stat as st
+
+import filetailor.config as ftconfig
+
+# Errors `pathlib` treats as the path not existing
+MISSING = {errno.ENOENT, errno.ENOTDIR, errno.EBADF, errno.ELOOP}
+
+
+def clear():
+    """Forget every path, at the start of a run
+
+    Called by `backup_or_restore` and `plan`
+    """
+
+    ftconfig.lstat_cache = {}
+    ftconfig.stat_cache = {}
+
+
+def call_stat(function, path):
+    """Return `function(path)`, or None if `path` does not exist"""
+
+    try:
+        return function(path)
+    except OSError as error:
+        if error.errno not in MISSING:
+            raise
+        return None
+
+
+def lstat(path):
+    """Return the `os.lstat` result of `path`, or None if it does not exist"""
+
+    lstats = ftconfig.lstat_cache
+    key = os.fspath(path)
+    if key not in lstats:
+        lstats[key] = call_stat(os.lstat, key)
+
+    return lstats[key]
+
+
+def stat(path):
+    """Return the `os.stat` result of `path`, following symlinks, or None if
+    it does not exist
+    """
+
+    result = lstat(path)
+    if result is None or not st.S_ISLNK(result.st_mode):
+        return result
+
+    stats = ftconfig.stat_cache
+    key = os.fspath(path)
+    if key not in stats:
+        stats[key] = call_stat(os.stat, key)
+
+    return stats[key]
+
+
+def exists(path):
+    """Return True if `path` exists, following symlinks"""
+    return stat(path) is not None
+
+
+def lexists(path):
+    """Return True if `path` exists, including broken symlinks"""
+    return lstat(path) is not None
+
+
+def is_file(path):
+    """Return True if `path` is a file, following symlinks"""
+
+    result = stat(path)
+    return result is not None and st.S_ISREG(result.st_mode)
+
+
+def is_dir(path):
+    """Return True if `path` is a directory, following symlinks"""
+
+    result = stat(path)
+    return result is not None and st.S_ISDIR(result.st_mode)
+
+
+def is_link(path):
+    """Return True if `path` is a symlink"""
+
+    result = lstat(path)
+    return result is not None and st.S_ISLNK(result.st_mode)
+
+
+def invalidate(path):
+    """Forget `path` after filetailor creates, changes, or removes it"""
+
+    key = os.fspath(path)
+    ftconfig.lstat_cache.pop(key, None)
+    ftconfig.stat_cache.pop(key, None)
+
+
+def invalidate_tree(path):
+    """Forget `path` and every path below it, after removing a directory"""
+
+    prefix = os.path.join(os.fspath(path), '')
+    for cache in [ftconfig.lstat_cache, ftconfig.stat_cache]:
+        # Copy keys first since worker threads may be adding paths
+        for key in list(cache):
+            if key.startswith(prefix):
+                cache.pop(key, None)
+    invalidate(path)
@@ -3,13 +3,52 @@
 specific device based on the YAML
 """
 
+import hashlib
+import io
+import json
 import logging
+import os
 import re
-import sys
+import tempfile
+import time
 
 import filetailor.config as ftconfig
-from filetailor.helpers import cprint
+import filetailor.helpers.throttle
+from filetailor.helpers.get_cache_dir import main as get_cache_dir
 from filetailor.helpers.get_key_list import main as get_key_list
+from filetailor.helpers.get_option import main as get_option
+
+# Increase when the format of compiled templates changes; cached templates
+# of other versions are removed by `prune_templates`
+TEMPLATE_VERSION = 2
+
+# Cached templates unused for this many seconds are removed, and only the
+# most recently used are kept
+TEMPLATE_MAX_AGE = 30 * 24 * 60 * 60
+MAX_TEMPLATES = 1000
+
+# Files with a null byte this close to the start are treated as binary
+BINARY_CHECK_SIZE = 8000
+
+
+def convert_devices(devices, key_list):
+    """Split `devices` from a tag and replace vars in each device name
+
+    Called by `LineAttributes` and `render`
+    """
+
+    # Converted device(s) have had vars replaced with values
+    converted_devices = []
+
+    for device in devices.split():
+        converted_device = device
+        for key in key_list:
+            # Replace vars in `line` with keys for backup; reverse for restore
+            var = key_list[key]
+            converted_device = converted_device.replace(key, var)
+        converted_devices = converted_devices + converted_device.split()
+
+    return converted_devices
 
 
 class LineAttributes:
@@ -43,19 +82,7 @@ class LineAttributes:
             self.action = m1.group(2)
 
             # From example, `devices` = `device1 device2`
-            devices = m1.group(3).split()
-
-            # Converted device(s) have had vars replaced with values
-            converted_devices = []
-
-            for device in devices:
-                converted_device = device
-                for key in key_list:
-                    # Replace vars in `line` with keys for backup; reverse for restore
-                    var = key_list[key]
-                    converted_device = converted_device.replace(key, var)
-                converted_devices = converted_devices + converted_device.split()
-            self.devices = converted_devices
+            self.devices = convert_devices(m1.group(3), key_list)
 
     def update(self, source_text):
         """Update line and indent with new `self.number`"""
@@ -93,7 +120,7 @@ def update_comments(line, comment_char, indent):
             # This is likely due to a multi-line tailor
             line = ' '*indent + comment_char + '\n'
 
-    if ftconfig.sync in ['status', 'restore']:
+    if ftconfig.sync in ['status', 'restore', 'plan']:
         # If restore, uncomment lines
         # Remove space trailing the comment if it exists
 
@@ -108,19 +135,278 @@ def update_comments(line, comment_char, indent):
     return line
 
 
-def main(xfile):
-    """Tailor the line to fit the sync directory (backup) or device (restore)
+def is_binary(head):
+    """Return True if the first bytes of a file contain a null byte, as in
+    sparse images that would otherwise decode as text
+    """
+    return b'\0' in head
+
+
+def decode(data):
+    """Return `data` split into lines as `open` would read it in text mode, or
+    False if `data` is binary
 
-    Called by `tailor_file`
+    Called by `main` and `render_file`
     """
 
-    with open(xfile.source) as source_file:
-        try:
-            source_text = source_file.readlines()
-        except (UnboundLocalError, UnicodeDecodeError):
-            logging.debug('Ignoring binary file {xfile.file_id}')
+    if is_binary(data[:BINARY_CHECK_SIZE]):
+        return False
+    try:
+        return io.TextIOWrapper(io.BytesIO(data)).readlines()
+    except UnicodeDecodeError:
+        return False
+
+
+def is_unchanged(data, source_text, source_tailored):
+    """Return True if writing `source_tailored` would reproduce `data`, the
+    bytes `source_text` was decoded from
+
+    Called by `main` and `write_tailored`
+    """
+
+    return (source_tailored == source_text
+            and ''.join(source_text).encode('UTF-8') == data)
+
+
+def main(xfile, data=None):
+    """Tailor the line to fit the sync directory (backup) or device (restore);
+    return False if the source is binary or tailoring does not change it, so
+    it can be copied as is
+
+    `data` is the contents of the source if already read. Called by
+    `tailor_file`
+    """
+
+    if data is None:
+        with open(xfile.source, 'rb') as source_file:
+            data = source_file.read(BINARY_CHECK_SIZE)
+            if is_binary(data):
+                # Skip reading the rest of large binary files
+                logging.debug('Ignoring binary file %s', xfile.file_id)
+                return False
+            data += source_file.read()
+        filetailor.helpers.throttle.wait(len(data))
+    source_text = decode(data)
+    if source_text is False:
+        logging.debug('Ignoring binary file %s', xfile.file_id)
+        return False
+
+    source_tailored = tailor(source_text, xfile)
+    if is_unchanged(data, source_text, source_tailored):
+        logging.debug('Nothing to tailor in %s', xfile.file_id)
+        return False
+
+    return source_tailored
+
+
+def get_replacements(key_list):
+    """Return (find, replace) pairs applied to every line, in order"""
+
+    if ftconfig.sync in ['backup']:
+        # Replace values with vars
+        return [(key_list[key], key) for key in key_list]
+    if ftconfig.sync in ['status', 'restore', 'plan']:
+        # Replace vars with values
+        return [(key, key_list[key]) for key in key_list]
+    return []
+
+
+def split_line(line, patterns):
+    """Split `line` into literal strings and indexes of `patterns`, matching
+    the order `str.replace` is applied for each pattern in turn
+    """
+
+    parts = [line]
+    for (index, pattern) in enumerate(patterns):
+        split_parts = []
+        for part in parts:
+            if isinstance(part, int):
+                split_parts.append(part)
+                continue
+            for (number, literal) in enumerate(part.split(pattern)):
+                if number > 0:
+                    split_parts.append(index)
+                if literal:
+                    split_parts.append(literal)
+        parts = split_parts
+
+    return parts
+
+
+def overlaps(replace, find):
+    """Return True if `find` could match text that includes part or all of
+    `replace`
+    """
+
+    if not replace or replace in find or find in replace:
+        return True
+    return any(replace[-size:] == find[:size] or replace[:size] == find[-size:]
+               for size in range(1, min(len(replace), len(find)) + 1))
+
+
+def can_fill(replacements):
+    """Return True if filling the slots of a template matches applying
+    `str.replace` for each of `replacements` in turn
+
+    It does unless a replacement, alone or joined to the text around it,
+    can form a pattern replaced after it.
+    """
+
+    for (index, (find, replace)) in enumerate(replacements):
+        if not (isinstance(find, str) and find and isinstance(replace, str)):
+            return False
+        if any(overlaps(replace, later) for (later, _)
+               in replacements[index + 1:]):
             return False
 
+    return True
+
+
+def get_segments(parts, patterns):
+    """Return `parts` of a line from `split_line` with each literal string
+    replaced by its `[start, end]` within the line
+    """
+
+    segments = []
+    position = 0
+    for part in parts:
+        if isinstance(part, int):
+            segments.append(part)
+            position += len(patterns[part])
+        else:
+            segments.append([position, position + len(part)])
+            position += len(part)
+
+    return segments
+
+
+def compile_template(source_text, patterns):
+    """Compile `source_text` into `[number, segments, tag]` for each line
+    with a tag or any of `patterns`
+
+    Lines with `patterns` have `segments` of `[start, end]` of the line and
+    slots (indexes of `patterns`), with the tag parsed after the slots are
+    filled. Other lines have `segments` of None and the parsed
+    `[comment_char, action, devices]` tag. No text of the lines is kept, so
+    cached templates do not copy the contents of files.
+    """
+
+    lines = []
+    for (number, line) in enumerate(source_text):
+        parts = split_line(line, patterns)
+        if any(isinstance(part, int) for part in parts):
+            lines.append([number, get_segments(parts, patterns), None])
+            continue
+        m1 = P1.search(line)
+        if m1:
+            lines.append([number, None, list(m1.groups())])
+
+    return lines
+
+
+def get_template_path(cache_key):
+    """Return the path caching the template with `cache_key`"""
+    return os.path.join(get_cache_dir('templates'),
+                        f'{cache_key}.v{TEMPLATE_VERSION}.json')
+
+
+def get_template(source_text, patterns):
+    """Return compiled `source_text`, loading it from the cache if compiled
+    before with the same `patterns`
+
+    Called by `tailor`
+    """
+
+    sha256 = hashlib.sha256(
+        json.dumps([TEMPLATE_VERSION, patterns]).encode('UTF-8'))
+    for line in source_text:
+        encoded = line.encode('UTF-8', 'surrogateescape')
+        sha256.update(len(encoded).to_bytes(8, 'little') + encoded)
+    cache_key = sha256.hexdigest()
+    templates = ftconfig.templates
+    if cache_key in templates:
+        return templates[cache_key]
+
+    cache_path = get_template_path(cache_key)
+    try:
+        with open(cache_path, 'r', encoding='UTF-8') as cache_file:
+            template = json.load(cache_file)
+        if can_save_templates():
+            # Mark as used so `prune_templates` keeps it
+            os.utime(cache_path)
+    except (OSError, ValueError):
+        template = compile_template(source_text, patterns)
+
+        # Files with nothing to tailor compile quickly, so are not cached
+        if template and can_save_templates():
+            # Replace atomically since other processes may read the same
+            # template. Temporary files are only readable by the user.
+            with tempfile.NamedTemporaryFile(
+                    'w', encoding='UTF-8', dir=os.path.dirname(cache_path),
+                    delete=False) as cache_file:
+                json.dump(template, cache_file, separators=(',', ':'))
+            os.chmod(cache_file.name, 0o600)
+            os.replace(cache_file.name, cache_path)
+
+    templates[cache_key] = template
+
+    return template
+
+
+def can_save_templates():
+    """Return True if this run may write to the template cache"""
+    return (ftconfig.sync in ['backup', 'restore']
+            and not get_option('dry_run'))
+
+
+def prune_templates():
+    """Remove cached templates of other versions or unused for
+    `TEMPLATE_MAX_AGE`, then the least recently used beyond `MAX_TEMPLATES`
+
+    Called by `backup_or_restore`
+    """
+
+    if not can_save_templates():
+        return
+
+    cached = []
+    suffix = f'.v{TEMPLATE_VERSION}.json'
+    for entry in os.scandir(get_cache_dir('templates')):
+        try:
+            mtime = entry.stat().st_mtime if entry.name.endswith(suffix) else 0
+        except OSError:
+            continue
+        cached.append((mtime, entry.path))
+    cached.sort(reverse=True)
+    oldest = time.time() - TEMPLATE_MAX_AGE
+    for (number, (mtime, path)) in enumerate(cached):
+        if number >= MAX_TEMPLATES or mtime < oldest:
+            logging.debug('Removing cached template %s', path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def replace_line(line, replacements):
+    """Apply each of `replacements` to `line` in turn"""
+
+    for (find, replace) in replacements:
+        line = line.replace(find, replace)
+
+    return line
+
+
+def get_indent(line):
+    """Get number of whitespaces at beginning of line"""
+    return len(line) - len(line.lstrip())
+
+
+def tailor(source_text, xfile):
+    """Tailor the lines of `source_text` for the device of `xfile`
+
+    Called by `main` and `render_file`
+    """
 
     source_tailored = []
     multiline = []  # List of comment symbols in active multiline
@@ -130,43 +416,61 @@ def main(xfile):
                             xfile.yaml_device,
                             xfile.yaml_file,
                             'file')
+    replacements = get_replacements(key_list)
+    patterns = [find for (find, _) in replacements]
+
+    # Otherwise replace line by line, then compile without slots
+    if can_fill(replacements):
+        template = get_template(source_text, patterns)
+    else:
+        source_text = [replace_line(line, replacements)
+                       for line in source_text]
+        template = compile_template(source_text, [])
+    template = {number: (segments, tag)
+                for (number, segments, tag) in template}
 
     for (current_line_number, line) in enumerate(source_text):
         # For each line in file
 
-        for key in key_list:
-            # Replace vars in `line` with keys for backup; reverse for restore
-            var = key_list[key]
-            if ftconfig.sync in ['backup']:
-                line = line.replace(var, key)
-            if ftconfig.sync in ['status', 'restore']:
-                line = line.replace(key, var)
+        (segments, tag) = template.get(current_line_number, (None, None))
+        if segments is None:
+            # Line without vars
+            devices = convert_devices(tag[2], key_list) if tag else None
+        else:
+            line = ''.join(line[segment[0]:segment[1]]
+                           if isinstance(segment, list)
+                           else replacements[segment][1]
+                           for segment in segments)
+            cline = LineAttributes(line, current_line_number,
+                                   key_list=key_list)
+            tag = [cline.comment_char, cline.action, None]
+            devices = cline.devices
+            if cline.action is None:
+                tag = None
 
         # Update filetailor tags
-        cline = LineAttributes(line, current_line_number, key_list=key_list)
-        if cline.action is not None and xfile.device_id in cline.devices:
-            if cline.action == '':
+        if tag is not None and xfile.device_id in devices:
+            (comment_char, action, _) = tag
+            if action == '':
                 # Single-line edit
-                line = update_comments(line, cline.comment_char, cline.indent)
-            elif cline.action in ['begin ', 'end ']:
-                if cline.action == 'begin ':
-                    # Check for multi-line start
-                    multiline.append(cline.comment_char)
-                    multiline_begin = LineAttributes(line, current_line_number)
-                elif cline.action == 'end ':
-                    # Check for multi-line stop
-                    del multiline[-1]
+                line = update_comments(line, comment_char, get_indent(line))
+            elif action == 'begin ':
+                # Check for multi-line start
+                multiline.append(comment_char)
+                multiline_indent = get_indent(line)
+            elif action == 'end ':
+                # Check for multi-line stop
+                del multiline[-1]
         elif len(multiline) > 0:
             # Update multi-line edits
-            cline.comment_char = multiline[-1]
-            line = update_comments(line, cline.comment_char, multiline_begin.indent)
+            line = update_comments(line, multiline[-1], multiline_indent)
 
         source_tailored.append(line)
 
     if len(multiline) > 0:
-        # Multi-line error
-        cprint.error(f'ERROR: In "{xfile.file_id}", multi-line control begun '
-                     + 'but not ended.', xfile)
-        input('Press return to continue.')
+        # Multi-line error, reported by `report_warnings` since this may run
+        # in a worker thread ahead of the file being shown
+        xfile.warnings.append(f'ERROR: In "{xfile.file_id}", multi-line '
+                              + 'control begun but not ended.')
 
     return source_tailored
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Limit how fast files are read and written, so runs on busy hosts leave
+disk I/O for other work
+
+`--max-rate` limits bytes per second and `--max-iops` reads and writes per
+second, shared by every thread of a run. After each read or write, `wait`
+sleeps until the run is back within both limits. `--idle` lowers the CPU
+and I/O priority of the run so it only uses what other processes leave.
+Only the command line offers `--idle`, since the priority of a process can
+not be raised back without root.
+"""
+
+import ctypes
+import logging
+import os
+import platform
+import re
+import sys
+import threading
+import time
+
+import filetailor.config as ftconfig
+from filetailor.helpers import cprint
+from filetailor.helpers.get_option import main as get_option
+
+UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# `ioprio_set` system call numbers, which differ between architectures
+IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30,
+              'armv7l': 314, 'ppc64le': 273, 's390x': 282, 'riscv64': 30}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+
+class Throttle():
+    """Bandwidth and operation limits shared by threads of a run"""
+
+    def __init__(self, rate=None, iops=None):
+        self.rate = rate
+        self.iops = iops
+        self.lock = threading.Lock()
+        # When the I/O done so far is allowed to have finished
+        self.until = time.monotonic()
+
+    def wait(self, size, operations=1):
+        """Sleep until `size` bytes in `operations` reads or writes, just
+        done, fit within the limits
+        """
+
+        cost = 0
+        if self.rate:
+            cost = size / self.rate
+        if self.iops:
+            cost = max(cost, operations / self.iops)
+        with self.lock:
+            now = time.monotonic()
+            self.until = max(self.until, now) + cost
+            delay = self.until - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_rate(rate):
+    """Return bytes per second from `rate`, such as "20M" or "512k", or
+    None if it is not valid
+    """
+
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*',
+                         str(rate), re.IGNORECASE)
+    if match is None:
+        return None
+    return float(match.group(1)) * UNITS[match.group(2).lower()]
+
+
+def set_idle_priority():
+    """Run this thread, and threads it starts, only when the CPU and disk
+    are otherwise idle, until the process exits
+    """
+
+    if hasattr(os, 'setpriority'):
+        os.setpriority(os.PRIO_PROCESS, 0, 19)
+    number = IOPRIO_SET.get(platform.machine())
+    if not sys.platform.startswith('linux') or number is None:
+        logging.debug('Idle I/O priority not supported here')
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0,
+                    IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        logging.debug('ioprio_set failed (%s)',
+                      os.strerror(ctypes.get_errno()))
+
+
+def setup():
+    """Apply `max_rate`, `max_iops`, and `idle` for this run
+
+    Called by `backup_or_restore`
+    """
+
+    ftconfig.throttle = None
+    (max_rate, max_iops) = (get_option('max_rate'), get_option('max_iops'))
+    rate = None
+    if max_rate:
+        rate = parse_rate(max_rate)
+        if not rate:
+            cprint.error('ERROR: "max_rate" must be bytes per second, such as '
+                         + '"20M".')
+            sys.exit(1)
+    if max_iops:
+        try:
+            max_iops = float(max_iops)
+        except ValueError:
+            max_iops = 0
+        if max_iops <= 0:
+            cprint.error('ERROR: "max_iops" must be a positive number.')
+            sys.exit(1)
+    if rate or max_iops:
+        ftconfig.throttle = Throttle(rate, max_iops)
+    if get_option('idle'):
+        set_idle_priority()
+
+
+def wait(size, operations=1):
+    """Count `size` bytes just read or written against the limits of this
+    run, if any
+
+    Called by `fast_copy`, `compare_files`, `hash_file`, `read_file`,
+    `tailor_lines`, and `write_bytes`
+    """
+
+    if ftconfig.throttle is not None:
+        ftconfig.throttle.wait(size, operations)
+
+
+def is_throttled():
+    """Return True if I/O of this run is limited"""
+    return ftconfig.throttle is not None
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Run status, backup, and restore from Python instead of the command line
+
+Example:
+```python
+from filetailor import Session
+
+session = Session()
+for result in session.status('laptop'):
+    print(result['file_id'], result['status'])
+```
+
+Each call runs with its own copy of the settings, so sessions can be used
+from several threads at once, including for different devices.
+"""
+
+import argparse
+import os
+
+import filetailor.config as ftconfig
+import filetailor.core.store
+import filetailor.core.sync
+import filetailor.helpers.load_yaml
+import filetailor.helpers.runs
+from filetailor.helpers import load_ini_files
+from filetailor.helpers.get_device_id import main as get_device_id
+from filetailor.helpers.get_hostname import main as get_hostname
+
+
+class SessionError(Exception):
+    """filetailor stopped before finishing, such as for invalid YAML"""
+
+
+class Session():
+    """Loaded "filetailor.ini" and YAML to run operations with
+
+    `filetailor_ini` defaults to the same file the command line uses. Output
+    is printed unless `quiet`; prompts are always answered yes.
+    """
+
+    def __init__(self, filetailor_ini=None, quiet=True):
+        self.quiet = quiet
+        self.state = ftconfig.State(**ftconfig.get_defaults())
+        self.run(self.state, self.load, filetailor_ini)
+
+    @staticmethod
+    def run(state, function, *args):
+        """Call `function` with `state` as the settings of this thread"""
+
+        token = ftconfig.current_state.set(state)
+        try:
+            return function(*args)
+        except SystemExit as error:
+            raise SessionError(
+                f'filetailor exited with status {error.code}') from error
+        finally:
+            ftconfig.current_state.reset(token)
+
+    def load(self, filetailor_ini):
+        """Read "filetailor.ini" and YAML into `self.state`"""
+
+        ftconfig.data = os.path.join(os.path.dirname(__file__), 'data')
+        ftconfig.args = argparse.Namespace(quiet=self.quiet, assumeyes=True)
+        if filetailor_ini is None:
+            config_ini = load_ini_files.load_config_ini()
+            ftconfig.override_filetailor_ini_path = config_ini['DEFAULT'].get(
+                'override_filetailor_ini_path', '')
+            filetailor_ini = load_ini_files.find_filetailor_ini()
+        else:
+            ftconfig.filetailor_ini_path = filetailor_ini
+        if not os.path.isfile(filetailor_ini):
+            raise SessionError(
+                f'"filetailor.ini" not found at "{filetailor_ini}".')
+
+        filetailor_ini = load_ini_files.read_filetailor_ini(filetailor_ini)
+        ftconfig.paths = filetailor_ini['PATHS']
+        ftconfig.tools = filetailor_ini['TOOLS']
+        if 'SNAPSHOTS' in filetailor_ini:
+            ftconfig.snapshots = filetailor_ini['SNAPSHOTS']
+        if 'STORE' in filetailor_ini:
+            ftconfig.store = filetailor_ini['STORE']
+        (ftconfig.yaml_default, ftconfig.yaml_devices,
+            ftconfig.yaml_files) = filetailor.helpers.load_yaml.main(
+                ftconfig.paths)
+
+    def sync(self, operation, device=None, files=None, **options):
+        """Run `operation` for `device` (device_id or hostname, defaulting to
+        this machine's hostname); return a dictionary for each file with its
+        status and the paths within it that differ
+
+        `options` are the command line options, such as `dry_run=True`
+        """
+
+        state = ftconfig.State(**vars(self.state))
+        state.results = []
+        state.snapshot_run_id = None
+        state.snapshot_saved = set()
+        state.in_progress_dir = None
+        state.in_progress_lock = None
+        state.sync_dir_lock = None
+        state.sync_store = None
+        state.sync_path = None
+        state.journal = None
+        state.journal_entries = {}
+        state.manifest_updates = {}
+        state.throttle = None
+        state.lstat_cache = {}
+        state.stat_cache = {}
+        state.templates = {}
+        state.sync = operation
+        # Lowered priority could never be raised back without root, so
+        # `idle` would slow the calling program for good
+        if options.get('idle'):
+            raise SessionError('"idle" is only available from the command '
+                               + 'line.')
+        state.args = argparse.Namespace(
+            FILES=list(files or []), device=device or get_hostname(),
+            quiet=self.quiet, assumeyes=True, no_diff=True, dry_run=False,
+            sudo=False, staging=None, idle=False)
+        for (key, value) in options.items():
+            setattr(state.args, key, value)
+        state.device_id = get_device_id(state.yaml_devices, state.args.device)
+
+        function = {
+            filetailor.core.sync.STATUS: filetailor.core.sync.status,
+            filetailor.core.sync.BACKUP: filetailor.core.sync.backup,
+            filetailor.core.sync.RESTORE: filetailor.core.sync.restore,
+        }[operation]
+        self.run(state, self.call, function)
+
+        return state.results
+
+    @staticmethod
+    def call(function):
+        """Call `function`, holding the lock on sync_dir if it changes files
+        and removing files of the run afterwards
+        """
+
+        try:
+            if (ftconfig.sync != filetailor.core.sync.STATUS
+                    and not ftconfig.args.dry_run):
+                filetailor.helpers.runs.lock_sync_dir()
+            function()
+        finally:
+            filetailor.core.store.close()
+            filetailor.helpers.runs.finish()
+
+    def status(self, device=None, files=None, **options):
+        """Compare local files with sync_dir without changing either"""
+        return self.sync(filetailor.core.sync.STATUS, device, files, **options)
+
+    def backup(self, device=None, files=None, **options):
+        """Copy files from the local machine to sync_dir"""
+        return self.sync(filetailor.core.sync.BACKUP, device, files, **options)
+
+    def restore(self, device=None, files=None, **options):
+        """Copy files from sync_dir to the local machine"""
+        return self.sync(filetailor.core.sync.RESTORE, device, files,
+                         **options)
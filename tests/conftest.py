@@ -0,0 +1,81 @@
+"""Fixtures running filetailor against a sync directory, YAML, and local
+files in a temporary directory
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def sandbox(tmp_path, monkeypatch):
+    """Return paths of a configured filetailor with a file "rc" and a
+    directory "dir" tracked for devices "dev1" and "dev2"
+    """
+
+    home = tmp_path / 'home'
+    sync_dir = tmp_path / 'data' / 'filetailor' / 'sync'
+    config_dir = tmp_path / 'config' / 'filetailor'
+    cache_dir = tmp_path / 'cache' / 'filetailor'
+    for path in [home / 'dir', sync_dir, config_dir, cache_dir]:
+        path.mkdir(parents=True)
+
+    yaml_path = tmp_path / 'data' / 'filetailor' / 'filetailor.yaml'
+    yaml_path.write_text(f'''\
+default:
+  vars:
+    MYHOME: {home}
+device dev1:
+device dev2:
+  vars:
+    MYHOME: /home/dev2
+file rc:
+  path: {home}/.rc
+file dir:
+  path: {home}/dir
+''', encoding='UTF-8')
+    ini_path = config_dir / 'filetailor.ini'
+    ini_path.write_text(f'''\
+[PATHS]
+sync_dir = {sync_dir}
+yaml = {yaml_path}
+in-progress_dir = {cache_dir}
+
+[TOOLS]
+diff_pager = None
+difftool = None
+''', encoding='UTF-8')
+
+    (home / '.rc').write_text(f"home='{home}' #{{filetailor dev1}}\n",
+                              encoding='UTF-8')
+    (home / 'dir' / 'a.txt').write_text('a\n', encoding='UTF-8')
+    (home / 'dir' / 'b.txt').write_text('b\n', encoding='UTF-8')
+
+    env = {'XDG_CONFIG_HOME': str(tmp_path / 'config'),
+           'XDG_CACHE_HOME': str(tmp_path / 'cache'),
+           'XDG_DATA_HOME': str(tmp_path / 'data')}
+    for (key, value) in env.items():
+        monkeypatch.setenv(key, value)
+
+    def run(*args, stdin='', extra_env=None):
+        """Run the command line with `args`; return the completed process"""
+        return subprocess.run(
+            [sys.executable, '-m', 'filetailor', *args], cwd=tmp_path,
+            env={**os.environ, **env, 'PYTHONPATH': str(ROOT),
+                 **(extra_env or {})},
+            input=stdin, capture_output=True, text=True, check=False)
+
+    def set_store(backend):
+        """Select the store `backend` in "filetailor.ini\""""
+        with open(ini_path, 'a', encoding='UTF-8') as ini_file:
+            ini_file.write(f'\n[STORE]\nbackend = {backend}\n')
+
+    return SimpleNamespace(root=tmp_path, home=home, sync_dir=sync_dir,
+                           yaml_path=yaml_path, ini_path=ini_path, run=run,
+                           set_store=set_store)
@@ -0,0 +1,26 @@
+"""Tests of writing files tailored for a device to a tar archive"""
+
+import os
+import tarfile
+import time
+
+
+def test_export_is_reproducible(sandbox):
+    assert sandbox.run('backup', '-d', 'dev1', '-y').returncode == 0
+    runs_dir = sandbox.root / 'cache' / 'filetailor' / 'runs'
+    before = sorted(os.listdir(runs_dir)) if runs_dir.exists() else []
+
+    archives = []
+    for name in ['first.tar.gz', 'second.tar.gz']:
+        result = sandbox.run('export', '-d', 'dev2', '--format', 'tar.gz',
+                             '-o', str(sandbox.root / name))
+        assert result.returncode == 0, result.stderr
+        archives.append((sandbox.root / name).read_bytes())
+        time.sleep(1.1)
+    assert archives[0] == archives[1]
+
+    after = sorted(os.listdir(runs_dir)) if runs_dir.exists() else []
+    assert after == before
+    with tarfile.open(sandbox.root / 'first.tar.gz') as archive:
+        member = archive.getmember(str(sandbox.home / '.rc').lstrip('/'))
+    assert member.mtime == int(os.lstat(sandbox.sync_dir / 'rc').st_mtime)
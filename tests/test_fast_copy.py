@@ -0,0 +1,49 @@
+"""Tests of copying files with `filetailor.helpers.fast_copy`"""
+
+import os
+
+from filetailor.helpers.fast_copy import copy_verified
+from filetailor.helpers.hash_file import hash_bytes
+
+
+def test_copy_verified(tmp_path):
+    (src, dst) = (tmp_path / 'src', tmp_path / 'dst')
+    src.write_bytes(b'new\n')
+    dst.write_bytes(b'old\n')
+
+    expected = hash_bytes(b'new\n')
+    assert copy_verified(src, dst, expected) == expected
+    assert dst.read_bytes() == b'new\n'
+    assert sorted(os.listdir(tmp_path)) == ['dst', 'src']
+
+
+def test_copy_verified_mismatch_keeps_target(tmp_path):
+    (src, dst) = (tmp_path / 'src', tmp_path / 'dst')
+    src.write_bytes(b'changed after tailoring\n')
+    dst.write_bytes(b'old\n')
+
+    assert copy_verified(src, dst, hash_bytes(b'new\n')) is None
+    assert dst.read_bytes() == b'old\n'
+    assert sorted(os.listdir(tmp_path)) == ['dst', 'src']
+
+
+def test_copy_verified_sparse(tmp_path):
+    (src, dst) = (tmp_path / 'src', tmp_path / 'dst')
+    with open(src, 'wb') as src_file:
+        src_file.seek(3 * 1024 * 1024)
+        src_file.write(b'data')
+        src_file.truncate(5 * 1024 * 1024)
+    expected = hash_bytes(src.read_bytes())
+
+    assert copy_verified(src, dst, expected) == expected
+    assert hash_bytes(dst.read_bytes()) == expected
+
+
+def test_copy_verified_keeps_hard_links(tmp_path):
+    (src, dst, link) = (tmp_path / 'src', tmp_path / 'dst', tmp_path / 'link')
+    src.write_bytes(b'new\n')
+    dst.write_bytes(b'old\n')
+    os.link(dst, link)
+
+    assert copy_verified(src, dst, hash_bytes(b'new\n')) is not None
+    assert link.read_bytes() == b'new\n'
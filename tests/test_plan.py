@@ -0,0 +1,42 @@
+"""Tests of planning a restore and applying the plan"""
+
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('backend', ['directory', 'sqlite'])
+def test_apply_plan(sandbox, backend):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    if backend == 'sqlite':
+        sandbox.set_store(backend)
+        sandbox.run('migrate', '-y')
+    (sandbox.home / 'dir' / 'a.txt').write_text('changed\n')
+    (sandbox.home / '.rc').unlink()
+    plan_path = sandbox.root / 'plan.json'
+
+    result = sandbox.run('plan', '-d', 'dev1', '-o', str(plan_path), '-y')
+    assert result.returncode == 0, result.stdout + result.stderr
+    entries = [action['entry'] for action
+               in json.loads(plan_path.read_text())['actions']
+               if action['op'] == 'copy']
+    assert sorted(entries) == [['dir', 'a.txt'], ['rc', '']]
+
+    result = sandbox.run('apply', str(plan_path), '-y')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'Refusing' not in result.stdout
+    assert (sandbox.home / 'dir' / 'a.txt').read_text() == 'a\n'
+    assert (sandbox.home / '.rc').exists()
+
+
+def test_apply_refuses_changed_source(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    (sandbox.home / 'dir' / 'a.txt').write_text('changed\n')
+    plan_path = sandbox.root / 'plan.json'
+    sandbox.run('plan', '-d', 'dev1', '-o', str(plan_path), '-y')
+    (sandbox.sync_dir / 'dir' / 'a.txt').write_text('newer\n')
+
+    result = sandbox.run('apply', str(plan_path), '-y')
+
+    assert 'source changed since planning' in result.stdout
+    assert (sandbox.home / 'dir' / 'a.txt').read_text() == 'changed\n'
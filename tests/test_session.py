@@ -0,0 +1,29 @@
+"""Tests of running filetailor from Python with `Session`"""
+
+import os
+
+import pytest
+
+from filetailor import Session
+from filetailor.session import SessionError
+
+
+def test_idle_keeps_priority(sandbox):
+    """`idle` in the YAML must not lower the priority of the caller, and
+    asking for it is refused
+    """
+
+    text = sandbox.yaml_path.read_text(encoding='UTF-8')
+    sandbox.yaml_path.write_text(
+        text.replace('default:\n', 'default:\n  idle: true\n'),
+        encoding='UTF-8')
+    session = Session(str(sandbox.ini_path))
+    priority = os.getpriority(os.PRIO_PROCESS, 0)
+
+    results = session.status('dev1')
+    assert {result['file_id'] for result in results} == {'rc', 'dir'}
+    assert os.getpriority(os.PRIO_PROCESS, 0) == priority
+
+    with pytest.raises(SessionError):
+        session.status('dev1', idle=True)
+    assert os.getpriority(os.PRIO_PROCESS, 0) == priority
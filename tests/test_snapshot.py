@@ -0,0 +1,25 @@
+"""Tests of saving local files before restore and rolling back"""
+
+import os
+
+
+def test_sudo_restore_saves_snapshot_with_sudo(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    (sandbox.home / '.rc').write_text('changed\n')
+    # Stands in for sudo, logging each command it runs
+    bin_dir = sandbox.root / 'bin'
+    bin_dir.mkdir()
+    log = sandbox.root / 'sudo.log'
+    (bin_dir / 'sudo').write_text(
+        f'#!/bin/sh\necho "$@" >> {log}\nexec "$@"\n')
+    (bin_dir / 'sudo').chmod(0o755)
+    path = f'{bin_dir}{os.pathsep}{os.environ["PATH"]}'
+
+    result = sandbox.run('restore', 'rc', '-d', 'dev1', '-y', '--sudo',
+                         extra_env={'PATH': path})
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert f'cat -- {sandbox.home}/.rc' in log.read_text()
+    run_id = result.stdout.split('filetailor rollback ')[1].split('"')[0]
+    sandbox.run('rollback', run_id, '-y')
+    assert (sandbox.home / '.rc').read_text() == 'changed\n'
@@ -0,0 +1,60 @@
+"""Tests of the SQLite store and moving sync_dir into it"""
+
+import os
+
+
+def test_status_does_not_migrate(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    sandbox.set_store('sqlite')
+
+    result = sandbox.run('status', '-d', 'dev1')
+
+    assert result.returncode == 1
+    assert 'filetailor migrate' in result.stdout
+    assert sorted(os.listdir(sandbox.sync_dir)) == ['dir', 'rc']
+
+
+def test_migrate_keeps_files_until_confirmed(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    sandbox.set_store('sqlite')
+
+    sandbox.run('migrate', stdin='n\n')
+    assert sorted(os.listdir(sandbox.sync_dir)) == [
+        'dir', 'filetailor.sqlite3', 'rc']
+    assert 'Status check complete' in sandbox.run(
+        'status', '-d', 'dev1').stdout
+
+    sandbox.run('migrate', stdin='y\n')
+    assert os.listdir(sandbox.sync_dir) == ['filetailor.sqlite3']
+    (sandbox.home / 'dir' / 'a.txt').unlink()
+    sandbox.run('restore', '-d', 'dev1', '-y', '-q')
+    assert (sandbox.home / 'dir' / 'a.txt').read_text() == 'a\n'
+
+
+def test_hidden_entries_are_not_stored_files(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    (sandbox.sync_dir / '.git').mkdir()
+    (sandbox.sync_dir / '.git' / 'HEAD').write_text('ref: refs/heads/main\n')
+
+    fsck = sandbox.run('fsck', '-y')
+    clean = sandbox.run('clean', '-y', '--dry-run')
+
+    assert fsck.returncode == 0, fsck.stdout + fsck.stderr
+    assert '.git' not in fsck.stdout
+    assert 'No untracked files found' in clean.stdout
+
+
+def test_render_mirrors_only_yaml_files(sandbox):
+    with open(sandbox.ini_path, 'a', encoding='UTF-8') as ini_file:
+        ini_file.write('\n[STORE]\nlocal_cache = yes\n')
+    assert sandbox.run('backup', '-d', 'dev1', '-y').returncode == 0
+    (sandbox.sync_dir / '.git').mkdir()
+    (sandbox.sync_dir / '.git' / 'HEAD').write_text('ref\n')
+    (sandbox.sync_dir / 'old').write_text('old\n')
+
+    result = sandbox.run('render', '--out', str(sandbox.root / 'out'))
+    assert result.returncode == 0, result.stderr
+    rendered = sandbox.root / 'out' / 'dev2' / 'rc' / '.rc'
+    assert "home='/home/dev2'" in rendered.read_text()
+    mirror = next((sandbox.root / 'cache' / 'filetailor' / 'mirror').iterdir())
+    assert sorted(path.name for path in mirror.iterdir()) == ['dir', 'rc']
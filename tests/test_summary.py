@@ -0,0 +1,39 @@
+"""Tests of the status summary shown by `status --cached`"""
+
+import fcntl
+import os
+import subprocess
+
+import filetailor.core.summary
+
+
+def test_refresh_skips_scripts(sandbox):
+    ran = sandbox.root / 'ran'
+    yaml = sandbox.yaml_path.read_text()
+    sandbox.yaml_path.write_text(yaml.replace(
+        'file rc:\n',
+        f'file rc:\n  scripts:\n    before_backup: touch {ran}\n'))
+
+    sandbox.run('status', '-d', 'dev1', '-q', '-y', '--no-scripts')
+    assert not ran.exists()
+    sandbox.run('status', '-d', 'dev1', '-q', '-y')
+    assert ran.exists()
+
+
+def test_refreshes_do_not_overlap(sandbox, monkeypatch):
+    started = []
+    monkeypatch.setattr(subprocess, 'Popen',
+                        lambda args, **kwargs: started.append(args))
+    marker = f'{filetailor.core.summary.get_summary_path()}.refresh'
+
+    filetailor.core.summary.refresh('dev1')
+    assert '--no-scripts' in started[0]
+
+    # Held by a refresh still running
+    fd = os.open(marker, os.O_RDONLY)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        filetailor.core.summary.refresh('dev1')
+    finally:
+        os.close(fd)
+    assert len(started) == 1
@@ -0,0 +1,52 @@
+"""Tests of backup and restore"""
+
+import filetailor
+
+
+def test_dry_run_directory(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    (sandbox.home / 'dir' / 'a.txt').write_text('changed\n')
+
+    for command in ['backup', 'restore']:
+        result = sandbox.run(command, '-d', 'dev1', '-y', '--dry-run')
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert 'Traceback' not in result.stderr
+
+    session = filetailor.Session(filetailor_ini=sandbox.ini_path, quiet=True)
+    session.restore('dev1', ['dir'], dry_run=True)
+    assert (sandbox.home / 'dir' / 'a.txt').read_text() == 'changed\n'
+    assert (sandbox.sync_dir / 'dir' / 'a.txt').read_text() == 'a\n'
+
+
+def test_scripts_run_before_later_files_are_read(sandbox):
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    yaml = sandbox.yaml_path.read_text()
+    sandbox.yaml_path.write_text(yaml.replace(
+        'file rc:\n', 'file rc:\n  scripts:\n    before_backup: '
+        f'echo scripted > {sandbox.home}/dir/a.txt\n'))
+
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+
+    assert (sandbox.sync_dir / 'dir' / 'a.txt').read_text() == 'scripted\n'
+
+
+def test_restore_keeps_private_modes(sandbox):
+    (sandbox.home / '.rc').chmod(0o644)
+    (sandbox.home / 'dir' / 'a.txt').chmod(0o755)
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    (sandbox.home / '.rc').chmod(0o600)
+    (sandbox.home / 'dir' / 'a.txt').chmod(0o600)
+
+    sandbox.run('restore', '-d', 'dev1', '-y', '-q')
+
+    assert (sandbox.home / '.rc').stat().st_mode & 0o777 == 0o600
+    # Only made executable
+    assert (sandbox.home / 'dir' / 'a.txt').stat().st_mode & 0o777 == 0o700
+
+    sandbox.run('restore', '-d', 'dev1', '-y', '-q')
+    assert (sandbox.home / '.rc').stat().st_mode & 0o777 == 0o600
+    sandbox.yaml_path.write_text(
+        sandbox.yaml_path.read_text().replace(
+            'file rc:\n', 'file rc:\n  preserve_mode: true\n'))
+    sandbox.run('restore', '-d', 'dev1', '-y', '-q')
+    assert (sandbox.home / '.rc').stat().st_mode & 0o777 == 0o644
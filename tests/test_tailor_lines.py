@@ -0,0 +1,36 @@
+"""Tests of tailoring lines and caching compiled templates"""
+
+import stat
+
+
+def test_templates_keep_no_contents(sandbox):
+    rc_text = (f"home='{sandbox.home}' #{{filetailor dev1}}\n"
+               'token=hunter2\n'
+               '#{begin filetailor dev1}\n'
+               f'cd {sandbox.home}/dir\n'
+               '#{end filetailor dev1}\n')
+    (sandbox.home / '.rc').write_text(rc_text)
+
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    assert (sandbox.sync_dir / 'rc').read_text() == (
+        "# home='MYHOME' #{filetailor dev1}\n"
+        'token=hunter2\n'
+        '#{begin filetailor dev1}\n'
+        '# cd MYHOME/dir\n'
+        '#{end filetailor dev1}\n')
+    (sandbox.home / '.rc').unlink()
+    sandbox.run('restore', '-d', 'dev1', '-y', '-q')
+    assert (sandbox.home / '.rc').read_text() == rc_text
+    # Tailored again from the cached template
+    synced = (sandbox.sync_dir / 'rc').read_text()
+    sandbox.run('backup', '-d', 'dev1', '-y', '-q')
+    assert (sandbox.sync_dir / 'rc').read_text() == synced
+
+    # Only "rc" has anything to tailor, once for each direction
+    templates = list((sandbox.root / 'cache' / 'filetailor' / 'cache'
+                      / 'templates').iterdir())
+    assert len(templates) == 2
+    for template in templates:
+        assert stat.S_IMODE(template.stat().st_mode) == 0o600
+        assert 'hunter2' not in template.read_text()
+        assert 'home=' not in template.read_text()